@@ -1,11 +1,17 @@
 import os
+import argparse
 import google.generativeai as genai
 import pandas as pd
 from dotenv import load_dotenv
 import time
+from llm_cache import add_cache_arguments, configure_from_args, llm_cache
 
 load_dotenv()
 
+parser = argparse.ArgumentParser(description='依題庫歸納各小節的知識點')
+add_cache_arguments(parser)
+configure_from_args(parser.parse_args())
+
 # 獲取環境變數
 api_key = os.getenv("GEMINI_API_KEY")
 
@@ -13,7 +19,8 @@ api_key = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=api_key)
 
 # 初始化 Gemini 客戶端
-model = genai.GenerativeModel('gemini-2.5-flash')
+model_name = 'gemini-2.5-flash'
+model = genai.GenerativeModel(model_name)
 
 # 定義檔案路徑
 sections_path = "processing/high_chem_chapter_list.csv"
@@ -56,9 +63,10 @@ for index, section_row in sections_df.iterrows():
         # 組合完整的 prompt
         prompt = f"{system_message}\n\n{questions_text}"
         
-        response = model.generate_content(prompt)
-        
-        knowledge_points = response.text.strip()
+        knowledge_points = llm_cache.call(
+            "gemini", model_name, prompt, {},
+            lambda: model.generate_content(prompt).text,
+        ).strip()
         print(f"成功生成知識點：{knowledge_points}")
         
         # 將結果加入新的 row
@@ -73,11 +81,13 @@ for index, section_row in sections_df.iterrows():
         print(f"為 '{section_name}' 生成知識點時發生錯誤: {e}")
         # 如果需要，可以在這裡加入錯誤處理邏輯，例如重試
     
-    # 為了避免觸發API頻率限制，可以加入短暫延遲
-    time.sleep(1)
+    # 為了避免觸發API頻率限制，可以加入短暫延遲（快取命中時不需要）
+    if not llm_cache.cache_only:
+        time.sleep(1)
 
 # 將最終結果儲存到CSV檔案
 output_df.to_csv(output_path, index=False, encoding='utf-8-sig')
 
 print(f"\n處理完成！知識點已成功存入 {output_path}")
+print(f"LLM 快取: {llm_cache.snapshot()}")
 
@@ -1,21 +1,50 @@
 import csv
 import os
 import json
-import time
 import pymysql
 import argparse
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import aiplatform
 from google.auth import exceptions
 from openai import OpenAI
-from typing import List, Dict, Any, Tuple
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 from vertexai.generative_models import GenerativeModel
 import vertexai
+from rate_limiter import ThroughputMeter, limiter_from_env
+from llm_cache import add_cache_arguments, configure_from_args, llm_cache
+from question_writer import QuestionBankWriter, SectionBuffer
+from near_duplicates import NearDuplicateIndex, fetch_bank_questions, question_fingerprint
+from reference_store import ReferenceStore
 
 # 加載 .env 文件
 load_dotenv()
 
+# 各供應商的限流器（可用 GEMINI_RPM / OPENAI_RPM / DEEPSEEK_RPM 與 *_MAX_CONCURRENCY 調整）
+LIMITERS = {
+    "gemini": limiter_from_env("gemini", 300, 16),
+    "openai": limiter_from_env("openai", 500, 16),
+    "deepseek": limiter_from_env("deepseek", 120, 8),
+}
+
+# 整個執行過程的處理速度統計
+throughput = ThroughputMeter()
+
+# 驗證與解釋等單次 LLM 呼叫用的執行緒池（與題目執行緒池分開，題目等待驗證結果時才不會互卡）
+llm_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_CALL_WORKERS", "64")))
+# 第一個驗證結果為「答案正確」時就先生成解釋（三個模型都認為答案正確時省下一輪等待；
+# 其餘模型推翻時已送出的解釋無法中止，多花一次解釋的費用）
+SPECULATIVE_EXPLANATION = os.getenv("SPECULATIVE_EXPLANATION", "1") == "1"
+# 生成回覆無法解析時的最多嘗試次數（重試時略過快取重新呼叫）
+GENERATION_MAX_ATTEMPTS = int(os.getenv("GENERATION_MAX_ATTEMPTS", "3"))
+
+# 參考題目索引（main 中建立，處理小節時才載入該小節知識點的參考題目）
+reference_store: Optional[ReferenceStore] = None
+
+# 近似重複題目索引（main 中依 --dedup-threshold 建立；None 表示不檢查）
+duplicate_index: Optional[NearDuplicateIndex] = None
+
 # 初始化 AI 客戶端
 openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 # 初始化 DeepSeek 客戶端
@@ -37,6 +66,34 @@ gemini_client = OpenAI(
     base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
 )
 
+LLM_CLIENTS = {
+    "gemini": gemini_client,
+    "openai": openai_client,
+    "deepseek": deepseek_client,
+}
+
+def chat_completion_text(
+    provider: str,
+    model: str,
+    messages: List[Dict[str, str]],
+    refresh: bool = False,
+    validate: Optional[Callable[[str], bool]] = None,
+    **params,
+) -> Optional[str]:
+    """
+    經由 LLM 快取與供應商限流器呼叫 chat completions，回傳原始文字內容
+
+    refresh 與 validate 直接交給 llm_cache.call：validate 不通過的回覆不會寫入快取。
+    """
+    return llm_cache.call(
+        provider, model, messages, params,
+        lambda: LIMITERS[provider].call(
+            LLM_CLIENTS[provider].chat.completions.create, model=model, messages=messages, **params
+        ).choices[0].message.content,
+        refresh=refresh,
+        validate=validate,
+    )
+
 def validate_env_vars():
     """驗證必要的環境變量"""
     required_vars = [
@@ -118,99 +175,66 @@ def read_csv_data(csv_file_path: str) -> List[Dict[str, Any]]:
         print(f"讀取 CSV 文件時出錯: {e}")
         return []
 
-def load_reference_questions(sections_data: List[Dict[str, Any]], csv_file_path: str = "processing/question_knowledge_point_matching_results.csv") -> Dict[str, List[Dict[str, Any]]]:
-    """從 question_knowledge_point_matching_results.csv 讀取參考題目，按知識點分組"""
-    reference_questions = {}
-    
-    # 先從 sections_data 收集所有知識點
-    all_knowledge_points = set()
-    for section in sections_data:
-        for kp in section['knowledge_points']:
-            all_knowledge_points.add(kp)
+def generate_questions_with_reference(knowledge_points: List[str], section_data: Dict[str, Any], reference_questions: Dict[str, List[Dict[str, Any]]], executor: ThreadPoolExecutor, batch_size: int = 2) -> Dict[str, List[Dict[str, Any]]]:
+    """使用 Gemini 2.5 Flash 參考現有題目為每個知識點生成題目，分批處理知識點（各批次並行）"""
+    all_questions = {}
+    batches = [knowledge_points[i:i+batch_size] for i in range(0, len(knowledge_points), batch_size)]
+    futures = [
+        executor.submit(generate_question_batch, batch_index, len(batches), batch_points, section_data, reference_questions)
+        for batch_index, batch_points in enumerate(batches, 1)
+    ]
+    for future in futures:
+        for question in future.result():
+            knowledge_point = question.get("knowledge_point", "")
+            
+            # 確保知識點存在於字典中
+            if knowledge_point not in all_questions:
+                all_questions[knowledge_point] = []
+            
+            # 添加題目
+            all_questions[knowledge_point].append({
+                "question": question.get("question", ""),
+                "options": question.get("options", []),
+                "answer": question.get("answer", "")
+            })
     
-    print(f"收集到 {len(all_knowledge_points)} 個知識點")
-    print(f"知識點列表: {list(all_knowledge_points)[:10]}...")  # 只顯示前10個
+    # 打印生成的題目數量
+    total_questions = sum(len(questions) for questions in all_questions.values())
+    print(f"[生成題目] 總共為 {len(all_questions)} 個知識點生成了 {total_questions} 個題目")
     
+    return all_questions
+
+def parse_question_batch(content: Optional[str]) -> List[Dict[str, Any]]:
+    """解析生成回覆中的題目清單；格式不符時拋出 ValueError"""
+    result = json.loads(content or "")
+    questions = result.get("questions") if isinstance(result, dict) else None
+    if not isinstance(questions, list):
+        raise ValueError("回覆中沒有 questions 清單")
+    return questions
+
+def is_valid_question_batch(content: str) -> bool:
     try:
-        print(f"開始讀取參考題目文件: {csv_file_path}")
-        
-        # 檢查文件是否存在
-        if not os.path.exists(csv_file_path):
-            print(f"錯誤：參考題目文件不存在: {csv_file_path}")
-            return {}
-            
-        with open(csv_file_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            print(f"CSV 列名: {reader.fieldnames}")
-            
-            row_count = 0
-            matched_count = 0
-            
-            for row in reader:
-                try:
-                    row_count += 1
-                    if row_count % 1000 == 0:
-                        print(f"已處理 {row_count} 行...")
-                    
-                    # 檢查必要的欄位是否存在
-                    required_fields = ['matched_knowledge_point', 'question_text']
-                    missing_fields = [field for field in required_fields if field not in row or not row[field]]
-                    if missing_fields:
-                        continue
-                    
-                    # 檢查這個題目的知識點是否在我們的知識點列表中
-                    matched_kp = row['matched_knowledge_point'].strip()
-                    if matched_kp in all_knowledge_points:
-                        matched_count += 1
-                        
-                        if matched_kp not in reference_questions:
-                            reference_questions[matched_kp] = []
-                        
-                        reference_questions[matched_kp].append({
-                            "subject": row.get('subject', ''),
-                            "chapter_name": row.get('chapter_name', ''),
-                            "section_name": row.get('section_name', ''),
-                            "question_text": row['question_text']
-                        })
-                        
-                except Exception as row_error:
-                    print(f"處理第 {row_count} 行時出錯: {row_error}")
-                    continue
-        
-        print(f"成功載入 {len(reference_questions)} 個知識點的參考題目")
-        print(f"總共處理了 {row_count} 行，其中 {matched_count} 行成功匹配")
-        for kp, questions in reference_questions.items():
-            print(f"  - {kp}: {len(questions)} 題")
-        
-        return reference_questions
-        
-    except Exception as e:
-        print(f"載入參考題目時出錯: {e}")
-        import traceback
-        traceback.print_exc()
-        return {}
+        parse_question_batch(content)
+        return True
+    except ValueError:
+        return False
 
-def generate_questions_with_reference(knowledge_points: List[str], section_data: Dict[str, Any], reference_questions: Dict[str, List[Dict[str, Any]]], batch_size: int = 2) -> Dict[str, List[Dict[str, Any]]]:
-    """使用 Gemini 2.5 Flash 參考現有題目為每個知識點生成題目，分批處理知識點"""
-    all_questions = {}
+def generate_question_batch(batch_index: int, batch_count: int, batch_points: List[str], section_data: Dict[str, Any], reference_questions: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """為一批知識點生成題目，回傳模型輸出的題目清單（失敗時為空清單）"""
+    print(f"[生成題目] 處理知識點批次 {batch_index}/{batch_count}: {', '.join(batch_points)}")
     
-    # 將知識點分成小批次
-    for i in range(0, len(knowledge_points), batch_size):
-        batch_points = knowledge_points[i:i+batch_size]
-        print(f"[生成題目] 處理知識點批次 {i//batch_size + 1}/{(len(knowledge_points) + batch_size - 1)//batch_size}: {', '.join(batch_points)}")
-        
-        # 為每個知識點收集參考題目
-        reference_text = ""
-        for point in batch_points:
-            if point in reference_questions:
-                reference_text += f"\n\n【知識點：{point} 的參考題目】\n"
-                for j, ref_q in enumerate(reference_questions[point], 1):  # 使用所有參考題目
-                    reference_text += f"{j}. {ref_q['question_text']}\n"
-            else:
-                reference_text += f"\n\n【知識點：{point}】\n（沒有找到相關的參考題目，請根據知識點名稱和小節描述生成適當的題目）\n"
-        
-        # 構建提示
-        prompt = f"""
+    # 為每個知識點收集參考題目
+    reference_text = ""
+    for point in batch_points:
+        if point in reference_questions:
+            reference_text += f"\n\n【知識點：{point} 的參考題目】\n"
+            for j, ref_q in enumerate(reference_questions[point], 1):  # 已由 ReferenceStore 挑選出有上限的多樣子集
+                reference_text += f"{j}. {ref_q['question_text']}\n"
+        else:
+            reference_text += f"\n\n【知識點：{point}】\n（沒有找到相關的參考題目，請根據知識點名稱和小節描述生成適當的題目）\n"
+    
+    # 構建提示
+    prompt = f"""
 你是一個專業的臺灣教育內容生成器。我需要你參考現有題目為以下教育內容生成選擇題：
 
 年級: {section_data['year_grade']}
@@ -259,48 +283,36 @@ def generate_questions_with_reference(knowledge_points: List[str], section_data:
 請確保 JSON 格式正確，可以被直接解析。
 """
 
-        try:
-            print(f"[生成題目] 調用 Gemini 2.5 Flash API")
-            
-            # 使用 Gemini 2.5 Flash 生成題目
-            response = gemini_client.chat.completions.create(
+    try:
+        print(f"[生成題目] 調用 Gemini 2.5 Flash API")
+        
+        for attempt in range(GENERATION_MAX_ATTEMPTS):
+            # 使用 Gemini 2.5 Flash 生成題目；無法解析的回覆不寫入快取，重試時略過快取重新呼叫
+            content = chat_completion_text(
+                "gemini",
                 model="gemini-2.5-flash",
                 messages=[
                     {"role": "system", "content": "你是一個專業的臺灣教育題目生成器，專注於生成符合中學學生認知水平的選擇題，中文字一律用繁體中文，不要使用簡體中文。請參考提供的參考題目來生成概念一致但內容不同的新題目。"},
                     {"role": "user", "content": prompt}
                 ],
+                refresh=attempt > 0,
+                validate=is_valid_question_batch,
                 response_format={"type": "json_object"}
             )
             
             # 解析回應
-            content = response.choices[0].message.content
-            result = json.loads(content)
-            
-            # 處理生成的題目
-            for question in result.get("questions", []):
-                knowledge_point = question.get("knowledge_point", "")
-                
-                # 確保知識點存在於字典中
-                if knowledge_point not in all_questions:
-                    all_questions[knowledge_point] = []
-                
-                # 添加題目
-                all_questions[knowledge_point].append({
-                    "question": question.get("question", ""),
-                    "options": question.get("options", []),
-                    "answer": question.get("answer", "")
-                })
-            
-            print(f"[生成題目] 成功為批次 {i//batch_size + 1} 生成 {len(result.get('questions', []))} 個題目")
-            
-        except Exception as e:
-            print(f"[生成題目] 生成題目時出錯: {e}")
-    
-    # 打印生成的題目數量
-    total_questions = sum(len(questions) for questions in all_questions.values())
-    print(f"[生成題目] 總共為 {len(all_questions)} 個知識點生成了 {total_questions} 個題目")
-    
-    return all_questions
+            try:
+                questions = parse_question_batch(content)
+            except ValueError as e:
+                print(f"[生成題目] 批次 {batch_index} 第 {attempt + 1} 次回覆無法解析: {e}")
+                continue
+            print(f"[生成題目] 成功為批次 {batch_index} 生成 {len(questions)} 個題目")
+            return questions
+        return []
+        
+    except Exception as e:
+        print(f"[生成題目] 生成題目時出錯: {e}")
+        return []
 
 def verify_question_with_deepseek(question_data: Dict[str, Any]) -> Tuple[bool, str, str]:
     """使用 DeepSeek Reasoner 驗證題目"""
@@ -324,7 +336,8 @@ def verify_question_with_deepseek(question_data: Dict[str, Any]) -> Tuple[bool,
 """
 
         # 調用 DeepSeek Reasoner API
-        response = deepseek_client.chat.completions.create(
+        content = chat_completion_text(
+            "deepseek",
             model="deepseek-chat",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.1,
@@ -332,7 +345,7 @@ def verify_question_with_deepseek(question_data: Dict[str, Any]) -> Tuple[bool,
         )
         
         # 解析回應
-        content = response.choices[0].message.content.strip()
+        content = content.strip()
         content = content.strip('"')
         print("content deepseek:", content)
         # 判斷結果
@@ -375,13 +388,14 @@ def verify_question_with_o3mini(question_data: Dict[str, Any]) -> Tuple[bool, st
 """
 
         # 調用 o4-mini API
-        response = openai_client.chat.completions.create(
+        content = chat_completion_text(
+            "openai",
             model="o4-mini",
             messages=[{"role": "user", "content": prompt}],
         )
         
         # 解析回應
-        content = response.choices[0].message.content.strip()
+        content = content.strip()
         content = content.strip('"')
         print("content o4-mini:", content)
         # 判斷結果
@@ -425,14 +439,15 @@ def verify_question_with_gemini(question_data: Dict[str, Any]) -> Tuple[bool, st
 
 
         # 改用 Gemini 2.0 Flash 驗證題目
-        response = gemini_client.chat.completions.create(
+        content = chat_completion_text(
+            "gemini",
             model="gemini-2.0-flash",
             messages=[
                 {"role": "user", "content": prompt}
             ]
         )
         
-        content = response.choices[0].message.content.strip()
+        content = content.strip()
         content = content.strip('"')
         print("content gemini:", content)
         #print(content)
@@ -486,304 +501,217 @@ def generate_explanation_with_o3mini(question_data: Dict[str, Any]) -> str:
 """
 
         # 調用 Gemini 2.5 Flash API
-        response = gemini_client.chat.completions.create(
+        explanation = chat_completion_text(
+            "gemini",
             model="gemini-2.5-flash",  # 使用 Gemini 2.5 Flash
             messages=[{"role": "user", "content": prompt}],
         )
         
         # 獲取解釋
-        explanation = response.choices[0].message.content
         return explanation
     except Exception as e:
         print(f"生成題目解釋時出錯: {e}")
         return "無法生成解釋。"
 
-def save_question_to_database(connection, knowledge_id: int, question_data: Dict[str, Any], explanation: str):
-    """將題目保存到數據庫"""
+VERIFIERS = [
+    ("DeepSeek", verify_question_with_deepseek),
+    ("o4-mini", verify_question_with_o3mini),
+    ("Gemini", verify_question_with_gemini),
+]
+
+def verification_verdict(result: Tuple[bool, str, str]) -> Optional[str]:
+    """把單一模型的驗證結果轉成判定："Y"（答案正確）、"1"-"4"（建議的正確答案）或 None（瑕疵/錯誤）"""
+    is_correct, answer, _ = result
+    if is_correct:
+        return "Y"
+    if answer in ["1", "2", "3", "4"]:
+        return answer
+    return None
+
+def verify_question_concurrently(
+    question_data: Dict[str, Any],
+    on_first_yes: Optional[Callable[[], None]] = None,
+) -> Tuple[Optional[str], Dict[str, Tuple[bool, str, str]]]:
+    """
+    同時送出三個模型的驗證，回傳 (共識判定, 已收到的各模型結果)
+
+    只有三個判定完全相同才會保留題目，所以任一模型回報瑕疵或兩個模型判定不同時
+    就能確定捨棄，不再等待其餘模型。第一個結果為 "Y" 且還有模型未回覆時呼叫 on_first_yes。
+    """
+    futures = {llm_executor.submit(verify, question_data): name for name, verify in VERIFIERS}
+    results = {}
+    consensus = None
     try:
-        with connection.cursor() as cursor:
-            sql = """
-            INSERT INTO questions 
-            (knowledge_id, question_text, option_1, option_2, option_3, option_4, correct_answer, explanation) 
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(
-                sql, 
-                (
-                    knowledge_id,
-                    question_data['question'],
-                    question_data['options'][0],
-                    question_data['options'][1],
-                    question_data['options'][2],
-                    question_data['options'][3],
-                    question_data['answer'],
-                    explanation
-                )
-            )
-        connection.commit()
-        print(f"成功保存題目: {question_data['question'][:30]}...")
-        return True
-    except Exception as e:
-        print(f"保存題目到數據庫時出錯: {e}")
-        connection.rollback()
-        return False
+        for future in as_completed(futures):
+            name = futures[future]
+            results[name] = future.result()
+            verdict = verification_verdict(results[name])
+            print(f"  [驗證結果] {name}: {verdict or '捨棄'}")
+            if verdict is None or (consensus is not None and verdict != consensus):
+                if len(results) < len(VERIFIERS):
+                    throughput.count("early_reject")
+                return None, results
+            if consensus is None and verdict == "Y" and on_first_yes and len(results) < len(VERIFIERS):
+                on_first_yes()
+            consensus = verdict
+        return consensus, results
+    finally:
+        # 只有尚未開始的驗證能被取消；已在執行中的請求無法中止，只是不再等待其結果
+        for future in futures:
+            future.cancel()
 
-def get_or_create_chapter(connection, subject: str, section_data: Dict[str, Any]) -> int:
-    """獲取或創建章節，返回章節 ID"""
+def discard_speculative_explanation(explanation_future):
+    """丟棄推測生成的解釋：尚未開始的直接取消；已在執行的無法中止，費用照付，計為 wasted"""
+    if explanation_future is None:
+        return
+    if explanation_future.cancel():
+        throughput.count("speculative_cancelled")
+    else:
+        throughput.count("speculative_wasted")
+
+def process_question(buffer: SectionBuffer, point_name: str, question_data: Dict[str, Any]) -> bool:
+    """處理單個題目：驗證後放入小節的寫入緩衝區（小節處理完才一次寫入數據庫）"""
+    accepted = False
     try:
-        with connection.cursor() as cursor:
-            # 檢查章節是否存在
-            sql = """
-            SELECT id FROM chapter_list 
-            WHERE subject = %s AND chapter_name = %s
-            """
-            cursor.execute(sql, (subject, section_data['chapter_name']))
-            result = cursor.fetchone()
-            
-            if result:
-                print(f"章節已存在，使用現有章節 ID: {result['id']}")
-                return result['id']
-            
-            # 創建新章節
-            sql = """
-            INSERT INTO chapter_list 
-            (subject, year_grade, book, chapter_num, chapter_name) 
-            VALUES (%s, %s, %s, %s, %s)
-            """
-            cursor.execute(
-                sql, 
-                (
-                    subject,
-                    int(section_data['year_grade']),
-                    section_data['book'],
-                    int(section_data['chapter_num']),
-                    section_data['chapter_name']
-                )
-            )
-            connection.commit()
-            
-            # 獲取新創建的章節 ID
-            chapter_id = cursor.lastrowid
-            print(f"創建新章節，章節 ID: {chapter_id}")
-            return chapter_id
-            
-    except Exception as e:
-        print(f"獲取或創建章節時出錯: {e}")
-        # 如果是重複鍵錯誤，再次嘗試獲取現有章節
-        if "Duplicate entry" in str(e):
-            try:
-                with connection.cursor() as cursor:
-                    sql = """
-                    SELECT id FROM chapter_list 
-                    WHERE subject = %s AND chapter_name = %s
-                    """
-                    cursor.execute(sql, (subject, section_data['chapter_name']))
-                    result = cursor.fetchone()
-                    if result:
-                        print(f"檢測到重複，使用現有章節 ID: {result['id']}")
-                        return result['id']
-            except Exception as retry_error:
-                print(f"重試獲取章節時出錯: {retry_error}")
+        print(f"[檢查點 4.2] 處理題目: {question_data['question']}...") #[:30]
+        print("選項A:", question_data['options'][0])
+        print("選項B:", question_data['options'][1])
+        print("選項C:", question_data['options'][2])
+        print("選項D:", question_data['options'][3])
+        print("答案：", question_data['answer'])
         
-        connection.rollback()
-        return 0
-
-def get_or_create_knowledge_point(connection, chapter_id: int, section_data: Dict[str, Any], point_name: str) -> int:
-    """獲取或創建知識點，返回知識點 ID"""
-    try:
-        with connection.cursor() as cursor:
-            # 檢查知識點是否存在
-            sql = """
-            SELECT id FROM knowledge_points 
-            WHERE section_name = %s AND point_name = %s
-            """
-            cursor.execute(sql, (section_data['section_name'], point_name))
-            result = cursor.fetchone()
-            
-            if result:
-                print(f"知識點已存在，使用現有知識點 ID: {result['id']}")
-                return result['id']
-            
-            # 創建新知識點
-            sql = """
-            INSERT INTO knowledge_points 
-            (section_num, section_name, point_name, chapter_id) 
-            VALUES (%s, %s, %s, %s)
-            """
-            cursor.execute(
-                sql, 
-                (
-                    int(section_data['section_num']),
-                    section_data['section_name'],
-                    point_name,
-                    chapter_id
-                )
-            )
-            connection.commit()
-            
-            # 獲取新創建的知識點 ID
-            knowledge_id = cursor.lastrowid
-            print(f"創建新知識點，知識點 ID: {knowledge_id}")
-            return knowledge_id
-            
-    except Exception as e:
-        print(f"獲取或創建知識點時出錯: {e}")
-        # 如果是重複鍵錯誤，再次嘗試獲取現有知識點
-        if "Duplicate entry" in str(e):
-            try:
-                with connection.cursor() as cursor:
-                    sql = """
-                    SELECT id FROM knowledge_points 
-                    WHERE section_name = %s AND point_name = %s
-                    """
-                    cursor.execute(sql, (section_data['section_name'], point_name))
-                    result = cursor.fetchone()
-                    if result:
-                        print(f"檢測到重複，使用現有知識點 ID: {result['id']}")
-                        return result['id']
-            except Exception as retry_error:
-                print(f"重試獲取知識點時出錯: {retry_error}")
+        print(f"  [驗證開始] 同時使用三個模型驗證題目")
         
-        connection.rollback()
-        return 0
+        # 第一個模型認為答案正確時，先假設其餘模型也會同意並開始生成解釋；被捨棄或答案被修正時丟棄
+        speculative = []
 
-def process_question(connection, knowledge_id: int, question_data: Dict[str, Any]):
-    """處理單個題目：驗證並保存到數據庫"""
-    try:
-        
-        print(f"  [驗證開始] 使用三個模型驗證題目")
+        def start_speculative_explanation():
+            speculative.append(llm_executor.submit(generate_explanation_with_o3mini, dict(question_data)))
 
-        print("題目內容：")
-        print()
-        
-        # 使用三個模型驗證題目
-        print(f"  [驗證 1/3] 使用 DeepSeek 驗證")
-        deepseek_result = verify_question_with_deepseek(question_data)
-        print(f"  [驗證 2/3] 使用 o4-mini 驗證")
-        gpt4_result = verify_question_with_o3mini(question_data)
-        print(f"  [驗證 3/3] 使用 Gemini 驗證")
-        gemini_result = verify_question_with_gemini(question_data)
-        
-        deepseek_correct, deepseek_answer, _ = deepseek_result
-        gpt4_correct, gpt4_answer, _ = gpt4_result
-        gemini_correct, gemini_answer, _ = gemini_result
-        
-        print(f"  [驗證結果] DeepSeek: {deepseek_correct}, o4-mini: {gpt4_correct}, Gemini: {gemini_correct}")
+        consensus, results = verify_question_concurrently(
+            question_data,
+            on_first_yes=start_speculative_explanation if SPECULATIVE_EXPLANATION else None,
+        )
+        explanation_future = speculative[0] if speculative else None
         
         # 如果三個模型都認為答案正確
-        if deepseek_correct and gpt4_correct and gemini_correct:
+        if consensus == "Y":
             print(f"  [處理] 三個模型都認為答案正確，生成解釋")
-            # 生成解釋並保存題目
-            explanation = generate_explanation_with_o3mini(question_data)
-            print(f"  [保存] 保存題目到數據庫")
-            save_question_to_database(connection, knowledge_id, question_data, explanation)
-            return True
+            if explanation_future:
+                throughput.count("speculative_used")
+                explanation = explanation_future.result()
+            else:
+                explanation = generate_explanation_with_o3mini(question_data)
+            print(f"  [保存] 題目加入小節寫入緩衝區")
+            buffer.add(point_name, question_data, explanation)
+            accepted = True
         
         # 如果三個模型都給出相同的不同答案
-        elif (not deepseek_correct and not gpt4_correct and not gemini_correct and
-              deepseek_answer == gpt4_answer == gemini_answer and
-              deepseek_answer in ["1", "2", "3", "4"]):
-            
-            print(f"  [處理] 三個模型都給出相同的另一個答案: {deepseek_answer}，修正答案")
+        elif consensus is not None:
+            discard_speculative_explanation(explanation_future)
+            print(f"  [處理] 三個模型都給出相同的另一個答案: {consensus}，修正答案")
             # 修正答案
-            question_data['answer'] = deepseek_answer
+            question_data['answer'] = consensus
             
             # 生成解釋並保存題目
             print(f"  [生成] Gemini 生成解釋")
             explanation = generate_explanation_with_o3mini(question_data)
-            print(f"  [保存] 保存修正後的題目到數據庫")
-            save_question_to_database(connection, knowledge_id, question_data, explanation)
-            return True
+            print(f"  [保存] 修正後的題目加入小節寫入緩衝區")
+            buffer.add(point_name, question_data, explanation)
+            accepted = True
         
         # 其他情況：模型給出不同答案或認為題目有問題
         else:
+            discard_speculative_explanation(explanation_future)
             print(f"  [捨棄] 題目被捨棄: {question_data['question']}...") #[:30]
-            print(f"  [詳情] DeepSeek: 正確={deepseek_correct}, 答案={deepseek_answer}")
-            print(f"  [詳情] o3mini: 正確={gpt4_correct}, 答案={gpt4_answer}")
-            print(f"  [詳情] Gemini: 正確={gemini_correct}, 答案={gemini_answer}")
-            return False
+            for name, _ in VERIFIERS:
+                if name in results:
+                    is_correct, answer, _ = results[name]
+                    print(f"  [詳情] {name}: 正確={is_correct}, 答案={answer}")
+                else:
+                    print(f"  [詳情] {name}: 已提前結束，未等待結果")
     except Exception as e:
         print(f"  [錯誤] 處理題目時出錯: {e}")
-        return False
-
-def process_section(subject: str, section_data: Dict[str, Any]) -> List[str]:
-    """處理單個小節的所有知識點和題目"""
-    connection = None
+    finally:
+        throughput.record(accepted)
+    return accepted
+
+def process_indexed_question(buffer: SectionBuffer, point_name: str, question_data: Dict[str, Any], duplicate_key: str) -> bool:
+    """處理已加入近似重複索引的題目；沒有通過驗證時移出索引，讓重新生成的相似題目不被誤判為重複"""
+    accepted = process_question(buffer, point_name, question_data)
+    if not accepted and duplicate_index:
+        duplicate_index.remove(duplicate_key)
+    return accepted
+
+def process_section(writer: QuestionBankWriter, section_data: Dict[str, Any], executor: ThreadPoolExecutor) -> List[str]:
+    """處理單個小節的所有知識點和題目（生成批次與題目驗證都交給 executor 並行，最後一次交易寫入）"""
+    buffer = writer.section(section_data)
     log_details = []
     try:
         print(f"\n===== 開始處理小節: {section_data['section_name']} =====")
-        connection = get_db_connection()
-        
-        # 獲取或創建章節
-        print(f"[檢查點 1] 嘗試獲取或創建章節: {section_data['chapter_name']}")
-        chapter_id = get_or_create_chapter(connection, subject, section_data)
-        if not chapter_id:
-            log_message = f"無法獲取或創建章節，跳過處理小節: {section_data['section_name']}"
-            print(log_message)
-            log_details.append(log_message)
-            return log_details
-        print(f"[檢查點 1 完成] 成功獲取章節 ID: {chapter_id}")
         
         # 獲取知識點列表
         knowledge_points = section_data['knowledge_points']
         print(f"[檢查點 2] 小節 {section_data['section_name']} 包含 {len(knowledge_points)} 個知識點")
         
-        # 使用全局載入的參考題目
-        print(f"[檢查點 2.5] 使用已載入的參考題目")
-        global reference_questions
+        # 載入這個小節知識點的參考題目（每個知識點最多 --references-per-point 題）
+        reference_questions = reference_store.sample_for_points(knowledge_points)
+        print(f"[檢查點 2.5] 載入 {len(reference_questions)} 個知識點的參考題目，共 {sum(len(qs) for qs in reference_questions.values())} 題")
         
         # 使用 Gemini 2.5 Flash 參考現有題目生成題目
         print(f"[檢查點 3] 開始使用 Gemini 2.5 Flash 參考現有題目生成題目")
-        questions_by_point = generate_questions_with_reference(knowledge_points, section_data, reference_questions, batch_size=2)
+        questions_by_point = generate_questions_with_reference(knowledge_points, section_data, reference_questions, executor, batch_size=2)
         print(f"[檢查點 3 完成] 成功生成 {sum(len(qs) for qs in questions_by_point.values())} 個題目")
         
-        # 處理每個知識點
+        # 所有題目一起送進 executor 驗證，通過的題目先留在緩衝區
+        question_futures = {}
         for point_name, questions in questions_by_point.items():
-            print(f"\n[檢查點 4] 開始處理知識點: {point_name}")
-            # 獲取或創建知識點
-            knowledge_id = get_or_create_knowledge_point(connection, chapter_id, section_data, point_name)
-            if not knowledge_id:
-                log_message = f"知識點 '{point_name}': 無法獲取或创建知識點ID，已跳過。"
-                print(log_message)
-                log_details.append(log_message)
-                continue
-            
-            print(f"[檢查點 4.1] 成功獲取知識點 ID: {knowledge_id}")
-            
-            # 處理該知識點的所有題目
-            successful_questions = 0
-            total_generated = len(questions)
-
-            if total_generated == 0:
+            if not questions:
                 log_message = f"知識點 '{point_name}': 未生成任何題目。"
                 print(f"[檢查點 4 完成] {log_message}")
                 log_details.append(log_message)
                 continue
 
-            for i, question_data in enumerate(questions):
-                print(f"[檢查點 4.2] 處理題目 {i+1}/{len(questions)}: {question_data['question']}...") #[:30]
-                print("選項A:", question_data['options'][0])
-                print("選項B:", question_data['options'][1])
-                print("選項C:", question_data['options'][2])
-                print("選項D:", question_data['options'][3])
-                print("答案：", question_data['answer'])
-                # 添加延遲以避免 API 限制
-                time.sleep(1)
-                
-                if process_question(connection, knowledge_id, question_data):
-                    successful_questions += 1
-            
-            log_message = f"知識點 '{point_name}': 成功保存 {successful_questions}/{total_generated} 個題目"
+            # 與題庫、參考題目或已生成題目近似重複的題目不送驗證
+            unique_questions = []
+            for index, question_data in enumerate(questions):
+                # 鍵含章節：不同章節可能有同名小節與知識點，鍵重複會覆蓋索引中的另一題
+                duplicate_key = f"new:{section_data['chapter_name']}:{section_data['section_name']}:{point_name}:{index}"
+                fingerprint = question_fingerprint(question_data['question'], question_data.get('options', []))
+                duplicate = duplicate_index.check_and_add(fingerprint, duplicate_key) if duplicate_index else None
+                if duplicate:
+                    match_key, similarity = duplicate
+                    print(f"  [捨棄] 與 {match_key} 近似重複（相似度 {similarity:.2f}）: {question_data['question'][:30]}...")
+                    throughput.count("near_duplicate")
+                    continue
+                unique_questions.append((duplicate_key, question_data))
+            if len(unique_questions) < len(questions):
+                log_details.append(f"知識點 '{point_name}': 捨棄 {len(questions) - len(unique_questions)} 個近似重複題目")
+
+            question_futures[point_name] = [
+                executor.submit(process_indexed_question, buffer, point_name, question_data, duplicate_key)
+                for duplicate_key, question_data in unique_questions
+            ]
+        
+        # 收集各知識點的結果
+        accepted_by_point = {}
+        for point_name, futures in question_futures.items():
+            accepted_by_point[point_name] = (sum(1 for future in futures if future.result()), len(futures))
+        
+        # 章節、知識點與題目在同一個交易寫入；失敗時整個小節不留下任何資料
+        print(f"[檢查點 5] 寫入數據庫")
+        buffer.flush(list(questions_by_point))
+        for point_name, (successful_questions, total) in accepted_by_point.items():
+            log_message = f"知識點 '{point_name}': 成功保存 {successful_questions}/{total} 個題目"
             print(f"[檢查點 4 完成] {log_message}")
             log_details.append(log_message)
+        print(f"[進度] {throughput.summary()}")
     
     except Exception as e:
         print(f"處理小節時出錯: {e}")
         log_details.append(f"處理小節時出錯: {e}")
         raise # 重新拋出異常，以便上層函數可以捕獲並記錄為失敗
     finally:
-        if connection:
-            connection.close()
         print(f"===== 完成處理小節: {section_data['section_name']} =====\n")
     
     return log_details
@@ -797,7 +725,13 @@ def main():
     parser.add_argument('--skip-existing', action='store_true', help='跳過已存在章節的小節')
     parser.add_argument('--resume', action='store_true', help='從上次中斷的地方繼續')
     parser.add_argument('--log-file', default='processing_log.txt', help='處理日誌文件')
+    parser.add_argument('--section-workers', type=int, default=2, help='同時處理的小節數')
+    parser.add_argument('--question-workers', type=int, default=16, help='同時進行的生成批次與題目驗證數（實際速率仍受各供應商限流器控制）')
+    parser.add_argument('--references-per-point', type=int, default=int(os.getenv('REFERENCE_QUESTIONS_PER_POINT', '8')), help='每個知識點放進 prompt 的參考題目上限')
+    parser.add_argument('--dedup-threshold', type=float, default=float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.8')), help='近似重複題目的 Jaccard 門檻，0 表示不檢查')
+    add_cache_arguments(parser)
     args = parser.parse_args()
+    configure_from_args(args)
     
     # 讀取 CSV 數據
     sections_data = read_csv_data(args.csv_file)
@@ -854,10 +788,40 @@ def main():
     
     print(f"實際需要處理: {len(sections_to_process)} 個小節")
     
-    # 載入參考題目（傳遞所有小節數據以收集知識點）
-    print("[初始化] 載入參考題目...")
-    global reference_questions
-    reference_questions = load_reference_questions(sections_data)
+    # 建立（或沿用）參考題目索引，實際題目在處理各小節時才載入
+    print("[初始化] 建立參考題目索引...")
+    global reference_store
+    reference_store = ReferenceStore(per_point=args.references_per_point)
+    reference_store.build()
+    all_knowledge_points = list(dict.fromkeys(kp for _, section in sections_to_process for kp in section['knowledge_points']))
+    
+    # 建立近似重複索引：題庫中該學科的題目與參考題目
+    global duplicate_index
+    if args.dedup_threshold > 0:
+        duplicate_index = NearDuplicateIndex(threshold=args.dedup_threshold)
+        connection = get_db_connection()
+        try:
+            duplicate_index.add_many(fetch_bank_questions(connection, args.subject))
+        finally:
+            connection.close()
+        duplicate_index.add_many(reference_store.iter_questions(all_knowledge_points))
+        print(f"[初始化] 近似重複索引: {len(duplicate_index)} 題（門檻 {args.dedup_threshold}）")
+    
+    # 日誌由多個小節執行緒共同寫入
+    log_lock = threading.Lock()
+    
+    def append_log(lines: List[str]):
+        with log_lock:
+            with open(args.log_file, 'a', encoding='utf-8') as f:
+                for line in lines:
+                    f.write(f"{line}\n")
+    
+    # 章節與知識點 ID 預先載入，題目每個小節一次交易寫入
+    writer = QuestionBankWriter(get_db_connection, args.subject)
+    writer.load()
+    
+    # 題目生成與驗證共用的執行緒池（與小節執行緒池分開，避免小節等待題目時互相卡住）
+    question_executor = ThreadPoolExecutor(max_workers=args.question_workers)
     
     # 處理小節
     def process_with_logging(section_info):
@@ -867,40 +831,38 @@ def main():
             print(f"\n[{idx+1}/{total_sections}] 開始處理: {section_name}")
             
             # 檢查是否要跳過已存在的章節
-            if args.skip_existing:
-                connection = get_db_connection()
-                try:
-                    with connection.cursor() as cursor:
-                        sql = "SELECT id FROM chapter_list WHERE subject = %s AND chapter_name = %s"
-                        cursor.execute(sql, (args.subject, section_data['chapter_name']))
-                        if cursor.fetchone():
-                            print(f"跳過已存在章節的小節: {section_name}")
-                            with open(args.log_file, 'a', encoding='utf-8') as f:
-                                f.write(f"SKIPPED:{section_name}\n")
-                            return
-                finally:
-                    connection.close()
+            if args.skip_existing and writer.has_chapter(section_data['chapter_name']):
+                print(f"跳過已存在章節的小節: {section_name}")
+                append_log([f"SKIPPED:{section_name}"])
+                return
             
             # 處理小節
-            log_details = process_section(args.subject, section_data)
+            log_details = process_section(writer, section_data, question_executor)
             
             # 記錄成功
-            with open(args.log_file, 'a', encoding='utf-8') as f:
-                f.write(f"COMPLETED:{section_name}\n")
-                for detail in log_details:
-                    f.write(f"  - {detail}\n")
+            append_log([f"COMPLETED:{section_name}"] + [f"  - {detail}" for detail in log_details])
             
             print(f"[{idx+1}/{total_sections}] 完成處理: {section_name}")
             
         except Exception as e:
             print(f"[{idx+1}/{total_sections}] 處理失敗: {section_name}, 錯誤: {e}")
-            with open(args.log_file, 'a', encoding='utf-8') as f:
-                f.write(f"FAILED:{section_name}\n")
-                f.write(f"  ERROR: {str(e)}\n")
+            append_log([f"FAILED:{section_name}", f"  ERROR: {str(e)}"])
+    
+    # 並行處理小節，API 速率由各供應商的限流器控制
+    try:
+        with ThreadPoolExecutor(max_workers=args.section_workers) as section_executor:
+            for future in as_completed([section_executor.submit(process_with_logging, info) for info in sections_to_process]):
+                future.result()
+    finally:
+        question_executor.shutdown(wait=False, cancel_futures=True)
     
-    # 序列處理（避免 API 限制）
-    for section_info in sections_to_process:
-        process_with_logging(section_info)
+    print(f"\n[完成] {throughput.summary()}")
+    for name, limiter in LIMITERS.items():
+        print(f"  [{name}] {limiter.snapshot()}")
+    print(f"  [llm_cache] {llm_cache.snapshot()}")
+    print(f"  [db] {writer.snapshot()}")
+    if duplicate_index:
+        print(f"  [dedup] {duplicate_index.snapshot()}")
 
 if __name__ == "__main__":
     validate_env_vars()
@@ -1,23 +1,54 @@
 import pandas as pd
-import os
+import argparse
 import vertexai
-from vertexai.generative_models import GenerativeModel
+from vertexai.generative_models import GenerationConfig, GenerativeModel
 import json
 import time
-from typing import Optional, List
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Optional, List, Tuple
+from lexical_matcher import LEXICAL_MATCH_REASON, section_knowledge_points
+from llm_cache import add_cache_arguments, configure_from_args, llm_cache
+from result_store import ResultStore
+from rate_limiter import limiter_from_env
 
 # 初始化 Vertex AI
 vertexai.init(project="dogtor-454402", location="us-central1")
 
+# Vertex AI 限流器（可用 VERTEX_RPM / VERTEX_MAX_CONCURRENCY 調整）
+VERTEX_LIMITER = limiter_from_env("vertex", 300, 8)
+
+# 批次匹配的結構化輸出：[{"ques_no": "...", "knowledge_point": "..."}]
+BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "ques_no": {"type": "string"},
+            "knowledge_point": {"type": "string"},
+        },
+        "required": ["ques_no", "knowledge_point"],
+    },
+}
+
 class QuestionKnowledgePointMatcher:
     def __init__(self):
         """初始化題目知識點匹配器"""
-        self.model = GenerativeModel("gemini-2.0-flash")
+        self.model_name = "gemini-2.0-flash"
+        self.model = GenerativeModel(self.model_name)
         self.knowledge_points_df = None
         self.question_bank_df = None
-        self.results = []
+        # 小節名稱 → 知識點清單，載入時一次解析
+        self.section_points: Dict[str, List[str]] = {}
+        self.processed_question_nos = set()
+        # 詞彙預先匹配的結果：題號 → 知識點（prematch() 填入）
+        self.lexical_matches: Dict[str, str] = {}
+        self.question_bank_path = "processing/high_chem_qbank.csv"
         self.output_path = "processing/question_knowledge_point_matching_results.csv"
+        # 處理中的結果寫入 append-only JSONL，結束時再匯出成 output_path 的 CSV
+        self.store = ResultStore("processing/question_knowledge_point_matching_results.jsonl")
+        self.lock = threading.Lock()
+        self.stats = {"api_calls": 0, "batch_calls": 0, "fallback_questions": 0, "single_calls": 0, "single_call_seconds": 0.0}
         
     def load_data(self):
         """載入知識點和題庫資料，並檢查已處理的結果"""
@@ -25,22 +56,19 @@ class QuestionKnowledgePointMatcher:
             # 載入知識點資料
             self.knowledge_points_df = pd.read_csv("processing/high_chem_list.csv")
             print(f"載入知識點資料: {len(self.knowledge_points_df)} 筆記錄")
+            self.section_points = section_knowledge_points(self.knowledge_points_df)
             
             # 載入題庫資料
-            self.question_bank_df = pd.read_csv("processing/high_chem_qbank.csv")
+            self.question_bank_df = pd.read_csv(self.question_bank_path)
             print(f"載入題庫資料: {len(self.question_bank_df)} 筆記錄")
             
-            # 檢查是否有已處理的結果
-            if os.path.exists(self.output_path):
-                processed_df = pd.read_csv(self.output_path)
-                processed_questions = set(processed_df['ques_no'].tolist())
-                print(f"發現已處理的結果: {len(processed_questions)} 題")
-                
-                # 更新 results 列表
-                self.results = processed_df.to_dict('records')
+            # 檢查是否有已處理的結果（只讀題號索引；第一次使用時匯入舊的 CSV 結果）
+            self.processed_question_nos = self.store.load(legacy_csv_path=self.output_path)
+            if self.processed_question_nos:
+                print(f"發現已處理的結果: {len(self.processed_question_nos)} 題")
                 
                 # 過濾掉已處理的題目
-                self.question_bank_df = self.question_bank_df[~self.question_bank_df['ques_no'].isin(processed_questions)]
+                self.question_bank_df = self.question_bank_df[~self.question_bank_df['ques_no'].astype(str).isin(self.processed_question_nos)]
                 print(f"剩餘待處理題目: {len(self.question_bank_df)} 題")
             
             return True
@@ -49,37 +77,18 @@ class QuestionKnowledgePointMatcher:
             return False
     
     def get_section_knowledge_points(self, chapter_name: str, section_name: str) -> List[str]:
-        """根據章節和節次取得相關知識點"""
-        try:
-            # 只尋找完全匹配的節次
-            filtered_df = self.knowledge_points_df[
-                self.knowledge_points_df['section_name'] == section_name
-            ]
-            
-            if filtered_df.empty:
-                print(f"找不到完全匹配的節次: {section_name}")
-                return []
-            
-            # 提取知識點
-            knowledge_points = []
-            for _, row in filtered_df.iterrows():
-                if pd.notna(row['knowledge_points']):
-                    points = str(row['knowledge_points']).split('、')
-                    knowledge_points.extend([point.strip() for point in points if point.strip()])
-            
-            # 去重並排序
-            return list(set(knowledge_points))
-            
-        except Exception as e:
-            print(f"取得知識點失敗: {e}")
+        """根據章節和節次取得相關知識點（只比對節次名稱，清單在 load_data 時已解析）"""
+        knowledge_points = self.section_points.get(section_name)
+        if not knowledge_points:
+            print(f"找不到完全匹配的節次: {section_name}")
             return []
+        return knowledge_points
     
     def should_skip_question(self, question_text: str) -> tuple[bool, str]:
         """判斷是否應該跳過這道題目"""
         # 檢查是否提到圖片
         image_keywords = ['圖為', '圖片', '圖表', '下圖', '右圖', '左圖', '如圖', '圖中', '附圖']
         # image_keywords = []
-        question_lower = question_text.lower()
         
         for keyword in image_keywords:
             if keyword in question_text:
@@ -118,25 +127,19 @@ class QuestionKnowledgePointMatcher:
         
         for attempt in range(max_retries):
             try:
-                response = self.model.generate_content(prompt)
-                result = response.text.strip()
+                # 重試（前一次回覆不在清單中）時不讀快取，重新呼叫並覆寫
+                result = self.generate(prompt, refresh=attempt > 0).strip()
                 
                 # 驗證回覆是否在知識點清單中
-                if result in knowledge_points:
-                    return result
-                elif result == "無匹配":
-                    return None
-                else:
-                    # 嘗試模糊匹配
-                    for kp in knowledge_points:
-                        if result in kp or kp in result:
-                            return kp
-                    
-                    print(f"API 回覆不在知識點清單中: {result}")
-                    if attempt < max_retries - 1:
-                        time.sleep(1)
-                        continue
-                    return None
+                valid, matched_kp = self.resolve_match(result, knowledge_points)
+                if valid:
+                    return matched_kp
+                
+                print(f"API 回覆不在知識點清單中: {result}")
+                if attempt < max_retries - 1:
+                    time.sleep(1)
+                    continue
+                return None
                     
             except Exception as e:
                 print(f"API 呼叫失敗 (嘗試 {attempt + 1}/{max_retries}): {e}")
@@ -147,31 +150,205 @@ class QuestionKnowledgePointMatcher:
         
         return None
     
+    def generate(self, prompt: str, refresh: bool = False, generation_config: Optional[GenerationConfig] = None, params: Optional[Dict[str, Any]] = None, single: bool = True) -> str:
+        """經由 LLM 快取與限流器呼叫 Gemini，回傳原始文字；single 表示單題呼叫，實際呼叫時記錄耗時"""
+        def call() -> str:
+            with self.lock:
+                self.stats["api_calls"] += 1
+            started = time.perf_counter()
+            text = VERTEX_LIMITER.call(self.model.generate_content, prompt, generation_config=generation_config).text
+            if single:
+                with self.lock:
+                    self.stats["single_calls"] += 1
+                    self.stats["single_call_seconds"] += time.perf_counter() - started
+            return text
+        
+        return llm_cache.call("vertex", self.model_name, prompt, params or {}, call, refresh=refresh)
+    
+    @staticmethod
+    def resolve_match(result: str, knowledge_points: List[str]) -> Tuple[bool, Optional[str]]:
+        """把模型回覆對應到知識點：回傳 (回覆是否有效, 知識點或 None 表示無匹配)"""
+        if result in knowledge_points:
+            return True, result
+        if result == "無匹配":
+            return True, None
+        # 嘗試模糊匹配
+        for kp in knowledge_points:
+            if result and (result in kp or kp in result):
+                return True, kp
+        return False, None
+    
+    def call_gemini_batch(self, questions: List[Tuple[str, str]], knowledge_points: List[str], max_retries: int = 3) -> Dict[str, Optional[str]]:
+        """
+        一次判斷同一小節的多道題目，questions 為 [(題號, 題目內容)]
+
+        回傳通過驗證的 {題號: 知識點或 None}；回覆缺漏、題號不符或知識點不在清單中的題目
+        不會出現在結果中，由呼叫端改用單題呼叫。
+        """
+        knowledge_points_str = "、".join(knowledge_points)
+        questions_str = "\n\n".join(f"[題號 {ques_no}]\n{question_text}" for ques_no, question_text in questions)
+        prompt = f"""
+請仔細分析以下 {len(questions)} 道題目，分別從給定的知識點清單中為每一題選擇一個最相關的知識點。
+
+可選的知識點清單：
+{knowledge_points_str}
+
+題目：
+{questions_str}
+
+請注意以下要求：
+1. 每一題只能從上述知識點清單中選擇一個知識點，並使用清單中的完整名稱
+2. 選擇與題目內容最相關的知識點
+3. 如果題目與任何知識點都不相關，knowledge_point 請填「無匹配」
+4. 每一題都要回覆一筆，ques_no 必須與題號完全相同
+
+回覆格式：JSON 陣列，例如 [{{"ques_no": "題號", "knowledge_point": "知識點名稱"}}]
+"""
+        generation_config = GenerationConfig(response_mime_type="application/json", response_schema=BATCH_RESPONSE_SCHEMA)
+        expected = {ques_no for ques_no, _ in questions}
+        
+        for attempt in range(max_retries):
+            try:
+                with self.lock:
+                    self.stats["batch_calls"] += 1
+                content = self.generate(prompt, refresh=attempt > 0, generation_config=generation_config, params={"response_schema": BATCH_RESPONSE_SCHEMA}, single=False)
+                items = json.loads(content)
+                if not isinstance(items, list):
+                    raise ValueError(f"回覆不是 JSON 陣列: {content[:100]}")
+                
+                matches = {}
+                for item in items:
+                    if not isinstance(item, dict):
+                        continue
+                    ques_no = str(item.get("ques_no", "")).strip()
+                    if ques_no not in expected or ques_no in matches:
+                        continue
+                    valid, matched_kp = self.resolve_match(str(item.get("knowledge_point", "")).strip(), knowledge_points)
+                    if valid:
+                        matches[ques_no] = matched_kp
+                return matches
+                
+            except Exception as e:
+                print(f"批次 API 呼叫失敗 (嘗試 {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    time.sleep(2 ** attempt)  # 指數退避
+        
+        return {}
+    
     def save_result(self, result: dict):
-        """儲存單一題目的處理結果"""
+        """儲存單一題目的處理結果（寫入緩衝，批次 fsync）"""
         try:
-            # 將結果加入列表
-            self.results.append(result)
-            
-            # 轉換為 DataFrame
-            results_df = pd.DataFrame([result])
-            
-            # 如果檔案不存在，創建新檔案
-            if not os.path.exists(self.output_path):
-                results_df.to_csv(self.output_path, index=False, encoding='utf-8-sig')
-            else:
-                # 追加到現有檔案
-                results_df.to_csv(self.output_path, mode='a', header=False, index=False, encoding='utf-8-sig')
-            
+            self.store.append(result)
         except Exception as e:
             print(f"儲存結果失敗: {e}")
     
+    def finalize_results(self):
+        """寫出緩衝中的結果，並匯出成原本的 CSV 格式"""
+        self.store.flush()
+        count = self.store.export_csv(self.output_path)
+        print(f"結果已匯出到: {self.output_path}（{count} 題）")
+    
+    def iter_questions(self):
+        """逐題產生 (尚未匹配的結果記錄, 完整題目內容)；先把欄位轉成字串清單，避免逐列建立 Series"""
+        columns = ['ques_no', 'subject', 'chapter name', 'section name', 'ques_detl']
+        values = [self.question_bank_df[column].fillna('').astype(str).tolist() for column in columns]
+        for question_no, subject, chapter_name, section_name, question_text in zip(*values):
+            yield self.build_result(question_no, subject, chapter_name, section_name, question_text), question_text
+    
+    def build_result(self, question_no: str, subject: str, chapter_name: str, section_name: str, question_text: str) -> dict:
+        """建立一題的結果記錄（尚未匹配）"""
+        # 檢查是否需要跳過
+        should_skip, skip_reason = self.should_skip_question(question_text)
+        
+        return {
+            'ques_no': question_no,
+            'subject': subject,
+            'chapter_name': chapter_name,
+            'section_name': section_name,
+            'question_text': question_text[:100] + "..." if len(question_text) > 100 else question_text,
+            'matched_knowledge_point': None,
+            'status': 'skipped' if should_skip else 'processed',
+            'reason': skip_reason if should_skip else ""
+        }
+    
+    @staticmethod
+    def apply_lexical_match(result: dict, matched_kp: str):
+        result['matched_knowledge_point'] = matched_kp
+        result['status'] = 'matched'
+        result['reason'] = LEXICAL_MATCH_REASON
+    
+    def calibrate_prematch(self, matcher, full_question_bank_df: pd.DataFrame, target_precision: float) -> Optional[Tuple[float, float]]:
+        """以已處理題目的 LLM 結果評估各組門檻，回傳精確率達標且覆蓋率最高的 (min_score, margin)"""
+        from lexical_matcher import (
+            CALIBRATION_MARGINS, CALIBRATION_MIN_SCORES, MIN_LABELED_QUESTIONS,
+            calibrate, labeled_inputs, llm_labels, precision_report,
+        )
+        
+        labels = llm_labels(self.store.iter_results())
+        question_texts, candidates, ordered_labels = labeled_inputs(full_question_bank_df, self.section_points, labels)
+        if len(ordered_labels) < MIN_LABELED_QUESTIONS:
+            print(f"詞彙預先匹配: LLM 標註只有 {len(ordered_labels)} 題（至少需要 {MIN_LABELED_QUESTIONS} 題）無法校準門檻，本次全部交給 LLM")
+            return None
+        rows = precision_report(question_texts, candidates, ordered_labels, matcher, CALIBRATION_MIN_SCORES, CALIBRATION_MARGINS)
+        chosen = calibrate(rows, target_precision)
+        if chosen is None:
+            print(f"詞彙預先匹配: 沒有門檻組合的精確率達到 {target_precision:.0%}（{len(ordered_labels)} 題標註），本次全部交給 LLM")
+            return None
+        row = next(row for row in rows if row[:2] == chosen)
+        print(f"詞彙預先匹配: 依 {len(ordered_labels)} 題 LLM 標註校準門檻 min_score={chosen[0]} margin={chosen[1]}"
+              f"（精確率 {row[3]:.1%}，覆蓋率 {row[2]:.1%}）")
+        return chosen
+    
+    def prematch(self, min_score: Optional[float], margin: Optional[float], target_precision: float):
+        """
+        以字元 n-gram TF-IDF 為待處理題目預先指定有把握的知識點（見 lexical_matcher.py）
+        
+        min_score 或 margin 未指定時，以已處理題目的 LLM 結果校準；標註不足或沒有門檻達標時不預先匹配。
+        """
+        from lexical_matcher import LexicalMatcher
+        
+        started = time.perf_counter()
+        sections = self.section_points
+        # 以完整題庫建立詞彙與 IDF（已處理的題目也用於校準）
+        full_question_bank_df = pd.read_csv(self.question_bank_path)
+        matcher = LexicalMatcher().fit(
+            full_question_bank_df['ques_detl'].fillna('').astype(str).tolist(),
+            [name for names in sections.values() for name in names],
+        )
+        if min_score is None or margin is None:
+            chosen = self.calibrate_prematch(matcher, full_question_bank_df, target_precision)
+            if chosen is None:
+                return
+            min_score = chosen[0] if min_score is None else min_score
+            margin = chosen[1] if margin is None else margin
+        matcher.min_score, matcher.margin = min_score, margin
+        
+        question_texts = self.question_bank_df['ques_detl'].fillna('').astype(str).tolist()
+        candidates = [sections.get(name, []) for name in self.question_bank_df['section name']]
+        predictions = matcher.predict(question_texts, candidates)
+        self.lexical_matches = {
+            str(ques_no): matched_kp
+            for ques_no, matched_kp in zip(self.question_bank_df['ques_no'], predictions)
+            if matched_kp
+        }
+        print(f"詞彙預先匹配: {len(self.lexical_matches)}/{len(question_texts)} 題（{time.perf_counter() - started:.1f} 秒）")
+    
+    @staticmethod
+    def apply_match(result: dict, matched_kp: Optional[str]):
+        if matched_kp:
+            result['matched_knowledge_point'] = matched_kp
+            result['status'] = 'matched'
+        else:
+            result['status'] = 'no_match'
+            result['reason'] = "AI 判斷無匹配的知識點"
+    
     def process_questions(self, batch_size: int = 10):
-        """處理所有題目"""
+        """處理所有題目（逐題呼叫 API）"""
         if self.question_bank_df is None or self.knowledge_points_df is None:
             print("請先載入資料")
             return
         
+        started = time.perf_counter()
         total_questions = len(self.question_bank_df)
         processed = 0
         skipped = 0
@@ -180,51 +357,35 @@ class QuestionKnowledgePointMatcher:
         print(f"開始處理 {total_questions} 道題目...")
         
         try:
-            for idx, row in self.question_bank_df.iterrows():
+            for idx, (result, question_text) in enumerate(self.iter_questions()):
                 try:
-                    question_text = str(row['ques_detl']) if pd.notna(row['ques_detl']) else ""
-                    subject = str(row['subject']) if pd.notna(row['subject']) else ""
-                    chapter_name = str(row['chapter name']) if pd.notna(row['chapter name']) else ""
-                    section_name = str(row['section name']) if pd.notna(row['section name']) else ""
-                    question_no = str(row['ques_no']) if pd.notna(row['ques_no']) else ""
-                    
-                    # 檢查是否需要跳過
-                    should_skip, skip_reason = self.should_skip_question(question_text)
-                    
-                    result = {
-                        'ques_no': question_no,
-                        'subject': subject,
-                        'chapter_name': chapter_name,
-                        'section_name': section_name,
-                        'question_text': question_text[:100] + "..." if len(question_text) > 100 else question_text,
-                        'matched_knowledge_point': None,
-                        'status': 'skipped' if should_skip else 'processed',
-                        'reason': skip_reason if should_skip else ""
-                    }
+                    question_no = result['ques_no']
                     
-                    if should_skip:
+                    if result['status'] == 'skipped':
                         skipped += 1
-                        print(f"[{processed + 1}/{total_questions}] 跳過題目 {question_no}: {skip_reason}")
+                        print(f"[{processed + 1}/{total_questions}] 跳過題目 {question_no}: {result['reason']}")
                     else:
                         # 取得相關知識點
-                        knowledge_points = self.get_section_knowledge_points(chapter_name, section_name)
+                        knowledge_points = self.get_section_knowledge_points(result['chapter_name'], result['section_name'])
                         
                         if not knowledge_points:
                             result['status'] = 'no_knowledge_points'
                             result['reason'] = "找不到相關知識點"
                             print(f"[{processed + 1}/{total_questions}] 題目 {question_no}: 找不到相關知識點")
+                        elif question_no in self.lexical_matches:
+                            matched_kp = self.lexical_matches[question_no]
+                            self.apply_lexical_match(result, matched_kp)
+                            matched += 1
+                            print(f"[{processed + 1}/{total_questions}] 題目 {question_no} 詞彙預先匹配到: {matched_kp}")
                         else:
                             # 呼叫 Gemini API
                             matched_kp = self.call_gemini_api(question_text, knowledge_points)
+                            self.apply_match(result, matched_kp)
                             
                             if matched_kp:
-                                result['matched_knowledge_point'] = matched_kp
-                                result['status'] = 'matched'
                                 matched += 1
                                 print(f"[{processed + 1}/{total_questions}] 題目 {question_no} 匹配到: {matched_kp}")
                             else:
-                                result['status'] = 'no_match'
-                                result['reason'] = "AI 判斷無匹配的知識點"
                                 print(f"[{processed + 1}/{total_questions}] 題目 {question_no}: 無匹配的知識點")
                     
                     # 儲存這一題的結果
@@ -244,17 +405,123 @@ class QuestionKnowledgePointMatcher:
             print("\n使用者中斷處理！")
             print("已儲存目前處理的結果，下次執行時會從中斷處繼續。")
         
-        print(f"\n處理完成！")
+        print("\n處理完成！")
         print(f"總題目數: {total_questions}")
         print(f"已處理: {processed}")
         print(f"跳過: {skipped}")
         print(f"成功匹配: {matched}")
         print(f"無匹配: {processed - skipped - matched}")
+        print(f"API 呼叫: {self.stats['api_calls']} 次，耗時: {time.perf_counter() - started:.1f} 秒")
+    
+    def process_section_batch(self, knowledge_points: List[str], pending: List[Tuple[dict, str]]) -> int:
+        """匹配同一小節的一批題目並儲存結果，回傳成功匹配數；批次回覆無效的題目改用單題呼叫"""
+        matches = self.call_gemini_batch([(result['ques_no'], question_text) for result, question_text in pending], knowledge_points)
+        matched = 0
+        for result, question_text in pending:
+            if result['ques_no'] in matches:
+                matched_kp = matches[result['ques_no']]
+            else:
+                with self.lock:
+                    self.stats["fallback_questions"] += 1
+                matched_kp = self.call_gemini_api(question_text, knowledge_points)
+            self.apply_match(result, matched_kp)
+            matched += bool(matched_kp)
+            self.save_result(result)
+        return matched
+    
+    def process_questions_batched(self, questions_per_prompt: int = 20, section_workers: int = 4):
+        """
+        批次模式：同一小節的題目每 questions_per_prompt 題合併成一個結構化輸出的 prompt，
+        各小節並行處理，速率由 VERTEX_LIMITER 控制
+        """
+        if self.question_bank_df is None or self.knowledge_points_df is None:
+            print("請先載入資料")
+            return
+        
+        started = time.perf_counter()
+        total_questions = len(self.question_bank_df)
+        skipped = 0
+        no_knowledge_points = 0
+        lexical = 0
+        sections: Dict[Tuple[str, str], List[Tuple[dict, str]]] = {}
+        
+        # 先處理不需要呼叫 API 的題目，其餘依小節分組
+        for result, question_text in self.iter_questions():
+            if result['status'] == 'skipped':
+                skipped += 1
+                self.save_result(result)
+                continue
+            sections.setdefault((result['chapter_name'], result['section_name']), []).append((result, question_text))
+        
+        jobs = []
+        for (chapter_name, section_name), pending in sections.items():
+            knowledge_points = self.get_section_knowledge_points(chapter_name, section_name)
+            if not knowledge_points:
+                for result, _ in pending:
+                    result['status'] = 'no_knowledge_points'
+                    result['reason'] = "找不到相關知識點"
+                    self.save_result(result)
+                no_knowledge_points += len(pending)
+                continue
+            # 詞彙預先匹配到的題目直接儲存，其餘才送 LLM
+            remaining = []
+            for result, question_text in pending:
+                if result['ques_no'] in self.lexical_matches:
+                    self.apply_lexical_match(result, self.lexical_matches[result['ques_no']])
+                    self.save_result(result)
+                    lexical += 1
+                else:
+                    remaining.append((result, question_text))
+            pending = remaining
+            for start in range(0, len(pending), questions_per_prompt):
+                jobs.append((section_name, knowledge_points, pending[start:start + questions_per_prompt]))
+        
+        llm_questions = sum(len(batch) for _, _, batch in jobs)
+        print(f"開始處理 {total_questions} 道題目：跳過 {skipped}、無知識點 {no_knowledge_points}、詞彙預先匹配 {lexical}，"
+              f"{llm_questions} 題分成 {len(jobs)} 個批次（每批最多 {questions_per_prompt} 題）")
+        
+        matched = lexical
+        done = 0
+        executor = ThreadPoolExecutor(max_workers=section_workers)
+        try:
+            futures = {executor.submit(self.process_section_batch, knowledge_points, batch): (section_name, len(batch))
+                       for section_name, knowledge_points, batch in jobs}
+            for future in as_completed(futures):
+                section_name, count = futures[future]
+                try:
+                    matched += future.result()
+                except Exception as e:
+                    print(f"處理小節 {section_name} 的批次時發生錯誤: {e}")
+                done += count
+                print(f"[{done}/{llm_questions}] 完成小節 {section_name} 的一個批次（{count} 題）")
+        except KeyboardInterrupt:
+            print("\n使用者中斷處理！")
+            print("已儲存目前處理的結果，下次執行時會從中斷處繼續。")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        elapsed = time.perf_counter() - started
+        api_calls = self.stats["api_calls"]
+        print("\n處理完成！")
+        print(f"總題目數: {total_questions}")
+        print(f"跳過: {skipped}")
+        print(f"成功匹配: {matched}")
+        print(f"API 呼叫: {api_calls} 次（逐題模式約需 {llm_questions} 次，省下 {max(0, llm_questions - api_calls)} 次），"
+              f"其中 {self.stats['fallback_questions']} 題改用單題呼叫")
+        print(f"耗時: {elapsed:.1f} 秒，平均每題 {elapsed / max(1, llm_questions) * 1000:.0f} ms")
+        # 逐題模式的耗時以本次實際單題呼叫（改用單題的題目）的平均延遲估計
+        if self.stats["single_calls"]:
+            per_call = self.stats["single_call_seconds"] / self.stats["single_calls"]
+            sequential = per_call * llm_questions
+            print(f"逐題模式估計約需 {sequential:.1f} 秒（單題呼叫平均 {per_call * 1000:.0f} ms × {llm_questions} 題），"
+                  f"實際 {elapsed:.1f} 秒，省下 {max(0.0, sequential - elapsed):.1f} 秒")
+        else:
+            print("逐題模式耗時無法估計：本次沒有實際送出的單題呼叫")
     
     def get_questions_to_delete(self) -> List[str]:
         """取得需要刪除的題目編號清單"""
         to_delete = []
-        for result in self.results:
+        for result in self.store.iter_results():
             if result['status'] in ['skipped', 'no_knowledge_points', 'no_match']:
                 to_delete.append(result['ques_no'])
         return to_delete
@@ -270,7 +537,7 @@ class QuestionKnowledgePointMatcher:
                 
                 # 按原因分組
                 delete_reasons = {}
-                for result in self.results:
+                for result in self.store.iter_results():
                     if result['status'] in ['skipped', 'no_knowledge_points', 'no_match']:
                         reason = result['reason'] if result['reason'] else result['status']
                         if reason not in delete_reasons:
@@ -292,17 +559,39 @@ class QuestionKnowledgePointMatcher:
 
 def main():
     """主程式"""
+    parser = argparse.ArgumentParser(description='題目知識點匹配')
+    parser.add_argument('--questions-per-prompt', type=int, default=20, help='每個 prompt 合併的同小節題數，1 表示逐題呼叫')
+    parser.add_argument('--section-workers', type=int, default=4, help='批次模式下同時處理的批次數')
+    parser.add_argument('--batch-size', type=int, default=5, help='逐題模式每處理幾題暫停 1 秒')
+    parser.add_argument('--prematch', action='store_true', help='先以 TF-IDF 詞彙相似度匹配有把握的題目，其餘才呼叫 LLM')
+    parser.add_argument('--prematch-min-score', type=float, default=None, help='詞彙預先匹配的最低相似度（預設以既有 LLM 結果校準）')
+    parser.add_argument('--prematch-margin', type=float, default=None, help='最高分需領先第二名的差距（預設以既有 LLM 結果校準）')
+    parser.add_argument('--prematch-target-precision', type=float, default=0.95, help='校準門檻時要求的精確率')
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    
     matcher = QuestionKnowledgePointMatcher()
     
     # 載入資料
     if not matcher.load_data():
         return
     
+    if args.prematch:
+        matcher.prematch(args.prematch_min_score, args.prematch_margin, args.prematch_target_precision)
+    
     # 處理題目
-    matcher.process_questions(batch_size=5)  # 調整批次大小以控制 API 呼叫頻率
+    try:
+        if args.questions_per_prompt > 1:
+            matcher.process_questions_batched(args.questions_per_prompt, args.section_workers)
+        else:
+            matcher.process_questions(batch_size=args.batch_size)  # 調整批次大小以控制 API 呼叫頻率
+    finally:
+        matcher.finalize_results()
     
     # 生成刪除報告
     matcher.generate_delete_report()
+    print(f"LLM 快取: {llm_cache.snapshot()}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+知識點詞彙預先匹配 - 字元 n-gram TF-IDF，題目明顯屬於某個知識點時不必呼叫 LLM
+
+題庫題目與知識點名稱一起建立字元 2-3 gram 的 TF-IDF 稀疏矩陣，一次矩陣乘法算出所有題目
+對所有知識點的 cosine 相似度，再只保留該題所屬小節的知識點。最高分達到 min_score 且
+領先第二名至少 margin 時直接指定該知識點，其餘（模稜兩可）的題目才交給 LLM。小節只有
+一個知識點時沒有第二名可比較，也無法判斷「無匹配」，一律交給 LLM。
+
+門檻不憑經驗設定，而是以既有的 LLM 匹配結果（含 LLM 判斷無匹配的題目）評估各組門檻的
+精確率，挑出精確率達標且覆蓋率最高的一組：
+
+    python lexical_matcher.py --results processing/question_knowledge_point_matching_results.csv
+"""
+import argparse
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from near_duplicates import normalize_text
+
+DEFAULT_MIN_SCORE = 0.05
+DEFAULT_MARGIN = 0.05
+# 校準時搜尋的門檻組合、要求的精確率，以及至少需要的 LLM 標註題數
+CALIBRATION_MIN_SCORES = (0.05, 0.1, 0.15, 0.2, 0.3)
+CALIBRATION_MARGINS = (0.0, 0.02, 0.05, 0.1, 0.15, 0.2)
+DEFAULT_TARGET_PRECISION = 0.95
+MIN_LABELED_QUESTIONS = 200
+# 門檻組合至少要預先匹配這麼多題，精確率才有參考價值
+MIN_CALIBRATION_PREDICTIONS = 30
+# 詞彙預先匹配寫入結果的 reason，校準時排除，避免拿自己的預測評估自己
+LEXICAL_MATCH_REASON = "詞彙預先匹配"
+
+
+def section_knowledge_points(knowledge_points_df: pd.DataFrame) -> Dict[str, List[str]]:
+    """小節名稱 → 去重後的知識點清單（knowledge_points 欄位以「、」分隔）"""
+    sections: Dict[str, List[str]] = {}
+    for section_name, points in zip(knowledge_points_df['section_name'], knowledge_points_df['knowledge_points']):
+        if pd.isna(points):
+            continue
+        names = sections.setdefault(section_name, [])
+        for point in str(points).split('、'):
+            point = point.strip()
+            if point and point not in names:
+                names.append(point)
+    return sections
+
+
+class LexicalMatcher:
+    """以字元 n-gram TF-IDF 相似度為題目挑選所屬小節中的知識點"""
+
+    def __init__(self, min_score: float = DEFAULT_MIN_SCORE, margin: float = DEFAULT_MARGIN, ngram_range: Tuple[int, int] = (2, 3)):
+        # scikit-learn 只有預先匹配時需要，6_question_knowledge_point_matching.py 只用到 section_knowledge_points
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.min_score = min_score
+        self.margin = margin
+        self.vectorizer = TfidfVectorizer(analyzer="char", ngram_range=ngram_range, preprocessor=normalize_text, sublinear_tf=True)
+        self.point_names: List[str] = []
+        self.point_index: Dict[str, int] = {}
+        self.point_matrix = None
+
+    def fit(self, question_texts: Sequence[str], point_names: Sequence[str]) -> "LexicalMatcher":
+        """以題庫題目與知識點名稱建立詞彙與 IDF，並把知識點轉成稀疏向量"""
+        self.point_names = list(dict.fromkeys(point_names))
+        self.point_index = {name: i for i, name in enumerate(self.point_names)}
+        self.vectorizer.fit(list(question_texts) + self.point_names)
+        self.point_matrix = self.vectorizer.transform(self.point_names)
+        return self
+
+    def scores(self, question_texts: Sequence[str], candidates: Sequence[Sequence[str]]) -> np.ndarray:
+        """回傳 (題數, 知識點數) 的相似度矩陣；不在該題候選清單中的知識點為 -inf"""
+        similarity = (self.vectorizer.transform(question_texts) @ self.point_matrix.T).toarray()
+        mask = np.zeros(similarity.shape, dtype=bool)
+        rows = [row for row, names in enumerate(candidates) for name in names if name in self.point_index]
+        cols = [self.point_index[name] for names in candidates for name in names if name in self.point_index]
+        mask[rows, cols] = True
+        return np.where(mask, similarity, -np.inf)
+
+    @staticmethod
+    def top_two(scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """每題的 (最高分知識點索引, 最高分, 第二高分)；只有一個候選時第二高分為 0"""
+        if scores.shape[1] == 1:
+            return np.zeros(len(scores), dtype=int), scores[:, 0], np.zeros(len(scores))
+        order = np.argpartition(-scores, 1, axis=1)[:, :2]
+        first = np.take_along_axis(scores, order, axis=1)
+        swap = first[:, 1] > first[:, 0]
+        best = np.where(swap, order[:, 1], order[:, 0])
+        top = np.max(first, axis=1)
+        second = np.min(first, axis=1)
+        second = np.where(np.isfinite(second), second, 0.0)
+        return best, top, second
+
+    @classmethod
+    def confident(cls, scores: np.ndarray, min_score: float, margin: float) -> Tuple[np.ndarray, np.ndarray]:
+        """每題的 (最高分知識點索引, 是否有把握)；候選少於兩個的題目一律沒有把握"""
+        best, top, second = cls.top_two(scores)
+        multiple = np.isfinite(scores).sum(axis=1) >= 2
+        return best, multiple & np.isfinite(top) & (top >= min_score) & (top - second >= margin)
+
+    def predict(self, question_texts: Sequence[str], candidates: Sequence[Sequence[str]]) -> List[Optional[str]]:
+        """有把握的題目回傳知識點名稱，模稜兩可、只有一個候選或沒有候選的題目回傳 None"""
+        if not len(question_texts) or not self.point_names:
+            return [None] * len(question_texts)
+        best, confident = self.confident(self.scores(question_texts, candidates), self.min_score, self.margin)
+        return [self.point_names[index] if ok else None for index, ok in zip(best, confident)]
+
+
+def llm_labels(results: Iterable[Dict]) -> Dict[str, Optional[str]]:
+    """
+    從匹配結果取出 LLM 的判斷：題號 → 知識點（LLM 判斷無匹配時為 None）
+
+    詞彙預先匹配的結果與跳過、沒有知識點的題目不算標註。
+    """
+    labels: Dict[str, Optional[str]] = {}
+    for result in results:
+        if result.get('reason') == LEXICAL_MATCH_REASON:
+            continue
+        if result.get('status') == 'matched' and result.get('matched_knowledge_point'):
+            labels[str(result['ques_no'])] = result['matched_knowledge_point']
+        elif result.get('status') == 'no_match':
+            labels[str(result['ques_no'])] = None
+    return labels
+
+
+def precision_report(
+    question_texts: Sequence[str],
+    candidates: Sequence[Sequence[str]],
+    labels: Sequence[Optional[str]],
+    matcher: LexicalMatcher,
+    min_scores: Sequence[float],
+    margins: Sequence[float],
+) -> List[Tuple[float, float, float, float, int]]:
+    """
+    以 LLM 標註為準，回傳各門檻組合的 (min_score, margin, 覆蓋率, 精確率, 預先匹配題數)
+
+    標註為 None（LLM 判斷無匹配）的題目只要被預先匹配就算錯。
+    """
+    scores = matcher.scores(question_texts, candidates)
+    rows = []
+    for min_score in min_scores:
+        for margin in margins:
+            best, confident = matcher.confident(scores, min_score, margin)
+            predicted = np.array([matcher.point_names[index] for index in best], dtype=object)
+            correct = predicted == np.array(labels, dtype=object)
+            count = int(confident.sum())
+            precision = float(correct[confident].mean()) if count else 0.0
+            rows.append((min_score, margin, count / len(labels), precision, count))
+    return rows
+
+
+def calibrate(
+    rows: Sequence[Tuple[float, float, float, float, int]],
+    target_precision: float = DEFAULT_TARGET_PRECISION,
+    min_predictions: int = MIN_CALIBRATION_PREDICTIONS,
+) -> Optional[Tuple[float, float]]:
+    """在精確率達到 target_precision 的組合中挑覆蓋率最高（同分取較嚴格）的 (min_score, margin)"""
+    passing = [row for row in rows if row[4] >= min_predictions and row[3] >= target_precision]
+    if not passing:
+        return None
+    min_score, margin, _, _, _ = max(passing, key=lambda row: (row[2], row[1], row[0]))
+    return min_score, margin
+
+
+def labeled_inputs(
+    question_bank_df: pd.DataFrame,
+    sections: Dict[str, List[str]],
+    labels: Dict[str, Optional[str]],
+) -> Tuple[List[str], List[List[str]], List[Optional[str]]]:
+    """依題號把 LLM 標註對回題庫的完整題目與所屬小節知識點（結果檔只存前 100 字）"""
+    texts, candidates, ordered_labels = [], [], []
+    for ques_no, section_name, text in zip(
+        question_bank_df['ques_no'].astype(str), question_bank_df['section name'], question_bank_df['ques_detl']
+    ):
+        if ques_no in labels:
+            texts.append('' if pd.isna(text) else str(text))
+            candidates.append(sections.get(section_name, []))
+            ordered_labels.append(labels[ques_no])
+    return texts, candidates, ordered_labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以既有的 LLM 匹配結果評估詞彙預先匹配的精確率')
+    parser.add_argument('--results', default='processing/question_knowledge_point_matching_results.csv')
+    parser.add_argument('--qbank', default='processing/high_chem_qbank.csv')
+    parser.add_argument('--knowledge-points', default='processing/high_chem_list.csv')
+    parser.add_argument('--min-scores', type=float, nargs='+', default=list(CALIBRATION_MIN_SCORES))
+    parser.add_argument('--margins', type=float, nargs='+', default=list(CALIBRATION_MARGINS))
+    parser.add_argument('--target-precision', type=float, default=DEFAULT_TARGET_PRECISION)
+    args = parser.parse_args()
+
+    question_bank_df = pd.read_csv(args.qbank)
+    sections = section_knowledge_points(pd.read_csv(args.knowledge_points))
+    results_df = pd.read_csv(args.results, dtype={'ques_no': str}).astype(object).where(lambda df: df.notna(), None)
+    labels = llm_labels(results_df.to_dict('records'))
+    question_texts, candidates, ordered_labels = labeled_inputs(question_bank_df, sections, labels)
+    if not ordered_labels:
+        print("沒有可用的 LLM 標註")
+        return
+
+    all_points = [name for names in sections.values() for name in names]
+    matcher = LexicalMatcher().fit(question_bank_df['ques_detl'].fillna('').astype(str), all_points)
+    no_match = sum(label is None for label in ordered_labels)
+    print(f"已標註題目: {len(ordered_labels)}（其中 LLM 判斷無匹配 {no_match} 題）")
+    rows = precision_report(question_texts, candidates, ordered_labels, matcher, args.min_scores, args.margins)
+    print(f"{'min_score':>9} {'margin':>8} {'coverage':>9} {'precision':>10} {'count':>7}")
+    for min_score, margin, coverage, precision, count in rows:
+        print(f"{min_score:>9.2f} {margin:>8.2f} {coverage:>9.1%} {precision:>10.1%} {count:>7}")
+    chosen = calibrate(rows, args.target_precision)
+    if chosen:
+        print(f"建議門檻（精確率 ≥ {args.target_precision:.0%}）：--prematch-min-score {chosen[0]} --prematch-margin {chosen[1]}")
+    else:
+        print(f"沒有任何門檻組合的精確率達到 {args.target_precision:.0%}，不建議使用 --prematch")
+
+
+if __name__ == "__main__":
+    main()
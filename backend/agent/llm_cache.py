@@ -0,0 +1,257 @@
+"""
+Agent LLM 呼叫快取 - 以 SQLite（WAL）保存原始回應，重跑時相同的 prompt 不再重複付費
+
+快取鍵由供應商、模型、prompt 雜湊與其他參數（temperature、response_format 等）組成，
+值為模型回傳的原始文字（尚未 strip、解析 JSON）。之後修改解析邏輯仍可直接重用快取。
+
+- TTL：LLM_CACHE_TTL_DAYS（預設 30 天，0 表示永不過期）
+- 容量：LLM_CACHE_MAX_MB（預設 512MB），超過時依最後使用時間淘汰最舊的項目
+- 重播：--cache-only（或 LLM_CACHE_ONLY=1）只讀快取，未命中時拋出 CacheMissError，
+  不會連網；可用於確定性的重跑與離線測試
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "processing", "llm_cache.sqlite3")
+
+# 每寫入這麼多筆檢查一次容量，避免每次寫入都計算總大小
+EVICTION_CHECK_INTERVAL = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cache_key TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_hit_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit_at ON llm_cache (last_hit_at);
+"""
+
+
+class CacheMissError(RuntimeError):
+    """--cache-only 模式下快取未命中"""
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "0").lower() in ("1", "true", "yes")
+
+
+def _hash(value: Any) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    執行緒安全的 LLM 回應快取
+
+    每個執行緒各自持有一個 SQLite 連線；WAL 模式下多個執行緒（或同時執行的多支腳本）
+    可以一邊讀一邊寫。
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        ttl_days: float = 30,
+        max_mb: float = 512,
+        cache_only: bool = False,
+        enabled: bool = True,
+    ):
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0, "rejected": 0}
+        self.configure(path=path, ttl_days=ttl_days, max_mb=max_mb, cache_only=cache_only, enabled=enabled)
+
+    def configure(
+        self,
+        path: Optional[str] = None,
+        ttl_days: Optional[float] = None,
+        max_mb: Optional[float] = None,
+        cache_only: Optional[bool] = None,
+        enabled: Optional[bool] = None,
+    ) -> None:
+        """調整設定；更換路徑後各執行緒會重新建立連線"""
+        with self.lock:
+            if path is not None:
+                self.path = path
+                self._local = threading.local()
+            if ttl_days is not None:
+                self.ttl_seconds = ttl_days * 86400
+            if max_mb is not None:
+                self.max_bytes = int(max_mb * 2**20)
+            if cache_only is not None:
+                self.cache_only = cache_only
+            if enabled is not None:
+                self.enabled = enabled
+            self._writes_since_check = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[name] += amount
+
+    @staticmethod
+    def make_key(provider: str, model: str, prompt: Any, params: Dict[str, Any]) -> str:
+        return _hash([provider, model, _hash(prompt), params])
+
+    def get(self, key: str) -> Optional[str]:
+        """回傳未過期的快取回應，並更新最後使用時間"""
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT response, created_at FROM llm_cache WHERE cache_key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, created_at = row
+        if self.ttl_seconds > 0 and now - created_at > self.ttl_seconds:
+            return None
+        self._connection().execute("UPDATE llm_cache SET last_hit_at = ? WHERE cache_key = ?", (now, key))
+        return response
+
+    def put(self, key: str, provider: str, model: str, prompt: Any, params: Dict[str, Any], response: str) -> None:
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO llm_cache "
+            "(cache_key, provider, model, prompt_hash, params, response, size, created_at, last_hit_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key, provider, model, _hash(prompt),
+                json.dumps(params, ensure_ascii=False, sort_keys=True),
+                response, len(response.encode("utf-8")), now, now,
+            ),
+        )
+        with self.lock:
+            self.stats["writes"] += 1
+            self._writes_since_check += 1
+            should_check = self._writes_since_check >= EVICTION_CHECK_INTERVAL
+            if should_check:
+                self._writes_since_check = 0
+        if should_check:
+            self.evict()
+
+    def evict(self) -> int:
+        """刪除過期項目；總大小超過上限時依最後使用時間淘汰，回傳刪除筆數"""
+        connection = self._connection()
+        removed = 0
+        if self.ttl_seconds > 0:
+            removed += connection.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total > self.max_bytes:
+            # 淘汰到上限的 90%，避免之後每次檢查都剛好超過
+            excess = total - int(self.max_bytes * 0.9)
+            keys = []
+            for key, size in connection.execute("SELECT cache_key, size FROM llm_cache ORDER BY last_hit_at"):
+                keys.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            connection.executemany("DELETE FROM llm_cache WHERE cache_key = ?", keys)
+            removed += len(keys)
+        if removed:
+            self._count("evicted", removed)
+        return removed
+
+    def call(
+        self,
+        provider: str,
+        model: str,
+        prompt: Any,
+        params: Dict[str, Any],
+        fn: Callable[[], Optional[str]],
+        refresh: bool = False,
+        validate: Optional[Callable[[str], bool]] = None,
+    ) -> Optional[str]:
+        """
+        先查快取，未命中才呼叫 fn() 並寫入。
+
+        prompt 為 messages 清單或 prompt 字串；params 為其餘會影響輸出的參數。
+        refresh=True 時略過讀取（例如前一次回覆格式不符而重試），但仍會覆寫快取；
+        --cache-only 模式下不會略過，因為無法重新呼叫。
+        validate 用來檢查回覆格式：不通過的回覆照常回傳但不寫入快取，
+        已在快取中的舊回覆不通過時視為未命中，重跑時不會一直重播壞掉的回覆。
+        """
+        if not self.enabled:
+            return fn()
+        key = self.make_key(provider, model, prompt, params)
+        if not refresh or self.cache_only:
+            cached = self.get(key)
+            if cached is not None and (validate is None or validate(cached)):
+                self._count("hits")
+                return cached
+        self._count("misses")
+        if self.cache_only:
+            raise CacheMissError(f"快取未命中（{provider}/{model}）")
+        response = fn()
+        if isinstance(response, str):
+            if validate is None or validate(response):
+                self.put(key, provider, model, prompt, params, response)
+            else:
+                self._count("rejected")
+        return response
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "hit_rate": round(stats["hits"] / lookups, 3) if lookups else 0.0,
+            "cache_only": self.cache_only,
+            "path": self.path,
+        }
+
+
+def settings_from_env() -> Dict[str, Any]:
+    return {
+        "path": os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+        "ttl_days": float(os.getenv("LLM_CACHE_TTL_DAYS", 30)),
+        "max_mb": float(os.getenv("LLM_CACHE_MAX_MB", 512)),
+        "cache_only": _env_flag("LLM_CACHE_ONLY"),
+        "enabled": not _env_flag("LLM_CACHE_DISABLED"),
+    }
+
+
+llm_cache = LLMCache(**settings_from_env())
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """加入 --cache-only、--no-cache、--cache-path 參數"""
+    parser.add_argument('--cache-only', action='store_true', help='只使用 LLM 快取，未命中視為失敗，不呼叫 API')
+    parser.add_argument('--no-cache', action='store_true', help='停用 LLM 快取')
+    parser.add_argument('--cache-path', default=None, help=f'LLM 快取檔路徑（預設 {DEFAULT_CACHE_PATH}）')
+
+
+def configure_from_args(args: argparse.Namespace) -> None:
+    """依環境變數（此時 .env 已載入）與命令列參數設定共用快取"""
+    if args.cache_only and args.no_cache:
+        raise SystemExit("--cache-only 與 --no-cache 不能同時使用")
+    settings = settings_from_env()
+    if args.cache_path:
+        settings["path"] = args.cache_path
+    if args.cache_only:
+        settings["cache_only"] = True
+    if args.no_cache:
+        settings["enabled"] = False
+    llm_cache.configure(**settings)
@@ -0,0 +1,85 @@
+"""
+知識點匹配器資料存取基準測試
+
+把題庫複製成指定列數（預設 10 萬列），不呼叫 LLM，只量測每一題「取出欄位、建立結果記錄、
+查詢小節知識點」的額外開銷：
+
+- legacy：iterrows 逐列取值，每題以布林遮罩篩選知識點表再 iterrows 解析
+- current：欄位先轉成字串清單逐題 zip，知識點清單在載入時解析成 dict
+
+用法：
+    python matcher_benchmark.py --rows 100000
+"""
+import argparse
+import importlib
+import time
+
+import pandas as pd
+
+from lexical_matcher import section_knowledge_points
+
+matching = importlib.import_module("6_question_knowledge_point_matching")
+
+
+def legacy_section_knowledge_points(knowledge_points_df, section_name):
+    """原本的 get_section_knowledge_points：每次呼叫都篩選並 iterrows"""
+    filtered_df = knowledge_points_df[knowledge_points_df['section_name'] == section_name]
+    knowledge_points = []
+    for _, row in filtered_df.iterrows():
+        if pd.notna(row['knowledge_points']):
+            points = str(row['knowledge_points']).split('、')
+            knowledge_points.extend([point.strip() for point in points if point.strip()])
+    return list(set(knowledge_points))
+
+
+def legacy_pass(matcher, question_bank_df, knowledge_points_df):
+    for _, row in question_bank_df.iterrows():
+        question_text = str(row['ques_detl']) if pd.notna(row['ques_detl']) else ""
+        section_name = str(row['section name']) if pd.notna(row['section name']) else ""
+        matcher.should_skip_question(question_text)
+        legacy_section_knowledge_points(knowledge_points_df, section_name)
+
+
+def current_pass(matcher):
+    for result, _ in matcher.iter_questions():
+        if result['status'] != 'skipped':
+            matcher.section_points.get(result['section_name'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='知識點匹配器資料存取基準測試')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--qbank', default='processing/high_chem_qbank.csv')
+    parser.add_argument('--knowledge-points', default='processing/high_chem_list.csv')
+    parser.add_argument('--legacy-rows', type=int, default=10000, help='legacy 只量測前幾列再換算（逐列篩選太慢）')
+    args = parser.parse_args()
+
+    knowledge_points_df = pd.read_csv(args.knowledge_points)
+    base = pd.read_csv(args.qbank)
+    repeats = -(-args.rows // len(base))
+    question_bank_df = pd.concat([base] * repeats, ignore_index=True).head(args.rows)
+    question_bank_df['ques_no'] = range(1, len(question_bank_df) + 1)
+
+    matcher = matching.QuestionKnowledgePointMatcher.__new__(matching.QuestionKnowledgePointMatcher)
+    matcher.question_bank_df = question_bank_df
+    matcher.knowledge_points_df = knowledge_points_df
+
+    started = time.perf_counter()
+    matcher.section_points = section_knowledge_points(knowledge_points_df)
+    current_pass(matcher)
+    current = time.perf_counter() - started
+
+    legacy_rows = min(args.legacy_rows, len(question_bank_df))
+    started = time.perf_counter()
+    legacy_pass(matcher, question_bank_df.head(legacy_rows), knowledge_points_df)
+    legacy = time.perf_counter() - started
+
+    print(f"題庫列數: {len(question_bank_df)}")
+    print(f"{'mode':<10} {'rows':>8} {'total(s)':>10} {'per-row(us)':>12}")
+    print(f"{'legacy':<10} {legacy_rows:>8} {legacy:>10.2f} {legacy / legacy_rows * 1e6:>12.1f}")
+    print(f"{'current':<10} {len(question_bank_df):>8} {current:>10.2f} {current / len(question_bank_df) * 1e6:>12.1f}")
+    print(f"legacy 換算 {len(question_bank_df)} 列約 {legacy / legacy_rows * len(question_bank_df):.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
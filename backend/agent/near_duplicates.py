@@ -0,0 +1,331 @@
+"""
+近似重複題目偵測 - 字元 shingle + MinHash + LSH
+
+題目先去掉空白與標點，切成連續 k 個字元的 shingle（中文不需斷詞），再以 MinHash
+簽章估計兩題 shingle 集合的 Jaccard 相似度。LSH 把簽章分成多個 band，只有至少一個
+band 完全相同的題目才會被拿來比對，查詢時間與題庫大小幾乎無關（一般題目長度下
+每次查詢遠低於 1 毫秒）。
+
+5_generate_questions.py 在驗證前用它捨棄與題庫、參考題目或同批新題目過於相似的題目；
+也可以離線列出題庫中既有的重複群組：
+
+    python near_duplicates.py --csv processing/high_chem_qbank.csv --threshold 0.8
+    python near_duplicates.py --db --subject 高中化學 --output duplicate_clusters.csv
+"""
+import argparse
+import csv
+import itertools
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 3
+
+# 大於 2^32 的質數；a < 2^31、x < 2^32，a * x + b 不會超出 uint64
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    """去掉空白與標點並轉小寫，只保留文字與數字"""
+    return _NON_WORD.sub("", str(text)).lower()
+
+
+def question_fingerprint(question_text: str, options: Iterable[Any] = ()) -> str:
+    """
+    題幹加上選項作為比對文字
+
+    只比題幹時，題幹相同但選項不同的題目會被誤判為重複；題庫 CSV 的題目文字本來就含選項，
+    加上選項後生成題目與題庫、參考題目的比對方式也一致。
+    """
+    return " ".join(str(part) for part in (question_text, *options) if part)
+
+
+def shingles(text: str, size: int = DEFAULT_SHINGLE_SIZE) -> List[str]:
+    normalized = normalize_text(text)
+    if len(normalized) <= size:
+        return [normalized] if normalized else []
+    return list({normalized[i:i + size] for i in range(len(normalized) - size + 1)})
+
+
+def _false_probabilities(threshold: float, bands: int, rows: int, steps: int = 100) -> Tuple[float, float]:
+    """以數值積分估計某個 (bands, rows) 設定的誤判（低於門檻卻成為候選）與漏判機率"""
+    def probability(s: float) -> float:
+        return 1 - (1 - s ** rows) ** bands
+
+    false_positive = sum(probability(threshold * i / steps) for i in range(steps)) * threshold / steps
+    false_negative = sum(1 - probability(threshold + (1 - threshold) * i / steps) for i in range(steps)) * (1 - threshold) / steps
+    return false_positive, false_negative
+
+
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """選擇誤判加漏判最小的 (bands, rows)；漏判權重較高，因為候選還會再算一次相似度"""
+    best, best_cost = (num_perm, 1), float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        false_positive, false_negative = _false_probabilities(threshold, bands, rows)
+        cost = 0.3 * false_positive + 0.7 * false_negative
+        if cost < best_cost:
+            best, best_cost = (bands, rows), cost
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    MinHash LSH 索引（執行緒安全）
+
+    check_and_add 在同一把鎖內完成查詢與加入，同時生成的兩道相似題目只會保留先到的一題。
+    新題目沒有通過驗證時應以 remove 移除，之後重新生成的相似題目才不會被誤判為重複。
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        num_perm: int = DEFAULT_NUM_PERM,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+        seed: int = 1,
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, 2**31, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, 2**31, size=num_perm, dtype=np.uint64)
+        self.buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(self.bands)]
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.texts: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self._auto_key = itertools.count()
+        self.stats = {"queries": 0, "duplicates": 0, "query_seconds": 0.0}
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def signature(self, text: str) -> np.ndarray:
+        values = shingles(text, self.shingle_size)
+        if not values:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(value.encode("utf-8")) for value in values), dtype=np.uint64, count=len(values))
+        permuted = (np.outer(hashes, self.a) + self.b) % _PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _insert(self, key: str, text: str, signature: np.ndarray) -> None:
+        self.signatures[key] = signature
+        self.texts[key] = text
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def _best_match(self, signature: np.ndarray, exclude: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+        candidates.discard(exclude)
+        best = None
+        for candidate in candidates:
+            similarity = float(np.mean(self.signatures[candidate] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        return best
+
+    def add(self, key: str, text: str) -> None:
+        signature = self.signature(text)
+        with self.lock:
+            self._insert(key, text, signature)
+
+    def remove(self, key: str) -> bool:
+        """從索引移除一題，回傳是否存在"""
+        with self.lock:
+            signature = self.signatures.pop(key, None)
+            if signature is None:
+                return False
+            del self.texts[key]
+            for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+                keys = bucket.get(band_key)
+                if keys and key in keys:
+                    keys.remove(key)
+                    if not keys:
+                        del bucket[band_key]
+            return True
+
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        for key, text in items:
+            self.add(key, text)
+
+    def query(self, text: str) -> Optional[Tuple[str, float]]:
+        """回傳最相似且超過門檻的 (key, 相似度)，沒有則為 None"""
+        signature = self.signature(text)
+        with self.lock:
+            return self._best_match(signature)
+
+    def check_and_add(self, text: str, key: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        """已有近似重複題目時回傳 (key, 相似度) 且不加入；否則加入索引並回傳 None"""
+        started = time.perf_counter()
+        signature = self.signature(text)
+        with self.lock:
+            match = self._best_match(signature)
+            if match is None:
+                self._insert(key or f"new:{next(self._auto_key)}", text, signature)
+            self.stats["queries"] += 1
+            self.stats["duplicates"] += match is not None
+            self.stats["query_seconds"] += time.perf_counter() - started
+        return match
+
+    def clusters(self) -> List[List[Tuple[str, float]]]:
+        """以 union-find 合併所有超過門檻的配對，回傳大小至少 2 的群組（每題附與群組首題的相似度）"""
+        parent = {key: key for key in self.signatures}
+
+        def find(key: str) -> str:
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for bucket in self.buckets:
+            for keys in bucket.values():
+                if len(keys) < 2:
+                    continue
+                for first, second in itertools.combinations(keys, 2):
+                    if find(first) == find(second):
+                        continue
+                    similarity = float(np.mean(self.signatures[first] == self.signatures[second]))
+                    if similarity >= self.threshold:
+                        parent[find(second)] = find(first)
+
+        groups: Dict[str, List[str]] = {}
+        for key in self.signatures:
+            groups.setdefault(find(key), []).append(key)
+        result = []
+        for keys in groups.values():
+            if len(keys) < 2:
+                continue
+            head = self.signatures[keys[0]]
+            result.append([(key, float(np.mean(self.signatures[key] == head))) for key in keys])
+        return sorted(result, key=len, reverse=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            queries = self.stats["queries"]
+            return {
+                "indexed": len(self.signatures),
+                "queries": queries,
+                "duplicates": self.stats["duplicates"],
+                "avg_query_ms": round(self.stats["query_seconds"] / queries * 1000, 3) if queries else 0.0,
+                "bands": self.bands,
+                "rows": self.rows,
+            }
+
+
+def fetch_bank_questions(connection, subject: Optional[str] = None) -> List[Tuple[str, str]]:
+    """讀取題庫題目，回傳 [("q:<id>", 題幹加選項)]；指定 subject 時只取該學科"""
+    columns = "q.id, q.question_text, q.option_1, q.option_2, q.option_3, q.option_4"
+    with connection.cursor() as cursor:
+        if subject:
+            cursor.execute(
+                f"""
+                SELECT {columns} FROM questions q
+                JOIN knowledge_points kp ON q.knowledge_id = kp.id
+                JOIN chapter_list c ON kp.chapter_id = c.id
+                WHERE c.subject = %s
+                """,
+                (subject,),
+            )
+        else:
+            cursor.execute(f"SELECT {columns} FROM questions q")
+        return [
+            (
+                f"q:{row['id']}",
+                question_fingerprint(row['question_text'], (row[f'option_{i}'] for i in range(1, 5))),
+            )
+            for row in cursor.fetchall()
+            if row['question_text']
+        ]
+
+
+def _read_csv_questions(path: str, column: str, id_column: str) -> List[Tuple[str, str]]:
+    with open(path, encoding="utf-8-sig") as f:
+        return [
+            (f"{os.path.basename(path)}:{row.get(id_column) or index}", row[column])
+            for index, row in enumerate(csv.DictReader(f))
+            if row.get(column)
+        ]
+
+
+def _connect_db():
+    """本地透過 Cloud SQL Proxy 連線（與 5_generate_questions.py 相同的環境變數）"""
+    import pymysql
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return pymysql.connect(
+        host=os.getenv('DB_HOST', '127.0.0.1'),
+        port=int(os.getenv('DB_PORT', 5433)),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME'),
+        cursorclass=pymysql.cursors.DictCursor,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='列出題庫中的近似重複題目群組')
+    parser.add_argument('--csv', nargs='*', default=[], help='題庫 CSV 檔')
+    parser.add_argument('--column', default='ques_detl', help='CSV 中的題目欄位')
+    parser.add_argument('--id-column', default='ques_no', help='CSV 中的題號欄位')
+    parser.add_argument('--db', action='store_true', help='讀取資料庫 questions 資料表')
+    parser.add_argument('--subject', default=None, help='只讀取此學科的題目（搭配 --db）')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Jaccard 相似度門檻')
+    parser.add_argument('--shingle-size', type=int, default=DEFAULT_SHINGLE_SIZE)
+    parser.add_argument('--top', type=int, default=20, help='印出前幾個最大的群組')
+    parser.add_argument('--output', default=None, help='把所有群組寫入 CSV')
+    args = parser.parse_args()
+
+    questions = []
+    for path in args.csv:
+        questions.extend(_read_csv_questions(path, args.column, args.id_column))
+    if args.db:
+        connection = _connect_db()
+        try:
+            questions.extend(fetch_bank_questions(connection, args.subject))
+        finally:
+            connection.close()
+    if not questions:
+        parser.error("沒有題目可以比對，請指定 --csv 或 --db")
+
+    index = NearDuplicateIndex(threshold=args.threshold, shingle_size=args.shingle_size)
+    started = time.perf_counter()
+    index.add_many(questions)
+    indexed = time.perf_counter() - started
+    clusters = index.clusters()
+    duplicated = sum(len(cluster) - 1 for cluster in clusters)
+    print(f"題目數: {len(questions)}，建立索引 {indexed:.2f}s（bands={index.bands}, rows={index.rows}）")
+    print(f"近似重複群組: {len(clusters)}，可刪除 {duplicated} 題（每群保留一題）")
+
+    for number, cluster in enumerate(clusters[:args.top], 1):
+        print(f"\n群組 {number}（{len(cluster)} 題）")
+        for key, similarity in cluster:
+            print(f"  {key}  相似度 {similarity:.2f}  {index.texts[key][:40]}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["cluster", "key", "similarity", "question_text"])
+            for number, cluster in enumerate(clusters, 1):
+                for key, similarity in cluster:
+                    writer.writerow([number, key, f"{similarity:.3f}", index.texts[key]])
+        print(f"\n已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+題庫批次寫入 - 章節 / 知識點 ID 走記憶體快取，題目累積後每個小節一次交易寫入
+
+原本每道題目、每個章節與知識點都各自 SELECT 再 INSERT 並 commit，生成 1 萬題就有數萬次
+資料庫往返。改為：
+
+- 啟動時一次讀入所有章節與知識點的 ID，之後查詢都在記憶體完成
+- 通過驗證的題目先放在小節的緩衝區，小節全部驗證完才 flush
+- flush 在同一個交易內建立缺少的章節與知識點，再用 executemany 一次寫入所有題目；
+  失敗時整個小節 rollback，--resume 重跑時不會留下半個小節的題目
+"""
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class SectionBuffer:
+    """單一小節通過驗證的題目（多個執行緒同時加入）"""
+
+    def __init__(self, writer: "QuestionBankWriter", section_data: Dict[str, Any]):
+        self.writer = writer
+        self.section_data = section_data
+        self.rows: List[Tuple[str, Dict[str, Any], str]] = []
+        self.lock = threading.Lock()
+
+    def add(self, point_name: str, question_data: Dict[str, Any], explanation: str) -> None:
+        with self.lock:
+            self.rows.append((point_name, dict(question_data), explanation))
+
+    def flush(self, point_names: List[str]) -> int:
+        """寫入章節、point_names 的知識點與緩衝的題目，回傳寫入題數"""
+        with self.lock:
+            rows = list(self.rows)
+        saved = self.writer.write_section(self.section_data, point_names, rows)
+        with self.lock:
+            self.rows = self.rows[len(rows):]
+        return saved
+
+
+class QuestionBankWriter:
+    """
+    題庫寫入器
+
+    connection_factory 回傳 DictCursor 的 pymysql 連線。flush 期間持有鎖，各小節的
+    交易依序執行，避免兩個小節同時建立同一個章節。
+    """
+
+    def __init__(self, connection_factory: Callable[[], Any], subject: str):
+        self.connection_factory = connection_factory
+        self.subject = subject
+        self.chapters: Dict[str, int] = {}
+        self.knowledge_points: Dict[Tuple[str, str], int] = {}
+        self.lock = threading.Lock()
+        self.stats = {"round_trips": 0, "sections": 0, "questions": 0, "chapters_created": 0, "knowledge_points_created": 0}
+
+    def _execute(self, cursor, sql: str, args=None) -> None:
+        cursor.execute(sql, args)
+        self.stats["round_trips"] += 1
+
+    def load(self) -> None:
+        """從資料庫預先載入該學科的章節與所有知識點 ID"""
+        connection = self.connection_factory()
+        try:
+            with connection.cursor() as cursor:
+                self._execute(cursor, "SELECT id, chapter_name FROM chapter_list WHERE subject = %s", (self.subject,))
+                chapters = {row['chapter_name']: row['id'] for row in cursor.fetchall()}
+                # 知識點以 (小節名稱, 知識點名稱) 識別，與原本的查詢條件相同
+                self._execute(cursor, "SELECT id, section_name, point_name FROM knowledge_points")
+                knowledge_points = {(row['section_name'], row['point_name']): row['id'] for row in cursor.fetchall()}
+        finally:
+            connection.close()
+        with self.lock:
+            self.chapters.update(chapters)
+            self.knowledge_points.update(knowledge_points)
+        print(f"[題庫寫入] 已載入 {len(chapters)} 個章節、{len(knowledge_points)} 個知識點")
+
+    def has_chapter(self, chapter_name: str) -> bool:
+        with self.lock:
+            return chapter_name in self.chapters
+
+    def section(self, section_data: Dict[str, Any]) -> SectionBuffer:
+        return SectionBuffer(self, section_data)
+
+    def _ensure_chapter(self, cursor, section_data: Dict[str, Any], created: Dict[str, int]) -> int:
+        chapter_name = section_data['chapter_name']
+        chapter_id = self.chapters.get(chapter_name)
+        if chapter_id:
+            return chapter_id
+        self._execute(
+            cursor,
+            """
+            INSERT INTO chapter_list
+            (subject, year_grade, book, chapter_num, chapter_name)
+            VALUES (%s, %s, %s, %s, %s)
+            """,
+            (
+                self.subject,
+                int(section_data['year_grade']),
+                section_data['book'],
+                int(section_data['chapter_num']),
+                chapter_name,
+            ),
+        )
+        created[chapter_name] = cursor.lastrowid
+        print(f"[題庫寫入] 創建新章節 {chapter_name}，章節 ID: {cursor.lastrowid}")
+        return cursor.lastrowid
+
+    def _ensure_knowledge_points(
+        self, cursor, chapter_id: int, section_data: Dict[str, Any], point_names: List[str]
+    ) -> Dict[str, int]:
+        section_name = section_data['section_name']
+        ids = {name: self.knowledge_points[(section_name, name)] for name in point_names if (section_name, name) in self.knowledge_points}
+        missing = [name for name in dict.fromkeys(point_names) if name not in ids]
+        if not missing:
+            return ids
+        cursor.executemany(
+            """
+            INSERT INTO knowledge_points
+            (section_num, section_name, point_name, chapter_id)
+            VALUES (%s, %s, %s, %s)
+            """,
+            [(int(section_data['section_num']), section_name, name, chapter_id) for name in missing],
+        )
+        self.stats["round_trips"] += 1
+        # 多列 INSERT 的自動遞增 ID 不保證連續，再查一次取得實際 ID
+        placeholders = ", ".join(["%s"] * len(missing))
+        self._execute(
+            cursor,
+            f"SELECT id, point_name FROM knowledge_points WHERE section_name = %s AND point_name IN ({placeholders})",
+            (section_name, *missing),
+        )
+        for row in cursor.fetchall():
+            ids[row['point_name']] = row['id']
+        print(f"[題庫寫入] 創建 {len(missing)} 個新知識點: {'、'.join(missing)}")
+        return ids
+
+    def write_section(
+        self,
+        section_data: Dict[str, Any],
+        point_names: List[str],
+        rows: List[Tuple[str, Dict[str, Any], str]],
+    ) -> int:
+        """在一個交易內建立章節、知識點並寫入題目；失敗時 rollback 並拋出錯誤"""
+        point_names = list(point_names) + [name for name, _, _ in rows if name not in point_names]
+        with self.lock:
+            connection = self.connection_factory()
+            created_chapters: Dict[str, int] = {}
+            try:
+                with connection.cursor() as cursor:
+                    chapter_id = self._ensure_chapter(cursor, section_data, created_chapters)
+                    knowledge_ids = self._ensure_knowledge_points(cursor, chapter_id, section_data, point_names)
+                    if rows:
+                        cursor.executemany(
+                            """
+                            INSERT INTO questions
+                            (knowledge_id, question_text, option_1, option_2, option_3, option_4, correct_answer, explanation)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                            """,
+                            [
+                                (
+                                    knowledge_ids[point_name],
+                                    question_data['question'],
+                                    question_data['options'][0],
+                                    question_data['options'][1],
+                                    question_data['options'][2],
+                                    question_data['options'][3],
+                                    question_data['answer'],
+                                    explanation,
+                                )
+                                for point_name, question_data, explanation in rows
+                            ],
+                        )
+                        self.stats["round_trips"] += 1
+                connection.commit()
+                self.stats["round_trips"] += 1
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                connection.close()
+
+            # 交易成功後才更新快取，rollback 的 ID 不會被後續小節使用
+            section_name = section_data['section_name']
+            new_points = {
+                (section_name, name): knowledge_id for name, knowledge_id in knowledge_ids.items()
+                if (section_name, name) not in self.knowledge_points
+            }
+            self.chapters.update(created_chapters)
+            self.knowledge_points.update(new_points)
+            self.stats["chapters_created"] += len(created_chapters)
+            self.stats["knowledge_points_created"] += len(new_points)
+            self.stats["sections"] += 1
+            self.stats["questions"] += len(rows)
+
+        print(f"[題庫寫入] 小節 {section_data['section_name']}: 一次交易寫入 {len(rows)} 道題目")
+        return len(rows)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.stats)
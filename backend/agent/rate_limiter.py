@@ -0,0 +1,184 @@
+"""
+LLM 供應商限流 - 每個供應商各自的 token bucket、併發上限與 429 自適應退避
+
+取代固定的 time.sleep(1)：呼叫前先向該供應商的 token bucket 取得配額，遇到 429 時
+整個供應商一起暫停（指數退避加抖動）並把速率減半，之後每次成功再慢慢加回設定值。
+速率以每分鐘請求數設定，例如 GEMINI_RPM=300、OPENAI_RPM=500、DEEPSEEK_RPM=120。
+"""
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import openai
+
+# 可重試的錯誤：429 走自適應退避，其他暫時性錯誤只做一般退避
+RATE_LIMIT_ERRORS = (openai.RateLimitError,)
+TRANSIENT_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class TokenBucket:
+    """執行緒安全的 token bucket：每秒補充 rate 個，最多累積 capacity 個"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate_per_minute: float) -> None:
+        with self.lock:
+            self._refill()
+            self.rate = rate_per_minute / 60.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self) -> None:
+        """取得一個 token，不足時等待"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ProviderLimiter:
+    """
+    單一供應商的限流器
+
+    - token bucket 控制每分鐘請求數
+    - semaphore 控制同時進行中的請求數
+    - 429 時所有執行緒一起冷卻，速率乘以 backoff_factor；成功後每次加回 recovery_step
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        max_concurrency: int,
+        max_retries: int = 5,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0,
+        backoff_factor: float = 0.5,
+        min_rate_ratio: float = 0.1,
+    ):
+        self.name = name
+        self.target_rpm = requests_per_minute
+        self.current_rpm = requests_per_minute
+        self.bucket = TokenBucket(requests_per_minute)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.backoff_factor = backoff_factor
+        self.min_rpm = requests_per_minute * min_rate_ratio
+        self.recovery_step = max(1.0, requests_per_minute * 0.02)
+        self.cooldown_until = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "rate_limited": 0, "retries": 0, "failures": 0}
+
+    def _wait_cooldown(self) -> None:
+        while True:
+            remaining = self.cooldown_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _on_rate_limited(self, attempt: int) -> float:
+        delay = random.uniform(self.backoff_base, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        with self.lock:
+            self.stats["rate_limited"] += 1
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+            self.current_rpm = max(self.min_rpm, self.current_rpm * self.backoff_factor)
+            self.bucket.set_rate(self.current_rpm)
+        print(f"⚠️ [{self.name}] 429，暫停 {delay:.1f}s，速率降為 {self.current_rpm:.0f}/min")
+        return delay
+
+    def _on_success(self) -> None:
+        if self.current_rpm >= self.target_rpm:
+            return
+        with self.lock:
+            self.current_rpm = min(self.target_rpm, self.current_rpm + self.recovery_step)
+            self.bucket.set_rate(self.current_rpm)
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """在限流下呼叫 fn；429 與暫時性錯誤會重試，超過次數則拋出最後的錯誤"""
+        for attempt in range(self.max_retries + 1):
+            self._wait_cooldown()
+            self.bucket.acquire()
+            delay = None
+            with self.semaphore:
+                try:
+                    result = fn(*args, **kwargs)
+                except RATE_LIMIT_ERRORS:
+                    if attempt >= self.max_retries:
+                        self.stats["failures"] += 1
+                        raise
+                    self.stats["retries"] += 1
+                    self._on_rate_limited(attempt)
+                    continue
+                except TRANSIENT_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        self.stats["failures"] += 1
+                        raise
+                    self.stats["retries"] += 1
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                    print(f"⚠️ [{self.name}] {type(e).__name__}，{delay:.1f}s 後重試")
+            if delay is not None:
+                time.sleep(delay)
+                continue
+            self.stats["calls"] += 1
+            self._on_success()
+            return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "current_rpm": round(self.current_rpm, 1), "target_rpm": self.target_rpm}
+
+
+def limiter_from_env(name: str, default_rpm: float, default_concurrency: int) -> ProviderLimiter:
+    """由環境變數 <NAME>_RPM 與 <NAME>_MAX_CONCURRENCY 建立限流器"""
+    prefix = name.upper()
+    return ProviderLimiter(
+        name,
+        requests_per_minute=float(os.getenv(f"{prefix}_RPM", default_rpm)),
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", default_concurrency)),
+    )
+
+
+class ThroughputMeter:
+    """統計每分鐘處理與通過的題數，以及其他具名計數（例如提前捨棄次數）"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.processed = 0
+        self.accepted = 0
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def record(self, accepted: bool) -> None:
+        with self.lock:
+            self.processed += 1
+            if accepted:
+                self.accepted += 1
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def summary(self) -> str:
+        minutes = max(1e-9, (time.monotonic() - self.started_at) / 60)
+        text = (
+            f"已處理 {self.processed} 題（通過 {self.accepted}），"
+            f"{self.processed / minutes:.1f} 題/分鐘，通過 {self.accepted / minutes:.1f} 題/分鐘"
+        )
+        if self.counters:
+            text += "，" + "、".join(f"{name}={value}" for name, value in sorted(self.counters.items()))
+        return text
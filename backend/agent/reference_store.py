@@ -0,0 +1,147 @@
+"""
+參考題目儲存 - 匹配結果 CSV 一次索引成以知識點為鍵的 SQLite，按小節載入並挑選多樣的子集
+
+原本 load_reference_questions 會把整個匹配結果 CSV 讀進記憶體，生成題目時又把每個知識點
+的所有參考題目都塞進 prompt。改為：
+
+- 第一次使用（或 CSV 有更新）時以串流方式讀 CSV，寫入 processing/reference_questions.sqlite3
+- 處理小節時才查詢該小節知識點的參考題目
+- 每個知識點最多挑 per_point 題：依序選出與已選題目字元 shingle 相似度最低的題目，
+  避免挑到幾乎相同的題目，也讓每次生成的 prompt 長度有上限；挑選結果是確定的，
+  重跑時 prompt 不變，可以命中 LLM 快取
+"""
+import csv
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from near_duplicates import shingles
+
+DEFAULT_CSV_PATH = "processing/question_knowledge_point_matching_results.csv"
+DEFAULT_DB_PATH = "processing/reference_questions.sqlite3"
+DEFAULT_PER_POINT = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reference_questions (
+    knowledge_point TEXT NOT NULL,
+    subject TEXT,
+    chapter_name TEXT,
+    section_name TEXT,
+    question_text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reference_questions_point ON reference_questions (knowledge_point);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def _jaccard(first: set, second: set) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def diverse_sample(questions: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    從參考題目中挑出最多 limit 題：先取最長的一題，之後每次加入與已選題目最大相似度最低的題目
+    """
+    if len(questions) <= limit:
+        return questions
+    shingle_sets = [set(shingles(question['question_text'])) for question in questions]
+    first = max(range(len(questions)), key=lambda i: len(questions[i]['question_text']))
+    chosen = [first]
+    # 每題與已選題目的最大相似度
+    closest = [_jaccard(shingle_sets[i], shingle_sets[first]) for i in range(len(questions))]
+    while len(chosen) < limit:
+        candidates = [i for i in range(len(questions)) if i not in chosen]
+        best = min(candidates, key=lambda i: (closest[i], i))
+        chosen.append(best)
+        for i in candidates:
+            closest[i] = max(closest[i], _jaccard(shingle_sets[i], shingle_sets[best]))
+    return [questions[i] for i in sorted(chosen)]
+
+
+class ReferenceStore:
+    """以知識點為鍵的參考題目儲存（執行緒安全）"""
+
+    def __init__(self, csv_path: str = DEFAULT_CSV_PATH, db_path: str = DEFAULT_DB_PATH, per_point: int = DEFAULT_PER_POINT):
+        self.csv_path = csv_path
+        self.db_path = db_path
+        self.per_point = per_point
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def _source_signature(self) -> str:
+        stat = os.stat(self.csv_path)
+        return f"{os.path.abspath(self.csv_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def build(self, force: bool = False) -> int:
+        """CSV 比索引新時重建索引，回傳索引中的題數"""
+        if not os.path.exists(self.csv_path):
+            print(f"錯誤：參考題目文件不存在: {self.csv_path}")
+            return 0
+        signature = self._source_signature()
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+            if row and row[0] == signature and not force:
+                return self.connection.execute("SELECT COUNT(*) FROM reference_questions").fetchone()[0]
+
+            print(f"建立參考題目索引: {self.csv_path} → {self.db_path}")
+            with self.connection:
+                self.connection.execute("DELETE FROM reference_questions")
+                count = 0
+                with open(self.csv_path, 'r', encoding='utf-8-sig') as file:
+                    rows = (
+                        (
+                            row['matched_knowledge_point'].strip(),
+                            row.get('subject', ''),
+                            row.get('chapter_name', ''),
+                            row.get('section_name', ''),
+                            row['question_text'],
+                        )
+                        for row in csv.DictReader(file)
+                        if row.get('matched_knowledge_point') and row.get('question_text')
+                    )
+                    batch = []
+                    for values in rows:
+                        batch.append(values)
+                        if len(batch) >= 1000:
+                            self.connection.executemany("INSERT INTO reference_questions VALUES (?, ?, ?, ?, ?)", batch)
+                            count += len(batch)
+                            batch = []
+                    self.connection.executemany("INSERT INTO reference_questions VALUES (?, ?, ?, ?, ?)", batch)
+                    count += len(batch)
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)", (signature,))
+            print(f"參考題目索引完成: {count} 題")
+            return count
+
+    def questions_for(self, point: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT subject, chapter_name, section_name, question_text FROM reference_questions "
+                "WHERE knowledge_point = ? ORDER BY rowid",
+                (point,),
+            ).fetchall()
+        return [
+            {"subject": subject, "chapter_name": chapter_name, "section_name": section_name, "question_text": question_text}
+            for subject, chapter_name, section_name, question_text in rows
+        ]
+
+    def sample_for_points(self, points: Sequence[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """一個小節的參考題目：{知識點: 挑選後的參考題目}，沒有參考題目的知識點不會出現"""
+        references = {}
+        for point in points:
+            questions = self.questions_for(point)
+            if questions:
+                references[point] = diverse_sample(questions, self.per_point)
+        return references
+
+    def iter_questions(self, points: Sequence[str]) -> Iterator[Tuple[str, str]]:
+        """逐題產生 (鍵, 題目內容)，供近似重複索引使用"""
+        for point in points:
+            for i, question in enumerate(self.questions_for(point)):
+                yield f"ref:{point}:{i}", question['question_text']
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,172 @@
+"""
+匹配結果的 append-only 儲存 - JSONL 主檔 + 已處理題號索引
+
+原本每一題都建立一個 DataFrame 再 to_csv 追加，續傳時要把整個 CSV 讀進 pandas。改為：
+
+- 結果逐筆寫成一行 JSON，先累積在記憶體，每 flush_every 筆或每 fsync_interval 秒才寫入並 fsync
+- 每次 flush 同時把題號追加到 <主檔>.idx，續傳時只讀這個小檔案就能得到已處理題號
+- 結束時（或需要時）由 JSONL 匯出原本的 CSV 格式，其他腳本照舊讀 CSV
+
+程式中斷時最多遺失最後一批尚未 flush 的結果，下次執行會重新處理這些題目；寫到一半的
+最後一行在 load 時截掉，之後追加的記錄才不會接在殘行後面而無法解析。
+"""
+import csv
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set
+
+RESULT_COLUMNS = [
+    'ques_no', 'subject', 'chapter_name', 'section_name', 'question_text',
+    'matched_knowledge_point', 'status', 'reason',
+]
+
+
+class ResultStore:
+    """執行緒安全的 append-only 結果儲存"""
+
+    def __init__(self, path: str, flush_every: int = 50, fsync_interval: float = 2.0):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.flush_every = flush_every
+        self.fsync_interval = fsync_interval
+        self.processed: Set[str] = set()
+        self.buffer: List[Dict] = []
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.stats = {"written": 0, "flushes": 0}
+
+    def __len__(self) -> int:
+        return len(self.processed)
+
+    def _last_record(self) -> Optional[Dict]:
+        """讀取主檔最後一筆完整的記錄（只讀檔尾）"""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 65536))
+            for line in reversed(f.read().splitlines()):
+                try:
+                    return json.loads(line)
+                except ValueError:
+                    continue
+        return None
+
+    @staticmethod
+    def _truncate_torn_tail(path: str) -> None:
+        """檔案不是以換行結尾時（寫入中斷），截掉最後一個換行之後的殘行"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # 由檔尾往前找最後一個換行
+            position = size
+            while position > 0:
+                start = max(0, position - 65536)
+                f.seek(start)
+                chunk = f.read(position - start)
+                newline = chunk.rfind(b'\n')
+                if newline != -1:
+                    position = start + newline + 1
+                    break
+                position = start
+            f.truncate(position)
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"已截掉 {path} 中斷時寫到一半的最後一行（{size - position} bytes）")
+
+    def load(self, legacy_csv_path: Optional[str] = None) -> Set[str]:
+        """
+        載入已處理題號並回傳
+
+        索引檔與主檔最後一筆不一致（例如寫入主檔後、寫入索引前中斷）時由主檔重建索引；
+        主檔不存在但有舊的 CSV 結果時先匯入一次。
+        """
+        if not os.path.exists(self.path) and legacy_csv_path and os.path.exists(legacy_csv_path):
+            self.import_csv(legacy_csv_path)
+        # 索引的殘行可能是被截斷的題號（例如 "123" 只寫了 "12"），同樣截掉
+        self._truncate_torn_tail(self.path)
+        self._truncate_torn_tail(self.index_path)
+
+        processed = set()
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                processed = {line.rstrip('\n') for line in f if line.strip()}
+        last = self._last_record()
+        if last is not None and str(last.get('ques_no')) not in processed:
+            processed = self.rebuild_index()
+        self.processed = processed
+        return processed
+
+    def rebuild_index(self) -> Set[str]:
+        processed = {str(result['ques_no']) for result in self.iter_results()}
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            f.writelines(f"{ques_no}\n" for ques_no in processed)
+        print(f"已由 {self.path} 重建題號索引: {len(processed)} 題")
+        return processed
+
+    def import_csv(self, csv_path: str) -> int:
+        """把舊的 CSV 結果轉成 JSONL（只在第一次使用時執行）"""
+        with open(csv_path, encoding='utf-8-sig') as f:
+            rows = [{column: row.get(column) or None for column in RESULT_COLUMNS} for row in csv.DictReader(f)]
+        with self.lock:
+            self.buffer.extend(rows)
+            self._flush()
+        print(f"已匯入舊的結果檔 {csv_path}: {len(rows)} 筆")
+        return len(rows)
+
+    def append(self, result: Dict) -> None:
+        with self.lock:
+            self.buffer.append({column: result.get(column) for column in RESULT_COLUMNS})
+            if len(self.buffer) >= self.flush_every or time.monotonic() - self.last_flush >= self.fsync_interval:
+                self._flush()
+
+    def _flush(self) -> None:
+        if not self.buffer:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(result, ensure_ascii=False) + '\n' for result in self.buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        # 索引在主檔 fsync 之後才寫入，索引中的題號一定已經在主檔中
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.writelines(f"{result['ques_no']}\n" for result in self.buffer)
+        self.processed.update(str(result['ques_no']) for result in self.buffer)
+        self.stats["written"] += len(self.buffer)
+        self.stats["flushes"] += 1
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def iter_results(self) -> Iterator[Dict]:
+        """依寫入順序逐筆讀取（略過中斷時寫到一半的最後一行）"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def export_csv(self, csv_path: str) -> int:
+        """匯出成原本的 CSV 格式（同一題號重複時保留最後一筆），回傳筆數"""
+        self.flush()
+        latest: Dict[str, Dict] = {}
+        for result in self.iter_results():
+            latest[str(result['ques_no'])] = result
+        with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(latest.values())
+        return len(latest)
@@ -0,0 +1,191 @@
+"""
+AI 回應快取 - 以內容雜湊為 key 的 LRU 記憶體快取，可選 MySQL 持久層
+
+key 由 (model, 系統提示, 用戶文字, 圖片位元組摘要, 其他參數) 計算 SHA-256，
+相同題目重複加入錯題本時直接回傳先前的摘要。同時進行的相同請求以 single-flight
+合併成一次上游呼叫。
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+from database import get_db_connection
+
+# 記憶體層最多保留的項目數
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000"))
+# 設為 1 時啟用 MySQL 持久層（ai_response_cache 表）
+AI_CACHE_PERSISTENT = os.getenv("AI_CACHE_PERSISTENT") == "1"
+
+CREATE_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS ai_response_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    model VARCHAR(64) NOT NULL,
+    response MEDIUMTEXT NOT NULL,
+    total_tokens INT NOT NULL DEFAULT 0,
+    hit_count INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+
+@dataclass
+class CachedResponse:
+    text: str
+    total_tokens: int = 0
+
+
+def cache_key(model: str, system_prompt: str, user_text: Optional[str], image_digest: Optional[str], **params) -> str:
+    """計算內容位址 key（image_digest 為原始圖片位元組的 SHA-256，見 image_preprocess.image_bytes_digest）"""
+    material = json.dumps({
+        "model": model,
+        "system": system_prompt,
+        "text": user_text or "",
+        "image": image_digest,
+        "params": params,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU 記憶體快取 + 可選 MySQL 持久層 + single-flight 合併"""
+
+    def __init__(self, max_entries: int = AI_CACHE_MAX_ENTRIES, persistent: bool = AI_CACHE_PERSISTENT):
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "coalesced": 0,
+            "misses": 0,
+            "saved_tokens": 0,
+        }
+
+    # ---- 記憶體層 ----
+    def _memory_get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _memory_put(self, key: str, entry: CachedResponse) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # ---- 持久層（同步 pymysql，於執行緒中呼叫）----
+    @staticmethod
+    def _persistent_get(key: str) -> Optional[CachedResponse]:
+        connection = get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT response, total_tokens FROM ai_response_cache WHERE cache_key = %s",
+                    (key,)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                cursor.execute(
+                    "UPDATE ai_response_cache SET hit_count = hit_count + 1, last_hit_at = NOW() WHERE cache_key = %s",
+                    (key,)
+                )
+            connection.commit()
+            return CachedResponse(text=row['response'], total_tokens=row['total_tokens'])
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _persistent_put(key: str, model: str, entry: CachedResponse) -> None:
+        connection = get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT IGNORE INTO ai_response_cache (cache_key, model, response, total_tokens)
+                    VALUES (%s, %s, %s, %s)
+                """, (key, model, entry.text, entry.total_tokens))
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _record_hit(self, kind: str, entry: CachedResponse) -> None:
+        self.stats[kind] += 1
+        self.stats["saved_tokens"] += entry.total_tokens
+
+    async def get_or_compute(
+        self,
+        key: str,
+        model: str,
+        compute: Callable[[], Awaitable[CachedResponse]],
+    ) -> Tuple[CachedResponse, str]:
+        """
+        取得快取或呼叫 compute 產生回應，回傳 (回應, 來源)
+
+        來源為 memory / persistent / coalesced / upstream。只有成功的結果會分享給合併等待的
+        請求；領頭請求失敗或被取消（例如該用戶被限流、客戶端斷線）時，等待者改為自行重算。
+        """
+        while True:
+            entry = self._memory_get(key)
+            if entry is not None:
+                self._record_hit("memory_hits", entry)
+                return entry, "memory"
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            # 領頭請求失敗時 future 的結果為 None，重新檢查並由其中一個等待者接手計算
+            entry = await asyncio.shield(inflight)
+            if entry is not None:
+                self._record_hit("coalesced", entry)
+                return entry, "coalesced"
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if self.persistent:
+                try:
+                    entry = await asyncio.to_thread(self._persistent_get, key)
+                except Exception as e:
+                    print(f"⚠️ 讀取持久快取失敗：{e}")
+                    entry = None
+                if entry is not None:
+                    self._record_hit("persistent_hits", entry)
+                    self._memory_put(key, entry)
+                    future.set_result(entry)
+                    return entry, "persistent"
+
+            self.stats["misses"] += 1
+            entry = await compute()
+            self._memory_put(key, entry)
+            future.set_result(entry)
+            if self.persistent:
+                try:
+                    await asyncio.to_thread(self._persistent_put, key, model, entry)
+                except Exception as e:
+                    print(f"⚠️ 寫入持久快取失敗：{e}")
+            return entry, "upstream"
+        except BaseException:
+            # 錯誤只屬於領頭請求，不轉給等待者
+            if not future.done():
+                future.set_result(None)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        hits = self.stats["memory_hits"] + self.stats["persistent_hits"] + self.stats["coalesced"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+summarize_cache = ResponseCache()
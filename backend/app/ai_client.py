@@ -0,0 +1,231 @@
+"""
+非同步 OpenAI 客戶端 - 共用連線池、併發上限、逾時與抖動重試
+
+所有 /ai 端點透過這裡呼叫 OpenAI，避免同步 SDK 在 async handler 中阻塞整個 worker。
+設定 OPENAI_BASE_URL 可改連本地的 OpenAI 相容 mock server（見 tools/mock_openai_server.py）。
+"""
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+import asyncio
+import os
+import random
+import httpx
+import openai
+from openai import AsyncOpenAI
+from fastapi import HTTPException, Request
+
+# 每個程序同時進行中的 OpenAI 請求上限
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+# 單一用戶同時進行中的請求上限，超過直接回 429
+OPENAI_MAX_CONCURRENCY_PER_USER = int(os.getenv("OPENAI_MAX_CONCURRENCY_PER_USER", "2"))
+# 單一來源 IP 同時進行中的請求上限（user_id 由客戶端提供，無法單靠它限流；同校 NAT 共用 IP，上限放寬）
+OPENAI_MAX_CONCURRENCY_PER_IP = int(os.getenv("OPENAI_MAX_CONCURRENCY_PER_IP", "8"))
+# 單次請求逾時（秒）
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+# 可重試錯誤的最大重試次數與退避參數
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "8"))
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+_client: Optional[AsyncOpenAI] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_user_inflight: Dict[str, int] = defaultdict(int)
+
+
+def get_client() -> AsyncOpenAI:
+    """取得共用的 AsyncOpenAI 客戶端（延遲初始化，所有請求共用同一個 HTTP 連線池）"""
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONCURRENCY,
+                max_keepalive_connections=OPENAI_MAX_CONCURRENCY,
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=5.0),
+        )
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            http_client=http_client,
+            # 重試由 chat_completion 自行處理（含抖動），避免與 SDK 內建重試疊加
+            max_retries=0,
+        )
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    return _semaphore
+
+
+async def close_client() -> None:
+    """應用關閉時釋放連線池"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def request_client_ip(request: Request) -> str:
+    """取得客戶端 IP：Cloud Run 經由前端代理轉發，優先取 X-Forwarded-For 的第一個位址"""
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def _slot_keys(user_id: Optional[str], ip: Optional[str]) -> List[tuple]:
+    """限流的鍵與上限：來源 IP 一律計入，有 user_id 時再加上單一用戶上限"""
+    keys = [(f"ip:{ip or 'unknown'}", OPENAI_MAX_CONCURRENCY_PER_IP)]
+    if user_id:
+        keys.append((f"user:{user_id}", OPENAI_MAX_CONCURRENCY_PER_USER))
+    return keys
+
+
+@asynccontextmanager
+async def user_slot(user_id: Optional[str], ip: Optional[str] = None):
+    """限制單一來源 IP 與單一用戶同時進行中的請求數；未提供 user_id 時仍以 IP 限制"""
+    keys = _slot_keys(user_id, ip)
+    if any(_user_inflight[key] >= limit for key, limit in keys):
+        raise HTTPException(status_code=429, detail="請求過於頻繁，請等上一個回答完成後再試")
+    for key, _ in keys:
+        _user_inflight[key] += 1
+    try:
+        yield
+    finally:
+        for key, _ in keys:
+            _user_inflight[key] -= 1
+            if _user_inflight[key] <= 0:
+                del _user_inflight[key]
+
+
+def backoff_delay(attempt: int) -> float:
+    """指數退避加 full jitter：在 [0, min(max, base * 2^attempt)] 間隨機"""
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * (2 ** attempt)))
+
+
+@asynccontextmanager
+async def _create_with_retry(client: AsyncOpenAI, params: Dict[str, Any]):
+    """
+    建立 completion 並在持有併發名額期間 yield 回應
+
+    每次嘗試各自取得程序級名額；遇到可重試錯誤時先釋放名額再以抖動退避等待，
+    避免退避中的請求佔住名額拖慢其他請求。最多重試 OPENAI_MAX_RETRIES 次。
+    """
+    semaphore = _get_semaphore()
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        await semaphore.acquire()
+        try:
+            response = await client.chat.completions.create(**params)
+        except RETRYABLE_ERRORS as e:
+            semaphore.release()
+            if attempt >= OPENAI_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"⚠️ OpenAI 請求失敗（第 {attempt + 1} 次）：{e}，{delay:.2f} 秒後重試")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            semaphore.release()
+            raise
+        try:
+            yield response
+        finally:
+            semaphore.release()
+        return
+
+
+async def chat_completion(
+    messages: List[Dict[str, Any]],
+    model: str = "gpt-4o",
+    max_tokens: int = 500,
+    user_id: Optional[str] = None,
+    client_ip: Optional[str] = None,
+    **kwargs,
+):
+    """
+    呼叫 Chat Completions API
+
+    受程序級 semaphore 與單一用戶、單一 IP 併發上限保護；遇到 429、逾時、連線錯誤或 5xx
+    時以抖動退避重試（退避期間不佔用 semaphore）。
+    """
+    client = get_client()
+    params = dict(model=model, messages=messages, max_tokens=max_tokens, **kwargs)
+    async with user_slot(user_id, client_ip):
+        async with _create_with_retry(client, params) as response:
+            return response
+
+
+async def stream_chat_completion(
+    messages: List[Dict[str, Any]],
+    model: str = "gpt-4o",
+    max_tokens: int = 500,
+    user_id: Optional[str] = None,
+    client_ip: Optional[str] = None,
+    **kwargs,
+) -> AsyncIterator[str]:
+    """
+    以串流方式呼叫 Chat Completions API，逐段產出文字 delta
+
+    併發名額在整個串流期間保留（重試退避期間除外）；呼叫端停止迭代（例如客戶端斷線）
+    時會關閉上游連線，OpenAI 隨即停止生成，不再為被放棄的回答付費。只在收到第一段內容前重試。
+    """
+    client = get_client()
+    params = dict(model=model, messages=messages, max_tokens=max_tokens, stream=True, **kwargs)
+    async with user_slot(user_id, client_ip):
+        async with _create_with_retry(client, params) as stream:
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+
+
+class StreamMetrics:
+    """串流回應的延遲統計：首個 token 時間（TTFT）與總耗時，保留最近 window 筆"""
+
+    def __init__(self, window: int = 1000):
+        self.ttft = deque(maxlen=window)
+        self.total = deque(maxlen=window)
+        self.counts = {"completed": 0, "cancelled": 0, "failed": 0}
+
+    def record(self, outcome: str, ttft: Optional[float], total: float) -> None:
+        self.counts[outcome] += 1
+        if ttft is not None:
+            self.ttft.append(ttft)
+        if outcome == "completed":
+            self.total.append(total)
+
+    @staticmethod
+    def _summary(values) -> Dict[str, float]:
+        if not values:
+            return {"count": 0}
+        ordered = sorted(values)
+        pick = lambda pct: ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+        return {
+            "count": len(ordered),
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+            "p50_ms": round(pick(50) * 1000, 1),
+            "p95_ms": round(pick(95) * 1000, 1),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "time_to_first_token": self._summary(self.ttft),
+            "total_latency": self._summary(self.total),
+        }
+
+
+stream_metrics = StreamMetrics()
@@ -0,0 +1,153 @@
+"""
+每日使用報告 - 統計前一天（台北時間）的關卡完成狀況並寄送郵件
+
+由工作佇列 worker 執行（工作類型 daily_report），/notifications/notify-daily-report
+只負責加入佇列，SMTP 寄送不會卡住 HTTP 請求。
+"""
+from datetime import date, datetime, timedelta, timezone
+from email.mime.text import MIMEText
+from typing import Any, Dict, List, Optional
+import os
+import smtplib
+import traceback
+from database import get_db_connection
+from job_queue import JobContext
+
+JOB_DAILY_REPORT = "daily_report"
+
+TAIPEI_TZ = timezone(timedelta(hours=8))
+TOP_USER_LIMIT = 5
+
+# 單一查詢：每位用戶的關卡數彙總後，以視窗函數一併算出總關卡數與總人數，並 JOIN 用戶名稱
+DAILY_REPORT_SQL = """
+    SELECT agg.user_id,
+           u.name,
+           agg.level_count,
+           SUM(agg.level_count) OVER () AS total_levels,
+           COUNT(*) OVER () AS total_users
+    FROM (
+        SELECT user_id, COUNT(*) AS level_count
+        FROM user_level
+        WHERE answered_at BETWEEN %s AND %s
+        GROUP BY user_id
+    ) agg
+    LEFT JOIN users u ON u.user_id = agg.user_id
+    ORDER BY agg.level_count DESC
+    LIMIT %s
+"""
+
+
+def report_day_range(report_date: date):
+    """報告日期在台北時間的起訖時間字串"""
+    start = datetime.combine(report_date, datetime.min.time(), tzinfo=TAIPEI_TZ)
+    end = datetime.combine(report_date, datetime.max.time(), tzinfo=TAIPEI_TZ)
+    return start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def build_daily_report(report_date: date) -> Dict[str, Any]:
+    """一次查詢取得報告日期的總關卡數、活躍人數與前幾名用戶"""
+    start_str, end_str = report_day_range(report_date)
+    print(f"查詢日期範圍: {start_str} 至 {end_str}")
+
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(DAILY_REPORT_SQL, (start_str, end_str, TOP_USER_LIMIT))
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+
+    return {
+        "report_date": report_date.isoformat(),
+        "total_levels": int(rows[0]['total_levels']) if rows else 0,
+        "total_users": int(rows[0]['total_users']) if rows else 0,
+        "top_users": [
+            {"name": row['name'] or row['user_id'], "level_count": row['level_count']}
+            for row in rows
+        ],
+    }
+
+
+def render_daily_report(report: Dict[str, Any], today: date):
+    """組出郵件主旨與內文"""
+    subject = f"【Dogtor 每日系統報告】{today.strftime('%Y-%m-%d')}"
+    body = f"""Dogtor 每日使用報告 ({report['report_date']})：
+
+【使用統計】
+昨日完成關卡數：{report['total_levels']} 個
+昨日活躍用戶數：{report['total_users']} 人
+"""
+
+    top_users: List[Dict[str, Any]] = report['top_users']
+    if top_users:
+        body += "\n【昨日最活躍用戶】\n"
+        for i, user in enumerate(top_users, 1):
+            body += f"{i}. {user['name']} - 完成 {user['level_count']} 個關卡\n"
+
+    body += """
+祝您有美好的一天！
+
+（本報告由系統自動生成，請勿直接回覆）
+"""
+    return subject, body
+
+
+def email_config() -> Optional[tuple]:
+    """讀取寄件帳號、應用程式密碼與收件人；任一項未設定時回傳 None"""
+    gmail_address = os.getenv("GMAIL_ADDRESS")
+    app_password = os.getenv("APP_PASSWORD")
+    receivers = os.getenv("RECEIVERS", "").split(",") if os.getenv("RECEIVERS") else []
+    if not gmail_address or not app_password or not receivers:
+        return None
+    return gmail_address, app_password, receivers
+
+
+def send_email(subject: str, body: str) -> bool:
+    """以 Gmail SMTP 寄送報告"""
+    config = email_config()
+    if config is None:
+        print("警告: 郵件發送信息不完整，無法發送郵件")
+        return False
+    gmail_address, app_password, receivers = config
+    print(f"準備發送郵件: 主題={subject}, 收件人={receivers}")
+
+    try:
+        msg = MIMEText(body, "plain", "utf-8")
+        msg["Subject"] = subject
+        msg["From"] = gmail_address
+        msg["To"] = ", ".join(receivers)
+
+        with smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=30) as server:
+            server.login(gmail_address, app_password)
+            server.sendmail(gmail_address, receivers, msg.as_string())
+        print("郵件發送成功")
+        return True
+    except Exception as e:
+        print(f"發送郵件時出錯: {e}")
+        print(traceback.format_exc())
+        return False
+
+
+def send_daily_report(report_date: Optional[date] = None) -> Dict[str, Any]:
+    """產生並寄送報告（預設為台北時間的昨天）"""
+    today = datetime.now(TAIPEI_TZ).date()
+    report_date = report_date or today - timedelta(days=1)
+
+    report = build_daily_report(report_date)
+    subject, body = render_daily_report(report, today)
+    report["email_configured"] = email_config() is not None
+    report["email_sent"] = report["email_configured"] and send_email(subject, body)
+    return report
+
+
+def run_daily_report_job(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    report_date = date.fromisoformat(payload["report_date"]) if payload.get("report_date") else None
+    report = send_daily_report(report_date)
+    if not report["email_configured"]:
+        # 未設定郵件環境變數時重試也不會成功，直接完成工作並在 result 記錄未寄出
+        print("警告: 未設定郵件環境變數，每日報告未寄出")
+        return report
+    if not report["email_sent"]:
+        # 真正的寄送失敗才讓工作佇列以退避重試
+        raise RuntimeError("每日報告生成成功，但郵件發送失敗")
+    return report
@@ -4,6 +4,7 @@
 import os
 import pymysql
 from typing import Optional
+from datetime import datetime
 
 
 def get_db_connection():
@@ -34,3 +35,14 @@ def get_db_connection():
             init_command='SET NAMES utf8mb4',
             cursorclass=pymysql.cursors.DictCursor
         )
+
+
+def get_db_now(cursor) -> datetime:
+    """
+    取得資料庫目前時間
+
+    批次寫入時先取一次 NOW() 再以參數帶入，讓 executemany 能合併成單一多列 INSERT
+    （PyMySQL 只在 VALUES 全為佔位符時才會合併）。
+    """
+    cursor.execute("SELECT NOW() AS now")
+    return cursor.fetchone()['now']
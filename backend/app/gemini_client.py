@@ -0,0 +1,65 @@
+"""
+Vertex AI Gemini 客戶端 - 程序級共用的模型實例與非同步生成
+
+vertexai.init() 與 GenerativeModel 建構只在第一次使用時執行一次，之後所有請求共用；
+初始化會讀取憑證、可能發出網路請求，generate_text 第一次使用時改在執行緒中進行，不阻塞事件迴圈。
+生成使用 generate_content_async 並以 asyncio.wait_for 限制等待時間。
+"""
+from typing import Dict, Optional
+import asyncio
+import os
+import threading
+import vertexai
+from vertexai.generative_models import GenerativeModel
+
+GEMINI_LOCATION = os.getenv("GEMINI_LOCATION", "us-central1")
+# 預設的單次生成逾時（秒）
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "4"))
+
+_init_lock = threading.Lock()
+_initialized = False
+_models: Dict[str, GenerativeModel] = {}
+
+
+def _ensure_initialized() -> None:
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            vertexai.init(project=os.getenv("GOOGLE_CLOUD_PROJECT"), location=GEMINI_LOCATION)
+            _initialized = True
+            print("✅ Vertex AI 初始化完成")
+
+
+def get_model(model_name: str = "gemini-2.0-flash") -> GenerativeModel:
+    """取得共用的 GenerativeModel（依模型名稱快取）"""
+    model = _models.get(model_name)
+    if model is None:
+        _ensure_initialized()
+        with _init_lock:
+            model = _models.get(model_name)
+            if model is None:
+                model = GenerativeModel(model_name)
+                _models[model_name] = model
+    return model
+
+
+async def generate_text(
+    prompt: str,
+    model_name: str = "gemini-2.0-flash",
+    timeout: Optional[float] = None,
+) -> str:
+    """
+    非同步生成文字
+
+    超過 timeout 秒會取消請求並拋出 asyncio.TimeoutError，由呼叫端決定降級方式。
+    """
+    model = _models.get(model_name)
+    if model is None:
+        model = await asyncio.to_thread(get_model, model_name)
+    response = await asyncio.wait_for(
+        model.generate_content_async(prompt),
+        timeout=GEMINI_TIMEOUT if timeout is None else timeout,
+    )
+    return response.text.strip()
@@ -0,0 +1,156 @@
+"""
+視覺模型前的圖片前處理 - 解碼一次、縮圖、移除 EXIF、重新編碼
+
+手機拍攝的題目照片常是 4000px 以上、數 MB 的 JPEG，直接送進 GPT-4o 會增加上傳時間
+與 vision token 成本。這裡在執行緒池中處理（Pillow 解碼/編碼會釋放 GIL），
+不阻塞 event loop。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Any, Dict, Optional
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import time
+from PIL import Image, ImageOps
+
+# 長邊上限（像素），OpenAI 高解析模式本身也會縮到 2048 內再切 512 方塊
+AI_IMAGE_MAX_SIDE = int(os.getenv("AI_IMAGE_MAX_SIDE", "1024"))
+# 重新編碼格式（JPEG 或 WEBP）與品質
+AI_IMAGE_FORMAT = os.getenv("AI_IMAGE_FORMAT", "JPEG").upper()
+AI_IMAGE_QUALITY = int(os.getenv("AI_IMAGE_QUALITY", "80"))
+# 前處理執行緒數
+AI_IMAGE_WORKERS = int(os.getenv("AI_IMAGE_WORKERS", "2"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+_executor = ThreadPoolExecutor(max_workers=AI_IMAGE_WORKERS, thread_name_prefix="image-preprocess")
+
+
+@dataclass
+class PreparedImage:
+    """前處理後的圖片"""
+    data_url: str
+    original_bytes: int
+    processed_bytes: int
+    original_size: tuple
+    processed_size: tuple
+    elapsed_ms: float
+
+
+class ImagePreprocessStats:
+    """累計前處理的位元組與耗時"""
+
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_ms = 0.0
+
+    def record(self, image: PreparedImage) -> None:
+        self.count += 1
+        self.bytes_in += image.original_bytes
+        self.bytes_out += image.processed_bytes
+        self.total_ms += image.elapsed_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "size_ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+        }
+
+
+preprocess_stats = ImagePreprocessStats()
+
+
+def decode_image_base64(image_base64: str) -> bytes:
+    """把 base64（可含 data URL 前綴）解碼為原始位元組，只做一次供摘要與前處理共用"""
+    data = image_base64.split(",", 1)[1] if image_base64.startswith("data:") else image_base64
+    try:
+        return base64.b64decode(data, validate=False)
+    except (binascii.Error, ValueError):
+        return data.encode("utf-8")
+
+
+def image_bytes_digest(raw: Optional[bytes]) -> Optional[str]:
+    if not raw:
+        return None
+    return hashlib.sha256(raw).hexdigest()
+
+
+def preprocess_image(
+    raw: bytes,
+    max_side: int = AI_IMAGE_MAX_SIDE,
+    image_format: str = AI_IMAGE_FORMAT,
+    quality: int = AI_IMAGE_QUALITY,
+) -> PreparedImage:
+    """
+    縮圖並重新編碼（同步版本，於執行緒池中呼叫）
+
+    - JPEG 以 draft 模式在解碼階段直接以 1/2、1/4、1/8 縮小，省下完整解碼的記憶體與時間
+    - 依 EXIF 方向轉正後不再寫回 EXIF（同時移除 GPS 等個資）
+    - 已經夠小且格式相同時仍重新編碼，以確保移除 EXIF
+    """
+    started = time.perf_counter()
+    with Image.open(BytesIO(raw)) as img:
+        original_size = img.size
+        if img.format == "JPEG":
+            img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            # 透明背景貼到白底，避免轉 JPEG 時變黑
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            rgba = img.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            img = background
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        output = BytesIO()
+        save_kwargs = {"quality": quality}
+        if image_format == "JPEG":
+            save_kwargs.update(optimize=True, progressive=True)
+        elif image_format == "WEBP":
+            save_kwargs.update(method=4)
+        img.save(output, format=image_format, **save_kwargs)
+        processed_size = img.size
+
+    processed = output.getvalue()
+    encoded = base64.b64encode(processed).decode("ascii")
+    return PreparedImage(
+        data_url=f"data:{MIME_TYPES.get(image_format, 'image/jpeg')};base64,{encoded}",
+        original_bytes=len(raw),
+        processed_bytes=len(processed),
+        original_size=original_size,
+        processed_size=processed_size,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+async def prepare_image(raw: bytes) -> str:
+    """
+    在執行緒池中前處理圖片，回傳可放進 image_url 的 data URL
+
+    無法解碼（非圖片或格式不支援）時原樣送出，由上游回報錯誤。
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        image = await loop.run_in_executor(_executor, preprocess_image, raw)
+    except Exception as e:
+        preprocess_stats.failed += 1
+        print(f"⚠️ 圖片前處理失敗，改送原圖：{e}")
+        return f"data:image/jpeg;base64,{base64.b64encode(raw).decode('ascii')}"
+
+    preprocess_stats.record(image)
+    print(
+        f"🖼️ 圖片前處理：{image.original_size} {image.original_bytes / 1024:.0f}KB → "
+        f"{image.processed_size} {image.processed_bytes / 1024:.0f}KB，{image.elapsed_ms:.0f}ms"
+    )
+    return image.data_url
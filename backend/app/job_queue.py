@@ -0,0 +1,380 @@
+"""
+輕量級持久化工作佇列 - 以 MySQL notification_jobs 表儲存推播等背景工作
+
+Cron 端點只負責 enqueue，由 worker 以 SELECT ... FOR UPDATE SKIP LOCKED 領取工作；
+handler 可隨時寫入 checkpoint，worker 當機後租約逾時的工作會被重新領取並從
+checkpoint 繼續執行。
+
+寫入進度與完成狀態時都會比對 locked_by：租約已被其他 worker 接手時 save_checkpoint 拋出
+LeaseLostError 中止 handler，避免同一批推播被兩個 worker 重複發送。
+"""
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional
+import json
+import os
+import socket
+import threading
+import traceback
+from database import get_db_connection, get_db_now
+
+# 工作租約秒數：running 狀態超過此時間未更新 checkpoint 視為 worker 已失效
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# 佇列為空時的輪詢間隔
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+# 重試退避基準秒數（第 n 次失敗等待 base * 2^(n-1) 秒）
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+
+CREATE_JOB_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS notification_jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    job_type VARCHAR(64) NOT NULL,
+    payload JSON,
+    status ENUM('pending', 'running', 'done', 'failed') NOT NULL DEFAULT 'pending',
+    dedupe_key VARCHAR(191),
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 5,
+    run_after DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by VARCHAR(255),
+    locked_at DATETIME NULL,
+    checkpoint JSON,
+    result JSON,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uniq_dedupe_key (dedupe_key),
+    INDEX idx_status_run_after (status, run_after)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+
+class LeaseLostError(Exception):
+    """工作租約已逾時並被其他 worker 接手"""
+
+
+@dataclass
+class Job:
+    """已領取的工作"""
+    id: int
+    job_type: str
+    payload: Dict[str, Any]
+    checkpoint: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+
+
+@dataclass
+class JobContext:
+    """提供給 handler 的執行環境，用來寫入進度"""
+    job: Job
+    worker_id: str
+    checkpoint: Dict[str, Any] = field(default_factory=dict)
+
+    def save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        """寫入進度並延長租約；租約已失去時拋出 LeaseLostError"""
+        if not save_checkpoint(self.job.id, self.worker_id, checkpoint):
+            raise LeaseLostError(f"工作 {self.job.id} 的租約已被其他 worker 接手")
+        self.checkpoint = checkpoint
+
+
+# handler 接收 payload 與 JobContext，回傳寫入 result 欄位的摘要
+JobHandler = Callable[[Dict[str, Any], JobContext], Optional[Dict[str, Any]]]
+
+
+def _loads(value) -> Dict[str, Any]:
+    if not value:
+        return {}
+    if isinstance(value, (bytes, str)):
+        return json.loads(value)
+    return value
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue_job(
+    job_type: str,
+    payload: Optional[Dict[str, Any]] = None,
+    dedupe_key: Optional[str] = None,
+    delay_seconds: int = 0,
+    max_attempts: int = 5,
+) -> Optional[int]:
+    """
+    新增工作，回傳工作 ID
+
+    dedupe_key 相同的工作只會存在一筆（例如 Cloud Scheduler 重送同一次觸發），
+    重複 enqueue 時回傳既有工作的 ID。
+    """
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT IGNORE INTO notification_jobs
+                    (job_type, payload, dedupe_key, max_attempts, run_after)
+                VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)
+            """, (job_type, json.dumps(payload or {}, ensure_ascii=False), dedupe_key, max_attempts, delay_seconds))
+            job_id = cursor.lastrowid if cursor.rowcount else None
+            if job_id is None and dedupe_key:
+                cursor.execute("SELECT id FROM notification_jobs WHERE dedupe_key = %s", (dedupe_key,))
+                row = cursor.fetchone()
+                job_id = row['id'] if row else None
+        connection.commit()
+        print(f"📥 已加入工作 {job_type} (ID: {job_id})")
+        return job_id
+    finally:
+        connection.close()
+
+
+def enqueue_jobs(jobs: List[Dict[str, Any]]) -> int:
+    """
+    以單一 executemany 批次新增工作，回傳實際新增筆數
+
+    每個元素包含 job_type，並可選 payload、dedupe_key、delay_seconds、max_attempts。
+    """
+    if not jobs:
+        return 0
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            now = get_db_now(cursor)
+            rows = [
+                (
+                    job["job_type"],
+                    json.dumps(job.get("payload") or {}, ensure_ascii=False),
+                    job.get("dedupe_key"),
+                    job.get("max_attempts", 5),
+                    now + timedelta(seconds=job.get("delay_seconds", 0)),
+                )
+                for job in jobs
+            ]
+            inserted = cursor.executemany("""
+                INSERT IGNORE INTO notification_jobs
+                    (job_type, payload, dedupe_key, max_attempts, run_after)
+                VALUES (%s, %s, %s, %s, %s)
+            """, rows)
+        connection.commit()
+        print(f"📥 已批次加入 {inserted}/{len(rows)} 筆工作")
+        return inserted
+    finally:
+        connection.close()
+
+
+def fail_exhausted_jobs() -> int:
+    """
+    租約逾時且已達重試上限的 running 工作直接標記為 failed，回傳筆數
+
+    這類工作通常是讓 worker 當機的工作，不再重新領取以免無限重試。
+    """
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            failed = cursor.execute("""
+                UPDATE notification_jobs
+                SET status = 'failed', last_error = '租約逾時且已達重試上限', locked_by = NULL, locked_at = NULL
+                WHERE status = 'running' AND locked_at < NOW() - INTERVAL %s SECOND
+                  AND attempts >= max_attempts
+            """, (JOB_LEASE_SECONDS,))
+        connection.commit()
+        if failed:
+            print(f"⚠️ {failed} 筆工作租約逾時且已達重試上限，標記為失敗")
+        return failed
+    finally:
+        connection.close()
+
+
+def claim_job(worker_id: str) -> Optional[Job]:
+    """領取一筆可執行的工作（含租約逾時且未達重試上限的 running 工作），沒有則回傳 None"""
+    connection = get_db_connection()
+    try:
+        connection.begin()
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, job_type, payload, checkpoint, attempts, max_attempts
+                FROM notification_jobs
+                WHERE (status = 'pending' AND run_after <= NOW())
+                   OR (status = 'running' AND locked_at < NOW() - INTERVAL %s SECOND
+                       AND attempts < max_attempts)
+                ORDER BY run_after, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            """, (JOB_LEASE_SECONDS,))
+            row = cursor.fetchone()
+            if not row:
+                connection.rollback()
+                return None
+
+            cursor.execute("""
+                UPDATE notification_jobs
+                SET status = 'running', locked_by = %s, locked_at = NOW(), attempts = attempts + 1
+                WHERE id = %s
+            """, (worker_id, row['id']))
+        connection.commit()
+        return Job(
+            id=row['id'],
+            job_type=row['job_type'],
+            payload=_loads(row['payload']),
+            checkpoint=_loads(row['checkpoint']),
+            attempts=row['attempts'] + 1,
+            max_attempts=row['max_attempts'],
+        )
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def _holds_lease(cursor, job_id: int, worker_id: str) -> bool:
+    cursor.execute("""
+        SELECT 1 FROM notification_jobs
+        WHERE id = %s AND status = 'running' AND locked_by = %s
+    """, (job_id, worker_id))
+    return cursor.fetchone() is not None
+
+
+def save_checkpoint(job_id: int, worker_id: str, checkpoint: Dict[str, Any]) -> bool:
+    """寫入工作進度，同時更新 locked_at 作為心跳；回傳是否仍持有租約"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            updated = cursor.execute("""
+                UPDATE notification_jobs
+                SET checkpoint = %s, locked_at = NOW()
+                WHERE id = %s AND status = 'running' AND locked_by = %s
+            """, (json.dumps(checkpoint, ensure_ascii=False), job_id, worker_id))
+            # rowcount 只計算實際變更的列：同一秒內寫入相同進度時為 0，需再確認租約
+            holds_lease = bool(updated) or _holds_lease(cursor, job_id, worker_id)
+        connection.commit()
+        return holds_lease
+    finally:
+        connection.close()
+
+
+def complete_job(job_id: int, worker_id: str, result: Optional[Dict[str, Any]] = None) -> bool:
+    """標記工作完成；租約已被其他 worker 接手時不更新並回傳 False"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            updated = cursor.execute("""
+                UPDATE notification_jobs
+                SET status = 'done', result = %s, locked_by = NULL, locked_at = NULL, last_error = NULL
+                WHERE id = %s AND status = 'running' AND locked_by = %s
+            """, (json.dumps(result or {}, ensure_ascii=False), job_id, worker_id))
+        connection.commit()
+        return bool(updated)
+    finally:
+        connection.close()
+
+
+def fail_job(job: Job, error: str, worker_id: Optional[str] = None) -> bool:
+    """
+    記錄失敗；尚未達重試上限時以指數退避重新排入佇列，checkpoint 保留供續跑
+
+    指定 worker_id 時只在仍持有租約時更新，回傳是否有更新。
+    """
+    lease_condition = "AND status = 'running' AND locked_by = %s" if worker_id else ""
+    lease_params = (worker_id,) if worker_id else ()
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            if job.attempts >= job.max_attempts:
+                updated = cursor.execute(f"""
+                    UPDATE notification_jobs
+                    SET status = 'failed', last_error = %s, locked_by = NULL, locked_at = NULL
+                    WHERE id = %s {lease_condition}
+                """, (error, job.id, *lease_params))
+            else:
+                delay = JOB_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+                updated = cursor.execute(f"""
+                    UPDATE notification_jobs
+                    SET status = 'pending', last_error = %s, locked_by = NULL, locked_at = NULL,
+                        run_after = NOW() + INTERVAL %s SECOND
+                    WHERE id = %s {lease_condition}
+                """, (error, delay, job.id, *lease_params))
+        connection.commit()
+        return bool(updated)
+    finally:
+        connection.close()
+
+
+def get_job(job_id: int) -> Optional[Dict[str, Any]]:
+    """查詢工作狀態與進度"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, job_type, status, attempts, max_attempts, run_after,
+                       checkpoint, result, last_error, created_at, updated_at
+                FROM notification_jobs
+                WHERE id = %s
+            """, (job_id,))
+            row = cursor.fetchone()
+        if row:
+            row['checkpoint'] = _loads(row['checkpoint'])
+            row['result'] = _loads(row['result'])
+        return row
+    finally:
+        connection.close()
+
+
+def run_job(job: Job, handlers: Dict[str, JobHandler], worker_id: str) -> None:
+    handler = handlers.get(job.job_type)
+    if handler is None:
+        fail_job(job, f"未知的工作類型: {job.job_type}", worker_id)
+        return
+
+    context = JobContext(job=job, worker_id=worker_id, checkpoint=dict(job.checkpoint))
+    print(f"⚙️ 開始執行工作 {job.job_type} (ID: {job.id}, 第 {job.attempts} 次)")
+    try:
+        result = handler(job.payload, context)
+    except LeaseLostError as e:
+        # 其他 worker 已從 checkpoint 接手，這裡不再更新工作狀態
+        print(f"⚠️ 中止工作 {job.job_type} (ID: {job.id}): {e}")
+        return
+    except Exception as e:
+        print(f"❌ 工作失敗 {job.job_type} (ID: {job.id}): {e}")
+        print(traceback.format_exc())
+        if not fail_job(job, str(e), worker_id):
+            print(f"⚠️ 工作 {job.id} 的租約已被其他 worker 接手，未記錄失敗")
+        return
+    if complete_job(job.id, worker_id, result):
+        print(f"✅ 工作完成 {job.job_type} (ID: {job.id}): {result}")
+    else:
+        print(f"⚠️ 工作 {job.job_type} (ID: {job.id}) 執行完畢，但租約已被其他 worker 接手，未標記完成")
+
+
+def run_worker(
+    handlers: Dict[str, JobHandler],
+    stop_event: Optional[threading.Event] = None,
+    worker_id: Optional[str] = None,
+) -> None:
+    """持續領取並執行工作，直到 stop_event 被設定"""
+    stop_event = stop_event or threading.Event()
+    worker_id = worker_id or default_worker_id()
+    print(f"👷 工作佇列 worker 啟動：{worker_id}")
+    while not stop_event.is_set():
+        try:
+            fail_exhausted_jobs()
+            job = claim_job(worker_id)
+        except Exception as e:
+            print(f"❌ 領取工作失敗: {e}")
+            job = None
+        if job is None:
+            stop_event.wait(JOB_POLL_INTERVAL)
+            continue
+        run_job(job, handlers, worker_id)
+    print(f"👋 工作佇列 worker 結束：{worker_id}")
+
+
+def start_worker_thread(handlers: Dict[str, JobHandler]) -> threading.Event:
+    """在背景執行緒啟動 worker，回傳用於停止的 Event"""
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=run_worker,
+        args=(handlers, stop_event),
+        name="notification-job-worker",
+        daemon=True,
+    )
+    thread.start()
+    return stop_event
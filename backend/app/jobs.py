@@ -0,0 +1,11 @@
+"""
+工作佇列的工作類型註冊表（worker.py 與 main.py 共用）
+"""
+from reminders import REMINDER_JOB_HANDLERS
+from daily_report import JOB_DAILY_REPORT, run_daily_report_job
+
+# 工作類型 → handler
+JOB_HANDLERS = {
+    **REMINDER_JOB_HANDLERS,
+    JOB_DAILY_REPORT: run_daily_report_job,
+}
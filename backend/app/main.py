@@ -7,7 +7,10 @@ from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from datetime import datetime
 from database import get_db_connection
+import asyncio
+import importlib
 import os
+import sys
 import uvicorn
 
 # 載入環境變數
@@ -15,6 +18,7 @@ load_dotenv()
 
 # 導入路由模組
 from routers import hearts, mistake_book, users, ai, quiz, friends, stats, notifications, admin, online_status, battle
+from ai_client import close_client
 
 # 創建 FastAPI 應用
 app = FastAPI(
@@ -80,14 +84,70 @@ async def health_check():
     }
 
 
+async def warm_up_text_classifier():
+    """在執行緒中 import text_classifier（連帶 torch），再載入模型並跑一次分類"""
+    try:
+        text_classifier = await asyncio.to_thread(importlib.import_module, "text_classifier")
+    except Exception as e:
+        print(f"⚠️ 無法載入 text_classifier，略過 TextCNN 暖機：{e}")
+        return
+    await text_classifier.warm_up_classifier()
+
+
+def migrate_schema():
+    """補上既有資料表缺少的欄位與索引（可重複執行，失敗時只記錄不阻擋啟動）"""
+    from push import migrate_token_table
+    from reminders import CREATE_REMINDER_CLAIM_TABLE_SQL
+    connection = None
+    try:
+        connection = get_db_connection()
+        with connection.cursor() as cursor:
+            migrate_token_table(cursor)
+            # 學習提醒發送前必須先認領，表不存在時 slot 工作會失敗
+            cursor.execute(CREATE_REMINDER_CLAIM_TABLE_SQL)
+        connection.commit()
+    except Exception as e:
+        print(f"⚠️ 資料表遷移失敗：{e}")
+    finally:
+        if connection:
+            connection.close()
+
+
 # 應用啟動事件
 @app.on_event("startup")
 async def startup_event():
     """應用啟動時的初始化"""
     print("🚀 Superb Learning Platform API 正在啟動...")
+    await asyncio.to_thread(migrate_schema)
+    # 推播工作佇列 worker（也可用 python worker.py 獨立執行）
+    if os.getenv("RUN_JOB_WORKER") == "1":
+        from job_queue import start_worker_thread
+        from jobs import JOB_HANDLERS
+        app.state.job_worker_stop = start_worker_thread(JOB_HANDLERS)
+    # TextCNN 模型在背景暖機，不拖慢啟動（設 TEXTCNN_WARMUP=0 則等第一個請求才載入）
+    if os.getenv("TEXTCNN_WARMUP", "1") == "1":
+        app.state.textcnn_warmup = asyncio.create_task(warm_up_text_classifier())
     print("✅ 應用啟動完成")
 
 
+# 應用關閉事件
+@app.on_event("shutdown")
+async def shutdown_event():
+    """應用關閉時停止背景 worker"""
+    stop_event = getattr(app.state, "job_worker_stop", None)
+    if stop_event:
+        stop_event.set()
+    # 釋放 OpenAI 共用連線池
+    await close_client()
+    # 停止 TextCNN 暖機與微批次背景工作（有用到分類才會載入該模組）
+    warmup = getattr(app.state, "textcnn_warmup", None)
+    if warmup:
+        warmup.cancel()
+    text_classifier = sys.modules.get("text_classifier")
+    if text_classifier:
+        await text_classifier.classify_batcher.close()
+
+
 if __name__ == "__main__":
     # 從環境變數獲取端口，如果沒有則默認使用 8080
     port = int(os.getenv("PORT", 8080))
@@ -0,0 +1,103 @@
+"""
+非同步微批次處理 - 把同時到達的請求合併成一次批次運算
+
+第一筆請求到達後最多再等 max_wait_ms 毫秒或湊滿 max_batch_size 筆，整批交給
+process_batch 在執行緒池中處理一次，再把結果依序分送回各請求。批次執行期間新到的
+請求會在佇列中累積，負載越高批次自然越大。
+"""
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+
+
+class MicroBatcher:
+    """
+    微批次處理器
+
+    process_batch 為同步函式：輸入項目清單，回傳等長、同順序的結果清單。
+    背景工作在第一次 submit 時於目前的 event loop 上啟動。
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        executor: Optional[Executor] = None,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"batches": 0, "items": 0, "max_batch_size": 0}
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """送出一筆項目並等待其結果"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 已取消的請求（例如客戶端斷線）不進入運算
+        return [(item, future) for item, future in batch if not future.cancelled()]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["items"] += len(items)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(items))
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch_size": round(self.stats["items"] / batches, 2) if batches else 0.0,
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
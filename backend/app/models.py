@@ -55,6 +55,11 @@ class ChatRequest(BaseModel):
         description="年級",
         examples=["G11", "G12", "G10"]
     )
+    user_id: Optional[str] = Field(
+        None,
+        description="用戶 ID（用於限制單一用戶同時進行中的 AI 請求數）",
+        examples=["user_12345"]
+    )
 
 
 class ChatResponse(BaseModel):
@@ -432,11 +437,13 @@ class TestPushRequest(BaseModel):
 class ClassifyTextRequest(BaseModel):
     """文本分類請求模型"""
     text: str = Field(description="待分類的文本", example="解一元二次方程式 x² - 5x + 6 = 0")
+    top_k: int = Field(3, description="回傳前幾個預測結果", example=3, ge=1, le=10)
 
     class Config:
         schema_extra = {
             "example": {
-                "text": "解一元二次方程式 x² - 5x + 6 = 0"
+                "text": "解一元二次方程式 x² - 5x + 6 = 0",
+                "top_k": 3
             }
         }
 
@@ -446,6 +453,11 @@ class ClassifyTextResponse(BaseModel):
     success: bool = Field(description="是否成功", example=True)
     predicted_class: Optional[str] = Field(None, description="預測類別", example="數學")
     confidence: Optional[float] = Field(None, description="信心度", example=0.95, ge=0, le=1)
+    top_predictions: Optional[List[dict]] = Field(
+        None,
+        description="依信心度排序的前 top_k 個預測",
+        example=[{"label": "數學", "confidence": 0.95}, {"label": "理化", "confidence": 0.03}]
+    )
     message: Optional[str] = Field(None, description="回應訊息", example="分類成功")
 
     class Config:
@@ -454,6 +466,10 @@ class ClassifyTextResponse(BaseModel):
                 "success": True,
                 "predicted_class": "數學",
                 "confidence": 0.95,
+                "top_predictions": [
+                    {"label": "數學", "confidence": 0.95},
+                    {"label": "理化", "confidence": 0.03}
+                ],
                 "message": "分類成功"
             }
         }
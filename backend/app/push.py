@@ -0,0 +1,197 @@
+"""
+推播發送服務 - 批次發送 FCM 推播並回收失效 token
+"""
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Sequence, Tuple
+import firebase_admin
+from firebase_admin import credentials, messaging, exceptions as firebase_exceptions
+
+# 初始化 Firebase Admin（使用同專案的預設憑證）
+try:
+    firebase_admin.get_app()
+    print("✅ Firebase Admin 已經初始化過了")
+except ValueError:
+    # Firebase Admin 尚未初始化，使用 ApplicationDefault 憑證
+    cred = credentials.ApplicationDefault()
+    firebase_admin.initialize_app(cred)
+    print("✅ Firebase Admin 初始化成功 (使用預設憑證)")
+
+# FCM send_each 單次最多 500 則訊息
+FCM_BATCH_SIZE = 500
+
+# 代表 token 已失效（App 被移除、token 輪替）的錯誤類型
+DEAD_TOKEN_ERRORS = (
+    messaging.UnregisteredError,
+    messaging.SenderIdMismatchError,
+)
+# INVALID_ARGUMENT 也可能是訊息內容的問題（例如 payload 過大），只有錯誤訊息指明 token 時才視為失效
+INVALID_TOKEN_MESSAGE = "registration token"
+
+
+@dataclass
+class PushBatchResult:
+    """批次推播結果"""
+    total: int = 0
+    success_count: int = 0
+    failure_count: int = 0
+    # 成功送達的 token（用於後續記錄提醒歷史）
+    delivered_tokens: List[str] = field(default_factory=list)
+    # 已確認失效、應停用的 token
+    dead_tokens: List[str] = field(default_factory=list)
+
+    def merge(self, other: "PushBatchResult") -> None:
+        self.total += other.total
+        self.success_count += other.success_count
+        self.failure_count += other.failure_count
+        self.delivered_tokens.extend(other.delivered_tokens)
+        self.dead_tokens.extend(other.dead_tokens)
+
+
+def send_push_notification(token: str, title: str, body: str) -> str:
+    """發送推播通知"""
+    try:
+        message = messaging.Message(
+            notification=messaging.Notification(
+                title=title,
+                body=body,
+            ),
+            token=token,
+        )
+        response = messaging.send(message)
+        print(f"✅ 已送出推播：{token[:10]}... → {response}")
+        return response
+    except Exception as e:
+        print(f"❌ 發送失敗：{e}")
+        return "error"
+
+
+def is_dead_token_error(error: Optional[Exception]) -> bool:
+    """判斷 FCM 錯誤是否代表 token 已失效"""
+    if isinstance(error, DEAD_TOKEN_ERRORS):
+        return True
+    return (
+        isinstance(error, firebase_exceptions.InvalidArgumentError)
+        and INVALID_TOKEN_MESSAGE in str(error).lower()
+    )
+
+
+def _send_chunk(messages: Sequence[messaging.Message], dry_run: bool) -> PushBatchResult:
+    result = PushBatchResult(total=len(messages))
+    try:
+        batch_response = messaging.send_each(list(messages), dry_run=dry_run)
+    except Exception as e:
+        # 整批失敗（網路或憑證問題）時無法判斷個別 token，全部視為暫時失敗
+        print(f"❌ 批次推播失敗：{e}")
+        result.failure_count = len(messages)
+        return result
+
+    for message, send_response in zip(messages, batch_response.responses):
+        if send_response.success:
+            result.success_count += 1
+            result.delivered_tokens.append(message.token)
+        else:
+            result.failure_count += 1
+            if is_dead_token_error(send_response.exception):
+                result.dead_tokens.append(message.token)
+    return result
+
+
+def send_push_batch(
+    notifications: Iterable[Tuple[str, str, str]],
+    dry_run: bool = False,
+) -> PushBatchResult:
+    """
+    批次發送推播
+
+    notifications 為 (token, title, body) 的序列；每 FCM_BATCH_SIZE 則呼叫一次
+    send_each，並收集 UNREGISTERED / INVALID_ARGUMENT 等代表 token 失效的錯誤。
+    """
+    result = PushBatchResult()
+    chunk: List[messaging.Message] = []
+    for token, title, body in notifications:
+        chunk.append(messaging.Message(
+            notification=messaging.Notification(title=title, body=body),
+            token=token,
+        ))
+        if len(chunk) >= FCM_BATCH_SIZE:
+            result.merge(_send_chunk(chunk, dry_run))
+            chunk = []
+    if chunk:
+        result.merge(_send_chunk(chunk, dry_run))
+
+    print(f"📨 批次推播完成：成功 {result.success_count}/{result.total}，失效 token {len(result.dead_tokens)} 個")
+    return result
+
+
+def migrate_token_table(cursor) -> List[str]:
+    """
+    為既有的 user_tokens 表補上 is_active 欄位與 idx_user_active 索引（可重複執行）
+
+    CREATE TABLE IF NOT EXISTS 不會修改已存在的表，而所有查詢 token 的 SQL 都會篩選
+    is_active = 1，因此舊表必須先補欄位。回傳實際執行的變更（不負責 commit）。
+    """
+    applied = []
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'user_tokens' AND COLUMN_NAME = 'is_active'
+    """)
+    if not cursor.fetchone()['count']:
+        cursor.execute("ALTER TABLE user_tokens ADD COLUMN is_active TINYINT(1) NOT NULL DEFAULT 1")
+        applied.append("ADD COLUMN is_active")
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'user_tokens' AND INDEX_NAME = 'idx_user_active'
+    """)
+    if not cursor.fetchone()['count']:
+        cursor.execute("ALTER TABLE user_tokens ADD INDEX idx_user_active (user_id, is_active)")
+        applied.append("ADD INDEX idx_user_active")
+    if applied:
+        print(f"🛠️ user_tokens 已遷移：{', '.join(applied)}")
+    return applied
+
+
+def deactivate_tokens(cursor, tokens: Sequence[str]) -> int:
+    """以單一 UPDATE 停用失效的 token，回傳受影響筆數（不負責 commit）"""
+    if not tokens:
+        return 0
+    unique_tokens = list(dict.fromkeys(tokens))
+    placeholders = ", ".join(["%s"] * len(unique_tokens))
+    sql = f"""
+        UPDATE user_tokens
+        SET is_active = 0
+        WHERE is_active = 1 AND firebase_token IN ({placeholders})
+    """
+    affected = cursor.execute(sql, unique_tokens)
+    print(f"🧹 已停用 {affected} 個失效 token")
+    return affected
+
+
+def send_push_batch_and_prune(
+    connection,
+    notifications: Iterable[Tuple[str, str, str]],
+    dry_run: bool = False,
+) -> PushBatchResult:
+    """
+    批次發送推播，並在每個 FCM 批次後把失效 token 一次停用
+
+    每次 cron 發送同時兼做 token 驗證，避免持續對失效 token 付費發送。
+    """
+    result = PushBatchResult()
+    chunk: List[Tuple[str, str, str]] = []
+
+    def flush():
+        chunk_result = send_push_batch(chunk, dry_run=dry_run)
+        if chunk_result.dead_tokens:
+            with connection.cursor() as cursor:
+                deactivate_tokens(cursor, chunk_result.dead_tokens)
+            connection.commit()
+        result.merge(chunk_result)
+
+    for item in notifications:
+        chunk.append(item)
+        if len(chunk) >= FCM_BATCH_SIZE:
+            flush()
+            chunk = []
+    if chunk:
+        flush()
+    return result
@@ -0,0 +1,210 @@
+"""
+測驗評語 - 常見結果走模板，複雜情況才呼叫 Gemini
+
+全對、全錯、沒有弱點或只有一個弱點時直接由 knowledge_stats 套模板產生評語；
+其餘情況呼叫 Gemini，並以正規化後的結果簽章（正確率區間 + 弱點知識點）為 key
+快取輸出，相同表現模式的下一位用戶直接共用。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import os
+from ai_cache import CachedResponse, ResponseCache, cache_key
+from gemini_client import generate_text
+
+QUIZ_COMMENT_MODEL = "gemini-2.0-flash"
+# 測驗評語的 Gemini 等待上限（秒）
+QUIZ_COMMENT_TIMEOUT = float(os.getenv("QUIZ_COMMENT_TIMEOUT", "3"))
+# 簽章中正確率的區間寬度（百分比）
+QUIZ_COMMENT_ACCURACY_BUCKET = int(os.getenv("QUIZ_COMMENT_ACCURACY_BUCKET", "10"))
+
+# 知識點正確率低於 70% 且至少 2 題視為弱點
+WEAK_POINT_ACCURACY = 0.7
+WEAK_POINT_MIN_TOTAL = 2
+
+PERFECT_TEMPLATES = [
+    "全對！太厲害了 🎉 繼續挑戰下一關吧！",
+    "滿分通過 💯 觀念很紮實，保持這個節奏！",
+    "零失誤 🌟 這關已經難不倒你了，往下一關前進！",
+]
+ZERO_TEMPLATES = [
+    "萬事起頭難 📖 先看看題目解析，下次會更順利！",
+    "別灰心 🌱 先回頭複習這章重點，再來挑戰一次！",
+]
+HIGH_TEMPLATES = [
+    "表現很棒 👍 把答錯的題目再看一次就更完美了！",
+    "很穩喔 💪 複習一下錯題，下次挑戰滿分！",
+]
+MID_TEMPLATES = [
+    "不錯喔 💪 複習一下錯題的觀念，下次一定更好！",
+    "有進步空間 📚 把錯題解析看懂，再試一次吧！",
+]
+LOW_TEMPLATES = [
+    "別灰心 🌱 先回頭複習這章重點，再來挑戰一次！",
+    "慢慢來 🐢 先把課本重點看一遍，再回來練習！",
+]
+ONE_WEAK_POINT_TEMPLATES = [
+    "整體不錯 👍 「{kp}」還不太熟，建議再複習一次！",
+    "加油 💪 把「{kp}」的觀念補起來就更棒了！",
+]
+
+
+class QuizCommentStats:
+    """評語來源統計：template / llm（含快取命中，見 quiz_comment_cache）/ fallback"""
+
+    def __init__(self):
+        self.counts = {"template": 0, "llm": 0, "fallback": 0}
+
+    def record(self, source: str) -> None:
+        self.counts[source] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        total = sum(self.counts.values())
+        return {
+            **self.counts,
+            "template_ratio": round(self.counts["template"] / total, 4) if total else 0.0,
+        }
+
+
+quiz_comment_stats = QuizCommentStats()
+quiz_comment_cache = ResponseCache()
+
+
+def compute_knowledge_stats(answer_history: List[dict]) -> Dict[str, Dict[str, int]]:
+    """統計每個知識點的答對數與題數"""
+    knowledge_stats: Dict[str, Dict[str, int]] = {}
+    for item in answer_history:
+        kp = item.get('knowledge_point', '未知')
+        if kp not in knowledge_stats:
+            knowledge_stats[kp] = {'correct': 0, 'total': 0}
+        knowledge_stats[kp]['total'] += 1
+        if item.get('is_correct', False):
+            knowledge_stats[kp]['correct'] += 1
+    return knowledge_stats
+
+
+def find_weak_points(knowledge_stats: Dict[str, Dict[str, int]]) -> List[str]:
+    """正確率偏低的知識點名稱（依名稱排序，確保簽章穩定）"""
+    return sorted(
+        kp for kp, stats in knowledge_stats.items()
+        if stats['total'] >= WEAK_POINT_MIN_TOTAL and stats['correct'] / stats['total'] < WEAK_POINT_ACCURACY
+    )
+
+
+def accuracy_bucket(correct_count: int, total_count: int) -> int:
+    """正確率落在哪個區間（以百分比表示的區間下限）"""
+    if total_count <= 0:
+        return 0
+    percent = correct_count * 100 // total_count
+    return percent // QUIZ_COMMENT_ACCURACY_BUCKET * QUIZ_COMMENT_ACCURACY_BUCKET
+
+
+def outcome_signature(correct_count: int, total_count: int, weak_points: List[str]) -> str:
+    """正規化後的結果簽章，作為 LLM 評語的快取 key"""
+    return f"{accuracy_bucket(correct_count, total_count)}|{'、'.join(weak_points)}"
+
+
+def _pick(templates: List[str], seed: str) -> str:
+    """以穩定雜湊挑選模板，同一用戶同一結果每次拿到相同評語"""
+    digest = hashlib.md5(seed.encode("utf-8")).digest()
+    return templates[int.from_bytes(digest[:4], "big") % len(templates)]
+
+
+def fallback_quiz_comment(correct_count: int, total_count: int, seed: str = "") -> str:
+    """只依正確率給出的固定評語（Gemini 逾時或失敗時也用這個）"""
+    accuracy = correct_count / total_count if total_count > 0 else 0
+    if accuracy >= 1:
+        return _pick(PERFECT_TEMPLATES, seed)
+    if accuracy >= 0.8:
+        return _pick(HIGH_TEMPLATES, seed)
+    if accuracy >= 0.6:
+        return _pick(MID_TEMPLATES, seed)
+    if accuracy > 0:
+        return _pick(LOW_TEMPLATES, seed)
+    return _pick(ZERO_TEMPLATES, seed)
+
+
+def template_quiz_comment(
+    correct_count: int,
+    total_count: int,
+    weak_points: List[str],
+    seed: str = "",
+) -> Optional[str]:
+    """
+    常見結果直接套模板；需要 LLM 時回傳 None
+
+    - 沒有作答、全對、全錯、沒有弱點：依正確率區間
+    - 只有一個弱點：點名該知識點
+    - 兩個以上弱點：交給 LLM
+    """
+    if total_count <= 0 or correct_count >= total_count or correct_count <= 0 or not weak_points:
+        return fallback_quiz_comment(correct_count, total_count, seed)
+    if len(weak_points) == 1:
+        return _pick(ONE_WEAK_POINT_TEMPLATES, seed).format(kp=weak_points[0])
+    return None
+
+
+def build_quiz_prompt(correct_count: int, total_count: int, weak_points: List[str]) -> str:
+    """
+    建構 Gemini 提示詞
+
+    只使用簽章中的資訊（正確率區間、弱點知識點），讓相同簽章的快取結果對每位用戶都成立；
+    表現不錯的知識點因人而異，不放進提示詞，以免快取的評語點名其他用戶的知識點。
+    """
+    bucket = accuracy_bucket(correct_count, total_count)
+    prompt = f"""請以溫暖鼓勵的語氣，分析這位學生在這次測驗中的表現：
+
+**測驗資訊：**
+- 正確率約 {bucket}%～{min(100, bucket + QUIZ_COMMENT_ACCURACY_BUCKET)}%
+
+**需要加強的知識點：**
+"""
+    for kp in weak_points:
+        prompt += f"- {kp}\n"
+
+    prompt += """
+請用繁體中文提供：
+1. 一句鼓勵的話
+2. 簡單指出需要加強的地方
+3. 給出1個具體的學習建議
+
+請保持正面鼓勵的語氣，控制在40字以內，可以使用 emoji。"""
+    return prompt
+
+
+async def generate_quiz_comment(
+    user_id: str,
+    correct_count: int,
+    total_count: int,
+    answer_history: List[dict],
+) -> Tuple[str, str]:
+    """
+    產生測驗評語，回傳 (評語, 來源)
+
+    來源為 template / llm / fallback；LLM 結果依結果簽章快取，逾時或失敗不寫入快取。
+    """
+    knowledge_stats = compute_knowledge_stats(answer_history)
+    weak_points = find_weak_points(knowledge_stats)
+    signature = outcome_signature(correct_count, total_count, weak_points)
+    seed = f"{user_id}:{signature}"
+
+    comment = template_quiz_comment(correct_count, total_count, weak_points, seed)
+    if comment is not None:
+        quiz_comment_stats.record("template")
+        return comment, "template"
+
+    async def compute() -> CachedResponse:
+        prompt = build_quiz_prompt(correct_count, total_count, weak_points)
+        return CachedResponse(text=await generate_text(prompt, QUIZ_COMMENT_MODEL, timeout=QUIZ_COMMENT_TIMEOUT))
+
+    # v2：舊版提示詞含有用戶個人的強項知識點，換 key 讓持久層中的舊評語不再被共用
+    key = cache_key(QUIZ_COMMENT_MODEL, "quiz_comment:v2", signature, None)
+    try:
+        entry, _ = await quiz_comment_cache.get_or_compute(key, QUIZ_COMMENT_MODEL, compute)
+    except Exception as e:
+        # asyncio.TimeoutError 也在此處理
+        print(f"⏱️ Gemini 評語未在 {QUIZ_COMMENT_TIMEOUT} 秒內完成，改用預設評語：{e!r}")
+        quiz_comment_stats.record("fallback")
+        return fallback_quiz_comment(correct_count, total_count, seed), "fallback"
+
+    quiz_comment_stats.record("llm")
+    return entry.text, "llm"
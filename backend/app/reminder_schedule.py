@@ -0,0 +1,81 @@
+"""
+學習提醒時間排程 - 以時間輪（hashed wheel）把提醒分散到用戶習慣的讀書時段
+
+一天切成 1440 個一分鐘的槽位。每位用戶的偏好槽位 = 習慣讀書小時 * 60 + hash(user_id) % 60，
+同一小時內的用戶依 hash 均勻分散；若該分鐘已達上限則往後順延到下一個有空位的槽位，
+藉此壓平 FCM 與資料庫的瞬間負載。
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import hashlib
+import os
+
+MINUTES_PER_DAY = 24 * 60
+
+# 台北時間（無日光節約）
+LOCAL_TZ = timezone(timedelta(hours=8))
+# 沒有答題紀錄的用戶預設在晚上 7 點提醒
+DEFAULT_REMINDER_HOUR = int(os.getenv("DEFAULT_REMINDER_HOUR", "19"))
+# 每分鐘最多發送的 token 數
+REMINDER_MAX_PER_MINUTE = int(os.getenv("REMINDER_MAX_PER_MINUTE", "200"))
+# 從排程當下起算的發送視窗（分鐘），超出視窗的偏好時段會折回視窗內
+REMINDER_WINDOW_MINUTES = int(os.getenv("REMINDER_WINDOW_MINUTES", str(MINUTES_PER_DAY)))
+
+
+def user_hash_minute(user_id: str) -> int:
+    """以 user_id 的穩定雜湊決定在一小時內的第幾分鐘（跨程序、跨重啟結果一致）"""
+    digest = hashlib.md5(user_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % 60
+
+
+def preferred_minute_of_day(user_id: str, study_hour: Optional[int]) -> int:
+    """用戶偏好的提醒時間（當地時間一天中的第幾分鐘）"""
+    hour = DEFAULT_REMINDER_HOUR if study_hour is None else int(study_hour) % 24
+    return hour * 60 + user_hash_minute(user_id)
+
+
+def local_minute_of_day(moment: datetime) -> int:
+    local = moment.astimezone(LOCAL_TZ)
+    return local.hour * 60 + local.minute
+
+
+@dataclass
+class ReminderWheel:
+    """
+    以分鐘為槽位的時間輪
+
+    start 為排程起點；place() 回傳相對於 start 的延遲分鐘數。
+    """
+    start: datetime
+    window_minutes: int = REMINDER_WINDOW_MINUTES
+    max_per_minute: int = REMINDER_MAX_PER_MINUTE
+    slots: List[int] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.slots:
+            self.slots = [0] * self.window_minutes
+        self._start_minute = local_minute_of_day(self.start)
+
+    def offset_for(self, minute_of_day: int) -> int:
+        """當地時間第 minute_of_day 分鐘距離排程起點的分鐘數（折回視窗內）"""
+        offset = (minute_of_day - self._start_minute) % MINUTES_PER_DAY
+        return offset % self.window_minutes
+
+    def place(self, user_id: str, study_hour: Optional[int]) -> int:
+        """為用戶分配槽位，回傳延遲分鐘數；槽位已滿時往後尋找，整個視窗都滿則放回偏好槽位"""
+        preferred = self.offset_for(preferred_minute_of_day(user_id, study_hour))
+        for step in range(self.window_minutes):
+            offset = (preferred + step) % self.window_minutes
+            if self.slots[offset] < self.max_per_minute:
+                self.slots[offset] += 1
+                return offset
+        self.slots[preferred] += 1
+        return preferred
+
+    def histogram(self) -> Dict[int, int]:
+        """非空槽位的每分鐘發送數"""
+        return {offset: count for offset, count in enumerate(self.slots) if count}
+
+    def send_time(self, offset: int) -> datetime:
+        return self.start + timedelta(minutes=offset)
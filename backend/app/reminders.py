@@ -0,0 +1,331 @@
+"""
+提醒推播工作 - 學習提醒與愛心回滿提醒的批次發送邏輯
+
+由工作佇列 worker 執行（見 job_queue.py / worker.py），每處理完一個批次就寫入
+checkpoint（最後處理的 user_tokens.id 與累計統計），當機重跑時從 checkpoint 續傳。
+
+學習提醒分兩段：learning_reminder 工作依用戶習慣讀書時段把 token 排進時間輪
+（見 reminder_schedule.py），每個非空的分鐘槽位各產生一個延遲執行的
+learning_reminder_slot 工作，到點時重新確認資格後才發送。發送前先在
+learning_reminder_claims 以 (user_id, remind_date) 主鍵認領當天的提醒，
+排程工作在 24 小時視窗內重跑或被重複觸發時，同一用戶當天只會收到一次。
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+import pymysql
+from database import get_db_connection, get_db_now
+from push import send_push_batch_and_prune
+from job_queue import JobContext, enqueue_jobs
+from reminder_schedule import LOCAL_TZ, ReminderWheel
+
+# 學習提醒在 reminder_history.message 中的標記，用於 12 小時內去重
+LEARNING_REMINDER_MESSAGE = "daily_learning_reminder"
+# 以 server-side cursor 串流讀取符合條件的用戶，每次取出的筆數
+REMINDER_FETCH_SIZE = 500
+
+JOB_LEARNING_REMINDER = "learning_reminder"
+JOB_LEARNING_REMINDER_SLOT = "learning_reminder_slot"
+JOB_HEART_REMINDER = "heart_reminder"
+
+# 學習提醒認領表：每位用戶每天（台北時間）只有一列，plan_job_id 為認領的排程工作
+CREATE_REMINDER_CLAIM_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS learning_reminder_claims (
+    user_id VARCHAR(255) NOT NULL,
+    remind_date DATE NOT NULL,
+    plan_job_id BIGINT NOT NULL,
+    claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, remind_date),
+    INDEX idx_remind_date_job (remind_date, plan_job_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# 「24 小時內未學習」且「12 小時內未收過學習提醒」的有效 token
+LEARNING_REMINDER_ELIGIBLE_CONDITIONS = """
+    ut.is_active = 1
+      AND NOT EXISTS (
+          SELECT 1 FROM user_level ul
+          WHERE ul.user_id = ut.user_id
+            AND ul.answered_at >= NOW() - INTERVAL 24 HOUR
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM reminder_history rh
+          WHERE rh.user_id = ut.user_id
+            AND rh.message = %s
+            AND rh.sent_at >= NOW() - INTERVAL 12 HOUR
+      )
+"""
+
+# 排程用：一次查出符合資格的 token 與用戶近 30 天最常答題的小時（台北時間）
+LEARNING_REMINDER_PLAN_SQL = f"""
+    SELECT ut.id, ut.user_id, habit.study_hour
+    FROM user_tokens ut
+    LEFT JOIN (
+        SELECT user_id, study_hour
+        FROM (
+            SELECT user_id,
+                   FLOOR(MOD(UNIX_TIMESTAMP(answered_at) + 8 * 3600, 86400) / 3600) AS study_hour,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY COUNT(*) DESC) AS rn
+            FROM user_level
+            WHERE answered_at >= NOW() - INTERVAL 30 DAY
+            GROUP BY user_id, study_hour
+        ) ranked
+        WHERE rn = 1
+    ) habit ON habit.user_id = ut.user_id
+    WHERE {LEARNING_REMINDER_ELIGIBLE_CONDITIONS}
+    ORDER BY ut.id
+"""
+
+# 發送用：到點時針對排定的 token 重新確認資格
+LEARNING_REMINDER_SEND_SQL = f"""
+    SELECT ut.id, ut.user_id, ut.firebase_token, u.name
+    FROM user_tokens ut
+    INNER JOIN users u ON ut.user_id = u.user_id
+    WHERE ut.id IN %s
+      AND {LEARNING_REMINDER_ELIGIBLE_CONDITIONS}
+    ORDER BY ut.id
+"""
+
+# 愛心已回滿的有效 token
+HEART_REMINDER_ELIGIBLE_SQL = """
+    SELECT ut.id, ut.user_id, ut.firebase_token
+    FROM user_tokens ut
+    JOIN user_heart uh ON ut.user_id = uh.user_id
+    WHERE uh.hearts = 5
+      AND ut.is_active = 1
+      AND ut.id > %s
+    ORDER BY ut.id
+"""
+
+
+def learning_reminder_content(name: str) -> tuple:
+    """學習提醒的推播標題與內容"""
+    title = "📚 該學習囉！"
+    body = f"{name or '同學'}，今天還沒有學習呢！保持每日學習習慣很重要哦～"
+    return title, body
+
+
+def heart_reminder_content() -> tuple:
+    """愛心回滿提醒的推播標題與內容"""
+    return "體力已回滿！", "快來 Dogtor 答題吧 ⚔️"
+
+
+def record_reminder_history(connection, user_ids, message: str) -> int:
+    """
+    以單一 executemany 批次寫入提醒歷史
+
+    sent_at 以參數帶入而非 NOW()：VALUES 中有非佔位符時 PyMySQL 會退回逐列執行。
+    """
+    rows = [(user_id, message) for user_id in dict.fromkeys(user_ids)]
+    if not rows:
+        return 0
+    with connection.cursor() as cursor:
+        now = get_db_now(cursor)
+        cursor.executemany("""
+            INSERT INTO reminder_history (user_id, message, sent_at, success)
+            VALUES (%s, %s, %s, %s)
+        """, [(user_id, message, now, 1) for user_id, message in rows])
+    connection.commit()
+    return len(rows)
+
+
+def claim_learning_reminders(connection, user_ids, remind_date: str, plan_job_id: int) -> set:
+    """
+    以 INSERT IGNORE 認領用戶當天的學習提醒，回傳屬於 plan_job_id 的用戶
+
+    同一次排程的多個槽位（同一用戶的多個 token 可能分在不同槽位）共用認領；
+    其他排程工作已認領的用戶會被排除。認領後才發送，寧可漏發也不重複發送。
+    """
+    users = list(dict.fromkeys(user_ids))
+    if not users:
+        return set()
+    with connection.cursor() as cursor:
+        cursor.executemany("""
+            INSERT IGNORE INTO learning_reminder_claims (user_id, remind_date, plan_job_id)
+            VALUES (%s, %s, %s)
+        """, [(user_id, remind_date, plan_job_id) for user_id in users])
+        cursor.execute("""
+            SELECT user_id FROM learning_reminder_claims
+            WHERE remind_date = %s AND plan_job_id = %s AND user_id IN %s
+        """, (remind_date, plan_job_id, tuple(users)))
+        owned = {row['user_id'] for row in cursor.fetchall()}
+    connection.commit()
+    return owned
+
+
+def stream_rows(connection, sql: str, params: tuple, fetch_size: int = REMINDER_FETCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """以 SSDictCursor 串流查詢結果，每次產出 fetch_size 筆"""
+    with connection.cursor(pymysql.cursors.SSDictCursor) as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def _initial_stats(checkpoint: Dict[str, Any]) -> Dict[str, int]:
+    stats = {"eligible_tokens": 0, "sent": 0, "dead_tokens": 0, "reminded_users": 0}
+    stats.update(checkpoint.get("stats", {}))
+    return stats
+
+
+def plan_learning_reminders(context: Optional[JobContext] = None) -> Dict[str, Any]:
+    """
+    依用戶習慣讀書時段排程學習提醒
+
+    串流符合資格的 token 放入時間輪，最後每個非空分鐘槽位批次產生一個延遲工作。
+    dedupe_key 含排程工作 ID 與槽位，重跑時不會重複產生同一槽位的工作；
+    不同排程工作之間的重複則由發送前的 claim_learning_reminders 排除。
+    """
+    job_id = context.job.id if context else 0
+    checkpoint = context.checkpoint if context else {}
+    connection = get_db_connection()
+    try:
+        # 排程起點寫入 checkpoint，重跑時沿用同一起點，槽位與 dedupe_key 才會一致
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT UNIX_TIMESTAMP() AS ts")
+            now_ts = int(cursor.fetchone()['ts'])
+        planned_at = checkpoint.get("planned_at")
+        if planned_at is None:
+            planned_at = now_ts
+            if context:
+                context.save_checkpoint({"planned_at": planned_at})
+        elapsed_seconds = now_ts - planned_at
+        wheel = ReminderWheel(start=datetime.fromtimestamp(planned_at, tz=timezone.utc))
+
+        slots = defaultdict(list)
+        for rows in stream_rows(connection, LEARNING_REMINDER_PLAN_SQL, (LEARNING_REMINDER_MESSAGE,)):
+            for row in rows:
+                offset = wheel.place(row['user_id'], row['study_hour'])
+                slots[offset].append(row['id'])
+            # 每個批次寫一次 checkpoint 當心跳；租約被接手時拋出 LeaseLostError 中止排程
+            if context:
+                context.save_checkpoint({"planned_at": planned_at})
+    finally:
+        connection.close()
+
+    scheduled = enqueue_jobs([
+        {
+            "job_type": JOB_LEARNING_REMINDER_SLOT,
+            "payload": {
+                "token_ids": token_ids,
+                "plan_job_id": job_id,
+                "remind_date": wheel.send_time(offset).astimezone(LOCAL_TZ).date().isoformat(),
+            },
+            "dedupe_key": f"{JOB_LEARNING_REMINDER_SLOT}:{job_id}:{offset}",
+            "delay_seconds": max(0, offset * 60 - elapsed_seconds),
+        }
+        for offset, token_ids in sorted(slots.items())
+    ])
+    histogram = wheel.histogram()
+    return {
+        "eligible_tokens": sum(histogram.values()),
+        "slot_jobs": scheduled,
+        "peak_per_minute": max(histogram.values(), default=0),
+    }
+
+
+def dispatch_learning_reminders(
+    token_ids: List[int],
+    context: Optional[JobContext] = None,
+    plan_job_id: int = 0,
+    remind_date: Optional[str] = None,
+) -> Dict[str, int]:
+    """
+    對排定的 token 分批發送學習提醒
+
+    讀取使用 SSDictCursor（不把整個結果集載入記憶體），因此推播回報的失效 token
+    與提醒歷史改由另一條連線寫入。查詢次數只與批次數有關，與用戶數無關。
+    每批發送前先認領用戶當天的提醒，已被其他排程工作認領的用戶不再發送。
+    """
+    checkpoint = context.checkpoint if context else {}
+    last_token_id = checkpoint.get("last_token_id", 0)
+    stats = _initial_stats(checkpoint)
+    stats.setdefault("already_claimed", 0)
+    remind_date = remind_date or datetime.now(LOCAL_TZ).date().isoformat()
+    remaining = tuple(token_id for token_id in token_ids if token_id > last_token_id)
+    if not remaining:
+        return stats
+
+    read_connection = get_db_connection()
+    write_connection = get_db_connection()
+    try:
+        for rows in stream_rows(read_connection, LEARNING_REMINDER_SEND_SQL, (remaining, LEARNING_REMINDER_MESSAGE)):
+            last_id = rows[-1]['id']
+            stats["eligible_tokens"] += len(rows)
+            owned = claim_learning_reminders(
+                write_connection, (row['user_id'] for row in rows), remind_date, plan_job_id
+            )
+            claimed_rows = [row for row in rows if row['user_id'] in owned]
+            stats["already_claimed"] += len(rows) - len(claimed_rows)
+            rows = claimed_rows
+            token_owner = {row['firebase_token']: row['user_id'] for row in rows}
+            result = send_push_batch_and_prune(
+                write_connection,
+                ((row['firebase_token'], *learning_reminder_content(row['name'])) for row in rows)
+            )
+            stats["sent"] += result.success_count
+            stats["dead_tokens"] += len(result.dead_tokens)
+            stats["reminded_users"] += record_reminder_history(
+                write_connection,
+                (token_owner[token] for token in result.delivered_tokens),
+                LEARNING_REMINDER_MESSAGE
+            )
+            if context:
+                context.save_checkpoint({"last_token_id": last_id, "stats": stats})
+    finally:
+        read_connection.close()
+        write_connection.close()
+    return stats
+
+
+def dispatch_heart_reminders(context: Optional[JobContext] = None) -> Dict[str, int]:
+    """串流愛心已回滿的用戶並分批發送提醒"""
+    checkpoint = context.checkpoint if context else {}
+    last_token_id = checkpoint.get("last_token_id", 0)
+    stats = _initial_stats(checkpoint)
+    title, body = heart_reminder_content()
+
+    read_connection = get_db_connection()
+    write_connection = get_db_connection()
+    try:
+        for rows in stream_rows(read_connection, HEART_REMINDER_ELIGIBLE_SQL, (last_token_id,)):
+            result = send_push_batch_and_prune(
+                write_connection,
+                ((row['firebase_token'], title, body) for row in rows)
+            )
+            stats["eligible_tokens"] += len(rows)
+            stats["sent"] += result.success_count
+            stats["dead_tokens"] += len(result.dead_tokens)
+            if context:
+                context.save_checkpoint({"last_token_id": rows[-1]['id'], "stats": stats})
+    finally:
+        read_connection.close()
+        write_connection.close()
+    return stats
+
+
+def run_learning_reminder_job(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    return plan_learning_reminders(context)
+
+
+def run_learning_reminder_slot_job(payload: Dict[str, Any], context: JobContext) -> Dict[str, int]:
+    return dispatch_learning_reminders(
+        payload.get("token_ids", []),
+        context,
+        plan_job_id=payload.get("plan_job_id", 0),
+        remind_date=payload.get("remind_date"),
+    )
+
+
+def run_heart_reminder_job(payload: Dict[str, Any], context: JobContext) -> Dict[str, int]:
+    return dispatch_heart_reminders(context)
+
+
+# 工作類型 → handler
+REMINDER_JOB_HANDLERS = {
+    JOB_LEARNING_REMINDER: run_learning_reminder_job,
+    JOB_LEARNING_REMINDER_SLOT: run_learning_reminder_slot_job,
+    JOB_HEART_REMINDER: run_heart_reminder_job,
+}
@@ -4,6 +4,10 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Body
 from database import get_db_connection
 from models import ImportKnowledgePointsRequest, StandardResponse
+from job_queue import CREATE_JOB_TABLE_SQL
+from ai_cache import CREATE_CACHE_TABLE_SQL
+from push import migrate_token_table
+from reminders import CREATE_REMINDER_CLAIM_TABLE_SQL
 from typing import Dict, Any
 import traceback
 import csv
@@ -222,14 +226,27 @@ async def create_required_tables():
             sql = """
             CREATE TABLE IF NOT EXISTS user_tokens (
                 id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id VARCHAR(255) NOT NULL,
-                token TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                INDEX idx_user_id (user_id)
+                user_id VARCHAR(50) NOT NULL,
+                firebase_token VARCHAR(255) NOT NULL,
+                device_info VARCHAR(255),
+                last_updated TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                is_active TINYINT(1) NOT NULL DEFAULT 1,
+                UNIQUE KEY uniq_token (firebase_token),
+                INDEX idx_user_active (user_id, is_active)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             """
             cursor.execute(sql)
+            # 既有的 user_tokens 表補上 is_active 欄位與索引
+            migrate_token_table(cursor)
+            
+            # 創建推播工作佇列表
+            cursor.execute(CREATE_JOB_TABLE_SQL)
+            
+            # 創建學習提醒認領表（每位用戶每天一列）
+            cursor.execute(CREATE_REMINDER_CLAIM_TABLE_SQL)
+            
+            # 創建 AI 回應快取表
+            cursor.execute(CREATE_CACHE_TABLE_SQL)
             
             connection.commit()
             return StandardResponse(success=True, message="資料表創建成功")
@@ -311,11 +328,11 @@ async def cleanup_inactive_tokens():
     try:
         connection = get_db_connection()
         with connection.cursor() as cursor:
-            # 刪除 30 天內未更新的不活躍 token
-            #WHERE is_active = 0
+            # 刪除停用超過 30 天的 token（推播發送時回報失效的 token 會被標記 is_active = 0）
             sql = """
-            DELETE FROM user_tokens   
-            AND updated_at < DATE_SUB(NOW(), INTERVAL 30 DAY)
+            DELETE FROM user_tokens
+            WHERE is_active = 0
+              AND last_updated < DATE_SUB(NOW(), INTERVAL 30 DAY)
             """
             cursor.execute(sql)
             deleted_count = cursor.rowcount
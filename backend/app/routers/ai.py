@@ -1,139 +1,295 @@
 """
 AI 相關 API
 """
-from fastapi import APIRouter, HTTPException
-from openai import OpenAI
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from models import ChatRequest, ClassifyTextRequest, ClassifyTextResponse, AnalyzeQuizRequest, AnalyzeQuizResponse, AnalyzeQuizPerformanceRequest
 #from database import get_openai_client
-import os
 from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional
+import asyncio
+import importlib
+import json
+import sys
+import time
 import traceback
-import vertexai
-from vertexai.generative_models import GenerativeModel
+from ai_client import chat_completion, request_client_ip, stream_chat_completion, stream_metrics
+from ai_cache import CachedResponse, cache_key, summarize_cache
+from quiz_comments import generate_quiz_comment, quiz_comment_cache, quiz_comment_stats
+from image_preprocess import AI_IMAGE_MAX_SIDE, decode_image_base64, image_bytes_digest, prepare_image, preprocess_stats
 
 # 加載環境變數
 load_dotenv()
 
 router = APIRouter(prefix="/ai", tags=["AI"])
 
-# 初始化 OpenAI 客戶端
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+
+async def request_image_url(request: ChatRequest) -> Optional[str]:
+    """把請求中的圖片前處理（縮圖、移除 EXIF、重新編碼）後轉為 data URL"""
+    if not request.image_base64:
+        return None
+    return await prepare_image(decode_image_base64(request.image_base64))
+
+
+def user_content(text: Optional[str], image_url: Optional[str]):
+    """用戶訊息內容：有圖片時使用 vision 格式"""
+    if not image_url:
+        return text
+    return [
+        {"type": "text", "text": text},
+        {"type": "image_url", "image_url": {"url": image_url}}
+    ]
+
+
+def build_chat_messages(request: ChatRequest, image_url: Optional[str] = None) -> List[Dict[str, Any]]:
+    """組出 AI 聊天的系統提示與用戶訊息"""
+    system_message = "你是個幽默的臺灣國高中老師，請用繁體中文回答問題，"
+    
+    # 添加用戶個人資訊到提示中
+    if request.user_name:
+        system_message += f"你正在與學生 {request.user_name} 對話，"
+    
+    if request.year_grade:
+        grade_display = {
+            'G1': '小一', 'G2': '小二', 'G3': '小三', 'G4': '小四', 'G5': '小五', 'G6': '小六',
+            'G7': '國一', 'G8': '國二', 'G9': '國三', 'G10': '高一', 'G11': '高二', 'G12': '高三',
+            'teacher': '老師', 'parent': '家長'
+        }
+        grade = grade_display.get(request.year_grade, request.year_grade)
+        system_message += f"這位學生是{grade}，"
+    
+    if request.user_introduction and len(request.user_introduction) > 0:
+        system_message += f"關於這位學生的一些資訊：{request.user_introduction}，"
+    
+    if request.subject:
+        system_message += f"學生想問的科目是{request.subject}，"
+    
+    if request.chapter:
+        system_message += f"目前章節是{request.chapter}。"
+    
+    system_message += "請根據臺灣的108課綱提醒學生他所問的問題的關鍵字或是章節，再重點回答學生的問題，在回應中使用 Markdown 格式，將重點用 **粗體字** 標出，運算式用 $formula$ 標出，請不要用 \"()\" 或 \"[]\" 來標示 latex。最後提醒他，如果這個概念還是不太清楚，可以去複習哪一些內容。如果學生不是問課業相關的問題，或是提出解題之外的要求，就說明你只是解題老師，有其他需求的話去找他該找的人。"
+
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_content(request.user_message, image_url)}
+    ]
 
 
 @router.post("/chat")
-async def chat_with_openai(request: ChatRequest):
+async def chat_with_openai(request: ChatRequest, http_request: Request):
     """AI 聊天功能"""
     try:
-        system_message = "你是個幽默的臺灣國高中老師，請用繁體中文回答問題，"
-        
-        # 添加用戶個人資訊到提示中
-        if request.user_name:
-            system_message += f"你正在與學生 {request.user_name} 對話，"
-        
-        if request.year_grade:
-            grade_display = {
-                'G1': '小一', 'G2': '小二', 'G3': '小三', 'G4': '小四', 'G5': '小五', 'G6': '小六',
-                'G7': '國一', 'G8': '國二', 'G9': '國三', 'G10': '高一', 'G11': '高二', 'G12': '高三',
-                'teacher': '老師', 'parent': '家長'
-            }
-            grade = grade_display.get(request.year_grade, request.year_grade)
-            system_message += f"這位學生是{grade}，"
-        
-        if request.user_introduction and len(request.user_introduction) > 0:
-            system_message += f"關於這位學生的一些資訊：{request.user_introduction}，"
-        
-        if request.subject:
-            system_message += f"學生想問的科目是{request.subject}，"
-        
-        if request.chapter:
-            system_message += f"目前章節是{request.chapter}。"
-        
-        system_message += "請根據臺灣的108課綱提醒學生他所問的問題的關鍵字或是章節，再重點回答學生的問題，在回應中使用 Markdown 格式，將重點用 **粗體字** 標出，運算式用 $formula$ 標出，請不要用 \"()\" 或 \"[]\" 來標示 latex。最後提醒他，如果這個概念還是不太清楚，可以去複習哪一些內容。如果學生不是問課業相關的問題，或是提出解題之外的要求，就說明你只是解題老師，有其他需求的話去找他該找的人。"
+        messages = build_chat_messages(request, await request_image_url(request))
 
-        messages = [
-            {"role": "system", "content": system_message}
-        ]
-        
-        if request.image_base64:
-            messages.append({
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": request.user_message},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{request.image_base64}"
-                        }
-                    }
-                ]
-            })
-        else:
-            messages.append({"role": "user", "content": request.user_message})
-
-        response = client.chat.completions.create(
+        response = await chat_completion(
+            messages,
             model="gpt-4o",
-            messages=messages,
-            max_tokens=500
+            max_tokens=500,
+            user_id=request.user_id,
+            client_ip=request_client_ip(http_request)
         )
         
         return {"response": response.choices[0].message.content}
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"AI 聊天錯誤: {e}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"AI 聊天錯誤: {str(e)}")
 
 
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """格式化一則 Server-Sent Event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_with_openai_stream(request: ChatRequest, http_request: Request):
+    """
+    AI 聊天功能（SSE 串流版）
+
+    以 `data: {"delta": "..."}` 逐段回傳內容，結束時送出 `event: done`（含 TTFT 與總耗時）。
+    客戶端斷線時會立即關閉上游串流，停止生成。
+    """
+    started = time.perf_counter()
+    messages = build_chat_messages(request, await request_image_url(request))
+    deltas = stream_chat_completion(
+        messages,
+        model="gpt-4o",
+        max_tokens=500,
+        user_id=request.user_id,
+        client_ip=request_client_ip(http_request)
+    )
+
+    # 先取得第一段內容再回應，讓 429 與上游錯誤仍能以一般 HTTP 狀態碼回傳
+    try:
+        first_delta = await deltas.__anext__()
+    except StopAsyncIteration:
+        first_delta = ""
+    except HTTPException:
+        raise
+    except Exception as e:
+        stream_metrics.record("failed", None, time.perf_counter() - started)
+        print(f"AI 聊天錯誤: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"AI 聊天錯誤: {str(e)}")
+    ttft = time.perf_counter() - started
+
+    async def event_stream():
+        outcome = "completed"
+        try:
+            if first_delta:
+                yield sse_event({"delta": first_delta})
+            async for delta in deltas:
+                if await http_request.is_disconnected():
+                    outcome = "cancelled"
+                    break
+                yield sse_event({"delta": delta})
+            if outcome == "completed":
+                total = time.perf_counter() - started
+                yield sse_event({"ttft_ms": round(ttft * 1000), "total_ms": round(total * 1000)}, event="done")
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "failed"
+            print(f"AI 串流錯誤: {e}")
+            print(traceback.format_exc())
+            yield sse_event({"message": f"AI 聊天錯誤: {str(e)}"}, event="error")
+        finally:
+            # 關閉上游串流（客戶端斷線時停止 OpenAI 繼續生成）
+            await deltas.aclose()
+            total = time.perf_counter() - started
+            stream_metrics.record(outcome, ttft, total)
+            print(f"💬 串流聊天 {outcome}：TTFT {ttft * 1000:.0f}ms，總耗時 {total * 1000:.0f}ms")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/metrics")
+async def get_ai_metrics():
+    """AI 端點統計：串流延遲、摘要快取命中率與節省的 token 數、圖片前處理前後大小、測驗評語來源"""
+    return {
+        "chat_stream": stream_metrics.snapshot(),
+        "summarize_cache": summarize_cache.snapshot(),
+        "image_preprocess": preprocess_stats.snapshot(),
+        "quiz_comment": {
+            **quiz_comment_stats.snapshot(),
+            "cache": quiz_comment_cache.snapshot()
+        }
+    }
+
+
+SUMMARIZE_MODEL = "gpt-4o"
+SUMMARIZE_MAX_TOKENS = 1000
+
+
 @router.post("/summarize")
-async def summarize_content(request: ChatRequest):
+async def summarize_content(request: ChatRequest, http_request: Request):
     """內容摘要生成"""
     try:
         system_message = "請你用十個字以內的話總結這個題目的重點，回傳十字總結"
 
-        messages = [
-            {"role": "system", "content": system_message}
-        ]
-
-        if request.image_base64:
-            messages.append({
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": request.user_message},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{request.image_base64}"
-                        }
-                    }
-                ]
-            })
-        else:
-            messages.append({"role": "user", "content": request.user_message})
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=1000
+        # 原圖只解碼一次：先用來算快取 key，未命中時再交給前處理
+        raw_image = decode_image_base64(request.image_base64) if request.image_base64 else None
+
+        async def compute() -> CachedResponse:
+            image_url = await prepare_image(raw_image) if raw_image else None
+            messages = [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_content(request.user_message, image_url)}
+            ]
+            response = await chat_completion(
+                messages,
+                model=SUMMARIZE_MODEL,
+                max_tokens=SUMMARIZE_MAX_TOKENS,
+                user_id=request.user_id,
+                client_ip=request_client_ip(http_request)
+            )
+            usage = response.usage
+            return CachedResponse(
+                text=response.choices[0].message.content,
+                total_tokens=usage.total_tokens if usage else 0
+            )
+
+        # 同一題目（文字 + 圖片內容）重複摘要時直接使用快取
+        key = cache_key(
+            SUMMARIZE_MODEL,
+            system_message,
+            request.user_message,
+            image_bytes_digest(raw_image),
+            max_tokens=SUMMARIZE_MAX_TOKENS,
+            image_max_side=AI_IMAGE_MAX_SIDE
         )
+        entry, source = await summarize_cache.get_or_compute(key, SUMMARIZE_MODEL, compute)
         
-        return {"response": response.choices[0].message.content}
+        return {"response": entry.text, "cached": source != "upstream"}
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"摘要生成錯誤: {e}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"摘要生成錯誤: {str(e)}")
 
 
+_text_classifier = None
+
+
+async def load_text_classifier():
+    """
+    延遲 import text_classifier：torch 不在應用啟動時載入
+
+    import torch 需要數秒，在執行緒中進行才不會阻塞事件迴圈；暖機正在 import 時，
+    執行緒會等到模組初始化完成再回傳。
+    """
+    global _text_classifier
+    if _text_classifier is None:
+        _text_classifier = await asyncio.to_thread(importlib.import_module, "text_classifier")
+    return _text_classifier
+
+
 @router.post("/classify_text", response_model=ClassifyTextResponse)
 async def classify_text(request: ClassifyTextRequest):
-    """文本分類（需要實作 TextCNN 模型）"""
-    # TODO: 實作 TextCNN 模型載入和預測邏輯
+    """使用本地 TextCNN 模型對文本進行分類，回傳前 top_k 個標籤與信心度"""
+    text = request.text.strip()
+    if not text:
+        return ClassifyTextResponse(success=False, message="缺少文本輸入")
+    
+    try:
+        text_classifier = await load_text_classifier()
+        predictions = await text_classifier.predict_text(text, request.top_k)
+    except Exception as e:
+        print(f"文本分類時出錯: {e}")
+        print(traceback.format_exc())
+        return ClassifyTextResponse(success=False, message=f"分類失敗: {str(e)}")
+    
     return ClassifyTextResponse(
-        success=False,
-        message="文本分類功能尚未實作"
+        success=True,
+        predicted_class=predictions[0]["label"],
+        confidence=predictions[0]["confidence"],
+        top_predictions=predictions,
+        message="分類成功"
     )
 
+
+@router.get("/classify_text/status")
+async def classify_text_status(http_request: Request):
+    """TextCNN 模型載入狀態與冷啟動時間（不會為了查詢狀態而 import torch）"""
+    classifier_status = getattr(sys.modules.get("text_classifier"), "classifier_status", None)
+    if classifier_status is None:
+        # 模組尚未 import 完成：暖機工作仍在執行即為載入中
+        warmup = getattr(http_request.app.state, "textcnn_warmup", None)
+        loading = warmup is not None and not warmup.done()
+        return {"success": True, "model_info": {"loaded": False, "loading": loading}}
+    return {"success": True, "model_info": classifier_status()}
+
 @router.post("/analyze_image")
 async def analyze_image():
     """圖片分析功能（待實作）"""
@@ -142,75 +298,25 @@ async def analyze_image():
 
 @router.post("/analyze_quiz_performance", response_model=AnalyzeQuizResponse)
 async def analyze_quiz_performance(request: AnalyzeQuizPerformanceRequest):
-    """使用 Gemini AI 分析用戶當前答題表現並提供鼓勵和建議"""
-    try:
-        # 初始化 Vertex AI
-        vertexai.init(project=os.getenv("GOOGLE_CLOUD_PROJECT"), location="us-central1")
-        
-        # 創建模型實例
-        model = GenerativeModel("gemini-2.0-flash")
-        
-        # 準備分析資料
-        answer_history = request.answer_history
-        correct_answers = [item for item in answer_history if item.get('is_correct', False)]
-        wrong_answers = [item for item in answer_history if not item.get('is_correct', True)]
-        
-        # 統計知識點表現
-        knowledge_stats = {}
-        for item in answer_history:
-            kp = item.get('knowledge_point', '未知')
-            if kp not in knowledge_stats:
-                knowledge_stats[kp] = {'correct': 0, 'total': 0}
-            knowledge_stats[kp]['total'] += 1
-            if item.get('is_correct', False):
-                knowledge_stats[kp]['correct'] += 1
-        
-        # 找出表現較弱的知識點
-        weak_points = []
-        for kp, stats in knowledge_stats.items():
-            if stats['total'] > 0:
-                accuracy = stats['correct'] / stats['total']
-                if accuracy < 0.7 and stats['total'] >= 2:  # 正確率低於70%且至少有2題
-                    weak_points.append(f"{kp} ({stats['correct']}/{stats['total']})")
-        
-        # 構建分析提示詞
-        accuracy_percent = (request.correct_count / request.total_count * 100) if request.total_count > 0 else 0
-        
-        prompt = f"""請以溫暖鼓勵的語氣，分析這位學生在這次測驗中的表現：
-
-**測驗資訊：**
-- 成績：{request.correct_count}/{request.total_count} ({accuracy_percent:.0f}%)
+    """
+    分析用戶當前答題表現並提供鼓勵和建議
 
-**知識點表現：**
-"""
-        
-        for kp, stats in knowledge_stats.items():
-            accuracy = (stats['correct'] / stats['total'] * 100) if stats['total'] > 0 else 0
-            prompt += f"- {kp}：{stats['correct']}/{stats['total']} ({accuracy:.0f}%)\n"
-        
-        if wrong_answers:
-            prompt += f"\n**答錯的題目：**\n"
-            for i, item in enumerate(wrong_answers[:5], 1):  # 只分析前5題錯誤
-                prompt += f"{i}. {item.get('knowledge_point', '未知')} - 選了「{item.get('selected_option', '未知')}」，正確答案是「{item.get('correct_option', '未知')}」\n"
-        
-        prompt += f"""
-請用繁體中文提供：
-1. 一句鼓勵的話
-2. 如果有表現較弱的知識點，簡單指出需要加強的地方
-3. 給出1個具體的學習建議
-
-請保持正面鼓勵的語氣，控制在40字以內，可以使用 emoji。"""
-        
-        # 生成分析
-        response = model.generate_content(prompt)
-        ai_comment = response.text.strip()
+    常見結果（全對、全錯、單一弱點等）直接套模板，只有多個弱點時才呼叫 Gemini。
+    """
+    try:
+        ai_comment, source = await generate_quiz_comment(
+            request.user_id,
+            request.correct_count,
+            request.total_count,
+            request.answer_history,
+        )
         
         # 返回包含兩個欄位名稱的回應以確保兼容性
         return AnalyzeQuizResponse(
             success=True,
             ai_comment=ai_comment,
             analysis=ai_comment,  # 前端期望的欄位名稱
-            message="分析完成"
+            message="分析完成（預設評語）" if source == "fallback" else "分析完成"
         )
         
     except Exception as e:
@@ -0,0 +1,313 @@
+"""
+TextCNN 文本分類推論服務 - 程序內載入一次模型與 tokenizer
+
+取代 main_old.py 每次從 GCS 下載到暫存檔再載入的做法：模型從本地路徑
+（TEXTCNN_MODEL_PATH）載入一次，tokenizer 也只初始化一次；推論在
+torch.inference_mode 下於專用執行緒中執行，並限制 intra-op 執行緒數，避免與
+uvicorn worker 搶 CPU。同時到達的請求經 MicroBatcher 合併成一次前向運算，並只補齊
+到該批最長的文本。若檢查點旁有 tools/export_textcnn.py 匯出的 TorchScript／int8
+模型檔，優先載入。
+
+模型不在 import 時載入：啟動後以背景工作暖機（或等第一個請求），eager 檢查點以
+mmap 載入，tokenizer 優先讀取模型目錄下的本地詞彙檔。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import threading
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from transformers import BertTokenizerFast
+from micro_batcher import MicroBatcher
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ARTIFACT_FILENAMES = {
+    "torchscript": "textcnn.ts.pt",
+    "int8": "textcnn.int8.ts.pt",
+}
+SCRIPT_METADATA_FILE = "metadata.json"
+
+# 模型檢查點路徑（state dict，見 test_model.py）；部署時由 cloudbuild.yaml 從 GCS 取得後打包進映像檔
+TEXTCNN_MODEL_GCS_URI = "gs://dogtor_asset/models/best_textcnn.pt"
+TEXTCNN_MODEL_PATH = os.getenv("TEXTCNN_MODEL_PATH", os.path.join(APP_DIR, "models", "best_textcnn.pt"))
+# 訓練時使用的 tokenizer；詞彙檔放在模型目錄下的 tokenizer/（Dockerfile 建置時或 tools/export_textcnn.py 產生）
+TEXTCNN_TOKENIZER_HUB_NAME = "bert-base-uncased"
+
+
+def tokenizer_dir(model_path: str) -> str:
+    return os.path.join(os.path.dirname(model_path), "tokenizer")
+
+
+_VENDORED_TOKENIZER_DIR = tokenizer_dir(TEXTCNN_MODEL_PATH)
+# 預設只讀本地詞彙檔，缺少時直接報錯而不是在執行期連 Hub 下載；明確設定才會改用其他目錄或 Hub 名稱
+TEXTCNN_TOKENIZER = os.getenv("TEXTCNN_TOKENIZER", _VENDORED_TOKENIZER_DIR)
+TEXTCNN_MAX_LENGTH = int(os.getenv("TEXTCNN_MAX_LENGTH", "128"))
+# torch intra-op 執行緒數（Cloud Run 1-2 vCPU 時設 1-2 即可）
+TEXTCNN_TORCH_THREADS = int(os.getenv("TEXTCNN_TORCH_THREADS", "1"))
+TEXTCNN_TOP_K = int(os.getenv("TEXTCNN_TOP_K", "3"))
+# 載入哪個版本：auto（有最佳化檔就用）/ int8 / torchscript / eager
+TEXTCNN_MODEL_VARIANT = os.getenv("TEXTCNN_MODEL_VARIANT", "auto")
+# 微批次：第一筆請求後最多等待的毫秒數與單批上限
+TEXTCNN_BATCH_WINDOW_MS = float(os.getenv("TEXTCNN_BATCH_WINDOW_MS", "5"))
+TEXTCNN_MAX_BATCH_SIZE = int(os.getenv("TEXTCNN_MAX_BATCH_SIZE", "32"))
+
+WARMUP_TEXT = "解一元二次方程式 x² - 5x + 6 = 0"
+
+
+class TextCNN(nn.Module):
+    def __init__(self, vocab_size, embed_size, num_classes, num_filters=100, filter_sizes=[3, 4, 5], dropout=0.5):
+        super(TextCNN, self).__init__()
+        self.embedding = nn.Embedding(vocab_size, embed_size)
+        self.convs = nn.ModuleList([
+            nn.Conv1d(embed_size, num_filters, filter_size)
+            for filter_size in filter_sizes
+        ])
+        self.dropout = nn.Dropout(dropout)
+        self.fc = nn.Linear(len(filter_sizes) * num_filters, num_classes)
+
+    def forward(self, x):
+        x = self.embedding(x)  # (batch_size, seq_len, embed_size)
+        x = x.permute(0, 2, 1)  # (batch_size, embed_size, seq_len)
+
+        conv_outputs = []
+        for conv in self.convs:
+            conv_out = torch.relu(conv(x))  # (batch_size, num_filters, new_seq_len)
+            pooled = torch.max_pool1d(conv_out, conv_out.size(2))  # (batch_size, num_filters, 1)
+            conv_outputs.append(pooled.squeeze(2))  # (batch_size, num_filters)
+
+        x = torch.cat(conv_outputs, dim=1)  # (batch_size, len(filter_sizes) * num_filters)
+        x = self.dropout(x)
+        x = self.fc(x)
+        return x
+
+
+def load_eager_model(model_path: str) -> Tuple[TextCNN, List[str]]:
+    """從 state dict 檢查點建立 eager 模型，回傳 (模型, 標籤)"""
+    # mmap：權重直接映射檔案頁面，用到時才由作業系統讀入，不先整份複製到記憶體
+    checkpoint = torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+    model_state = checkpoint.get("model_state_dict", checkpoint)
+    vocab_size, embed_size = model_state["embedding.weight"].shape
+    num_classes = model_state["fc.weight"].shape[0]
+
+    # 在 meta device 上建立模型（不配置、不初始化權重），再以 assign 直接採用映射的張量
+    with torch.device("meta"):
+        model = TextCNN(vocab_size=vocab_size, embed_size=embed_size, num_classes=num_classes)
+    model.load_state_dict(model_state, assign=True)
+    model.eval()
+
+    idx_to_label = checkpoint.get("idx_to_label") if isinstance(checkpoint, dict) else None
+    labels = [
+        idx_to_label[i] if idx_to_label and i < len(idx_to_label) else f"類別_{i}"
+        for i in range(num_classes)
+    ]
+    return model, labels
+
+
+def model_min_length(model: TextCNN) -> int:
+    """序列長度至少要等於最大的卷積核寬度"""
+    return max(conv.kernel_size[0] for conv in model.convs)
+
+
+def artifact_path(model_path: str, variant: str) -> str:
+    """與檢查點同目錄下的最佳化模型檔（tools/export_textcnn.py 產生）"""
+    return os.path.join(os.path.dirname(model_path), ARTIFACT_FILENAMES[variant])
+
+
+def resolve_model_variant(model_path: str, variant: str = TEXTCNN_MODEL_VARIANT) -> Tuple[str, str]:
+    """依 TEXTCNN_MODEL_VARIANT 決定要載入的檔案；auto 時優先 int8，其次 TorchScript，最後 eager"""
+    if variant == "eager":
+        return "eager", model_path
+    if variant != "auto":
+        return variant, artifact_path(model_path, variant)
+    for candidate in ("int8", "torchscript"):
+        path = artifact_path(model_path, candidate)
+        if os.path.exists(path):
+            return candidate, path
+    return "eager", model_path
+
+
+def save_scripted_model(model: nn.Module, path: str, labels: List[str], min_length: int) -> None:
+    """以 TorchScript 儲存，標籤與最小序列長度一起寫入 extra files"""
+    metadata = json.dumps({"labels": labels, "min_length": min_length}, ensure_ascii=False)
+    torch.jit.save(torch.jit.script(model), path, _extra_files={SCRIPT_METADATA_FILE: metadata})
+
+
+def load_scripted_model(path: str) -> Tuple[torch.jit.ScriptModule, List[str], int]:
+    extra_files = {SCRIPT_METADATA_FILE: ""}
+    model = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+    model.eval()
+    metadata = json.loads(extra_files[SCRIPT_METADATA_FILE])
+    return model, metadata["labels"], metadata["min_length"]
+
+
+def load_tokenizer(tokenizer_name: str = TEXTCNN_TOKENIZER) -> BertTokenizerFast:
+    """本地目錄只讀本地檔案；否則從 Hub（或其快取）載入"""
+    if tokenizer_name == _VENDORED_TOKENIZER_DIR and not os.path.isdir(tokenizer_name):
+        raise FileNotFoundError(
+            f"找不到 tokenizer 詞彙檔目錄 {tokenizer_name}；請執行 tools/export_textcnn.py 產生，"
+            f"或設定 TEXTCNN_TOKENIZER={TEXTCNN_TOKENIZER_HUB_NAME} 改從 Hugging Face Hub 下載"
+        )
+    return BertTokenizerFast.from_pretrained(tokenizer_name, local_files_only=os.path.isdir(tokenizer_name))
+
+
+class TextClassifier:
+    """已載入的 TextCNN 模型（eager、TorchScript 或 int8）、tokenizer 與標籤"""
+
+    def __init__(
+        self,
+        model: nn.Module,
+        tokenizer,
+        labels: List[str],
+        min_length: int,
+        variant: str = "eager",
+        load_seconds: float = 0.0,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.labels = labels
+        self.min_length = min_length
+        self.variant = variant
+        self.load_seconds = load_seconds
+
+    @classmethod
+    def load(
+        cls,
+        model_path: str = TEXTCNN_MODEL_PATH,
+        tokenizer_name: str = TEXTCNN_TOKENIZER,
+        variant: str = TEXTCNN_MODEL_VARIANT,
+    ) -> "TextClassifier":
+        started = time.perf_counter()
+        torch.set_num_threads(TEXTCNN_TORCH_THREADS)
+
+        tokenizer = load_tokenizer(tokenizer_name)
+        variant, path = resolve_model_variant(model_path, variant)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"找不到 TextCNN 模型檔 {path}；請先執行 gsutil cp {TEXTCNN_MODEL_GCS_URI} {model_path}"
+                "（或設定 TEXTCNN_MODEL_PATH）"
+            )
+        if variant == "eager":
+            model, labels = load_eager_model(path)
+            min_length = model_min_length(model)
+        else:
+            model, labels, min_length = load_scripted_model(path)
+
+        load_seconds = time.perf_counter() - started
+        print(f"✅ TextCNN 模型載入完成（{variant}）：{path}，classes={len(labels)}，{load_seconds:.2f}s")
+        return cls(model, tokenizer, labels, min_length, variant, load_seconds)
+
+    def encode(self, texts: List[str]) -> torch.Tensor:
+        """只補齊到這一批最長的文本（而非固定的 TEXTCNN_MAX_LENGTH），省下短文本的卷積運算"""
+        encoding = self.tokenizer(
+            texts,
+            add_special_tokens=True,
+            max_length=TEXTCNN_MAX_LENGTH,
+            padding="longest",
+            truncation=True,
+            return_tensors="pt",
+        )
+        input_ids = encoding["input_ids"]
+        if input_ids.shape[1] < self.min_length:
+            input_ids = F.pad(input_ids, (0, self.min_length - input_ids.shape[1]), value=self.tokenizer.pad_token_id)
+        return input_ids
+
+    def predict_proba(self, texts: List[str]) -> torch.Tensor:
+        """回傳各類別機率，形狀 (len(texts), num_classes)"""
+        input_ids = self.encode(texts)
+        with torch.inference_mode():
+            return torch.softmax(self.model(input_ids), dim=1)
+
+    def classify(self, texts: List[str], top_k: int = TEXTCNN_TOP_K) -> List[List[Dict[str, Any]]]:
+        """對一批文本分類，每筆回傳依信心度排序的前 top_k 個標籤"""
+        probabilities = self.predict_proba(texts)
+        top_probs, top_indices = torch.topk(probabilities, min(top_k, probabilities.shape[1]), dim=1)
+
+        return [
+            [
+                {"label": self.labels[idx], "confidence": round(prob, 6)}
+                for prob, idx in zip(probs, indices)
+            ]
+            for probs, indices in zip(top_probs.tolist(), top_indices.tolist())
+        ]
+
+    def classify_requests(self, requests: List[Tuple[str, int]]) -> List[List[Dict[str, Any]]]:
+        """微批次入口：requests 為 (文本, top_k)，整批一次前向運算後依各自的 top_k 截斷"""
+        results = self.classify([text for text, _ in requests], max(top_k for _, top_k in requests))
+        return [result[:top_k] for result, (_, top_k) in zip(results, requests)]
+
+
+_classifier: Optional[TextClassifier] = None
+_load_lock = threading.Lock()
+# 冷啟動量測：從第一次要求載入（暖機或第一個請求）到第一次分類成功的秒數
+cold_start: Dict[str, Optional[float]] = {
+    "load_requested_at": None,
+    "first_classification_seconds": None,
+}
+# 推論專用執行緒（平行度由 torch intra-op 執行緒提供）
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="textcnn")
+
+
+def _classify_batch(requests: List[Tuple[str, int]]) -> List[List[Dict[str, Any]]]:
+    return load_classifier().classify_requests(requests)
+
+
+classify_batcher = MicroBatcher(
+    _classify_batch,
+    max_batch_size=TEXTCNN_MAX_BATCH_SIZE,
+    max_wait_ms=TEXTCNN_BATCH_WINDOW_MS,
+    executor=_executor,
+)
+
+
+def load_classifier() -> TextClassifier:
+    """載入模型（同一程序只載入一次，第一次使用或暖機時才載入）"""
+    global _classifier
+    if _classifier is None:
+        if cold_start["load_requested_at"] is None:
+            cold_start["load_requested_at"] = time.perf_counter()
+        with _load_lock:
+            if _classifier is None:
+                _classifier = TextClassifier.load()
+    return _classifier
+
+
+def classifier_status() -> Dict[str, Any]:
+    if _classifier is None:
+        return {"loaded": False, "loading": cold_start["load_requested_at"] is not None, "model_path": TEXTCNN_MODEL_PATH}
+    return {
+        "loaded": True,
+        "model_path": TEXTCNN_MODEL_PATH,
+        "tokenizer": TEXTCNN_TOKENIZER,
+        "variant": _classifier.variant,
+        "num_classes": len(_classifier.labels),
+        "load_seconds": round(_classifier.load_seconds, 3),
+        "first_classification_seconds": cold_start["first_classification_seconds"],
+        "torch_threads": torch.get_num_threads(),
+        "batching": classify_batcher.snapshot(),
+    }
+
+
+async def predict_text(text: str, top_k: int = TEXTCNN_TOP_K) -> List[Dict[str, Any]]:
+    """分類單一文本；同時到達的請求由 classify_batcher 合併成一次前向運算"""
+    result = await classify_batcher.submit((text, top_k))
+    _record_first_classification()
+    return result
+
+
+def _record_first_classification() -> None:
+    if cold_start["first_classification_seconds"] is None and cold_start["load_requested_at"] is not None:
+        seconds = time.perf_counter() - cold_start["load_requested_at"]
+        cold_start["first_classification_seconds"] = round(seconds, 3)
+        print(f"⏱️ TextCNN 冷啟動：{seconds:.2f}s 後完成第一次分類")
+
+
+async def warm_up_classifier() -> None:
+    """背景暖機：載入模型並跑一次分類（在推論執行緒中，不阻塞啟動與其他請求）"""
+    try:
+        await predict_text(WARMUP_TEXT, 1)
+    except Exception as e:
+        print(f"⚠️ TextCNN 暖機失敗，將在首次請求時重試：{e}")
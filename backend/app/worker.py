@@ -0,0 +1,31 @@
+"""
+推播工作佇列 worker 入口
+
+獨立執行：python worker.py（可部署為 Cloud Run Job 或常駐服務）；
+也可在 API 服務中設定 RUN_JOB_WORKER=1，由 main.py 啟動背景執行緒。
+"""
+import signal
+import threading
+from dotenv import load_dotenv
+
+# 載入環境變數
+load_dotenv()
+
+from job_queue import run_worker
+from jobs import JOB_HANDLERS
+
+
+def main():
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        print(f"收到訊號 {signum}，完成目前工作後結束...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    run_worker(JOB_HANDLERS, stop_event)
+
+
+if __name__ == "__main__":
+    main()
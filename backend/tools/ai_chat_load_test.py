@@ -0,0 +1,86 @@
+"""
+/ai/chat 壓力測試
+
+同時送出多個聊天請求，統計 requests/sec 與延遲分位數。搭配 mock_openai_server.py
+使用時可看出同步 SDK（一次只能處理一個請求）與 AsyncOpenAI 的差異。
+
+用法：
+    python tools/mock_openai_server.py --latency 5 &
+    OPENAI_BASE_URL=http://localhost:9000/v1 OPENAI_API_KEY=mock uvicorn main:app --app-dir app --port 8080 &
+    python tools/ai_chat_load_test.py --url http://localhost:8080/ai/chat --concurrency 100 --requests 300
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+
+async def send_chat(client, url, index, distinct_users):
+    payload = {
+        "user_message": f"請幫我解釋牛頓第一定律（第 {index} 題）",
+        "subject": "物理",
+        "chapter": "力學",
+        "user_id": f"load_user_{index % distinct_users}",
+    }
+    started = time.perf_counter()
+    try:
+        response = await client.post(url, json=payload)
+        status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - started
+
+
+async def run(url, total, concurrency, distinct_users, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker(index):
+            async with semaphore:
+                return await send_chat(client, url, index, distinct_users)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(worker(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/ai/chat 壓力測試")
+    parser.add_argument("--url", default="http://localhost:8080/ai/chat")
+    parser.add_argument("--requests", type=int, default=300, help="總請求數")
+    parser.add_argument("--concurrency", type=int, default=100, help="同時進行的請求數")
+    parser.add_argument("--users", type=int, default=100, help="模擬的不同用戶數（影響單一用戶併發上限）")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    results, elapsed = asyncio.run(run(args.url, args.requests, args.concurrency, args.users, args.timeout))
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    ok_latencies = [latency for status, latency in results if status == 200]
+
+    print(f"總請求：{len(results)}，併發：{args.concurrency}，耗時：{elapsed:.2f} 秒")
+    print(f"吞吐量：{len(results) / elapsed:.2f} requests/sec（成功 {len(ok_latencies) / elapsed:.2f}/sec）")
+    print(f"狀態碼分布：{statuses}")
+    if ok_latencies:
+        print(
+            f"延遲（成功請求）：平均 {statistics.mean(ok_latencies):.2f}s，"
+            f"p50 {percentile(ok_latencies, 50):.2f}s，p95 {percentile(ok_latencies, 95):.2f}s，"
+            f"p99 {percentile(ok_latencies, 99):.2f}s，最大 {max(ok_latencies):.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+TextCNN 模型匯出與量化
+
+把 best_textcnn.pt（state dict）匯出為 TorchScript（textcnn.ts.pt）與動態量化的
+int8 版本（textcnn.int8.ts.pt，Embedding 權重與 Linear 皆量化為 8-bit），放在檢查點
+同目錄，app/text_classifier.py 載入時會優先使用；同時把 tokenizer 詞彙檔存到
+tokenizer/ 子目錄，服務啟動時不必連 Hugging Face Hub。匯出後以題庫題目作為保留樣本，
+比較與 eager 模型的 top-1 一致率與機率誤差；一致率低於門檻的檔案會被刪除，
+服務不會載入未通過檢查的版本。
+
+用法：
+    python tools/export_textcnn.py --model-path app/models/best_textcnn.pt --limit 1000
+
+backend/Dockerfile 在建置映像檔時執行同一指令，一致率未達門檻時建置失敗。
+"""
+import argparse
+import csv
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import torch  # noqa: E402
+import torch.nn as nn  # noqa: E402
+from torch.ao.quantization import default_dynamic_qconfig, float_qparams_weight_only_qconfig, quantize_dynamic  # noqa: E402
+from text_classifier import (  # noqa: E402
+    TEXTCNN_MODEL_PATH,
+    TEXTCNN_TOKENIZER_HUB_NAME,
+    TextClassifier,
+    artifact_path,
+    load_eager_model,
+    load_scripted_model,
+    load_tokenizer,
+    model_min_length,
+    save_scripted_model,
+    tokenizer_dir,
+)
+
+AGENT_PROCESSING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent", "processing")
+DEFAULT_SAMPLE_FILES = [
+    os.path.join(AGENT_PROCESSING_DIR, "high_chem_qbank.csv"),
+    os.path.join(AGENT_PROCESSING_DIR, "jun_公民_qbank.csv"),
+]
+
+
+def load_samples(paths, limit):
+    """讀取保留樣本：題庫 CSV 取 ques_detl 欄位，其他檔案一行一筆"""
+    texts = []
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"⚠️ 找不到樣本檔：{path}")
+            continue
+        with open(path, encoding="utf-8-sig") as f:
+            if path.endswith(".csv"):
+                texts.extend(row["ques_detl"] for row in csv.DictReader(f) if row.get("ques_detl"))
+            else:
+                texts.extend(line.strip() for line in f if line.strip())
+    return texts[:limit]
+
+
+def quantize_int8(model):
+    """動態量化：Embedding 權重 8-bit（佔模型大部分大小），Linear 權重與運算 int8"""
+    return quantize_dynamic(
+        model,
+        qconfig_spec={
+            nn.Embedding: float_qparams_weight_only_qconfig,
+            nn.Linear: default_dynamic_qconfig,
+        },
+        dtype=torch.qint8,
+    )
+
+
+def evaluate(reference, candidate, texts, batch_size):
+    """回傳 (top-1 一致率, 最大機率誤差, 每批平均耗時 ms)"""
+    agree = 0
+    max_diff = 0.0
+    timings = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        expected = reference.predict_proba(batch)
+        t0 = time.perf_counter()
+        actual = candidate.predict_proba(batch)
+        timings.append(time.perf_counter() - t0)
+        agree += (expected.argmax(dim=1) == actual.argmax(dim=1)).sum().item()
+        max_diff = max(max_diff, (expected - actual).abs().max().item())
+    return agree / len(texts), max_diff, statistics.mean(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TextCNN 模型匯出與量化")
+    parser.add_argument("--model-path", default=TEXTCNN_MODEL_PATH)
+    parser.add_argument("--samples", nargs="+", default=DEFAULT_SAMPLE_FILES, help="保留樣本（題庫 CSV 或純文字檔）")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="top-1 一致率門檻")
+    parser.add_argument("--skip-int8", action="store_true")
+    args = parser.parse_args()
+
+    texts = load_samples(args.samples, args.limit)
+    if not texts:
+        sys.exit("❌ 沒有可用的保留樣本")
+
+    vendored_dir = tokenizer_dir(args.model_path)
+    if os.path.isdir(vendored_dir):
+        tokenizer = load_tokenizer(vendored_dir)
+    else:
+        tokenizer = load_tokenizer(TEXTCNN_TOKENIZER_HUB_NAME)
+        tokenizer.save_pretrained(vendored_dir)
+        print(f"已將 tokenizer 詞彙檔存到 {vendored_dir}")
+    model, labels = load_eager_model(args.model_path)
+    min_length = model_min_length(model)
+    reference = TextClassifier(model, tokenizer, labels, min_length, "eager")
+
+    variants = {"torchscript": model}
+    if not args.skip_int8:
+        variants["int8"] = quantize_int8(model)
+
+    _, _, eager_ms = evaluate(reference, reference, texts, args.batch_size)
+    print(f"樣本數：{len(texts)}")
+    print(f"{'variant':<12} {'size(MB)':>9} {'agreement':>10} {'max|Δp|':>9} {'batch(ms)':>10}")
+    print(f"{'eager':<12} {os.path.getsize(args.model_path) / 2**20:>9.1f} {1:>10.4f} {0:>9.5f} {eager_ms:>10.2f}")
+
+    failed = False
+    for variant, variant_model in variants.items():
+        path = artifact_path(args.model_path, variant)
+        save_scripted_model(variant_model, path, labels, min_length)
+        scripted, _, _ = load_scripted_model(path)
+        candidate = TextClassifier(scripted, tokenizer, labels, min_length, variant)
+        agreement, max_diff, batch_ms = evaluate(reference, candidate, texts, args.batch_size)
+        print(f"{variant:<12} {os.path.getsize(path) / 2**20:>9.1f} {agreement:>10.4f} {max_diff:>9.5f} {batch_ms:>10.2f}")
+        if agreement < args.min_agreement:
+            os.remove(path)
+            failed = True
+            print(f"❌ {variant} 一致率低於 {args.min_agreement}，已刪除 {path}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+圖片前處理基準測試
+
+對指定的圖片（或資料夾內所有圖片）執行 app/image_preprocess.py 的前處理，輸出前後
+位元組數、解析度與耗時；未指定時以隨機雜訊產生一張 4032x3024 的模擬手機照片。
+
+用法：
+    python tools/image_preprocess_benchmark.py ~/Desktop/Screenshots --max-side 1024 --format WEBP
+"""
+import argparse
+import os
+import statistics
+import sys
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from PIL import Image  # noqa: E402
+from image_preprocess import preprocess_image  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".bmp")
+
+
+def synthetic_photo():
+    img = Image.effect_noise((4032, 3024), 64).convert("RGB")
+    output = BytesIO()
+    img.save(output, format="JPEG", quality=92)
+    return "synthetic_4032x3024.jpg", output.getvalue()
+
+
+def load_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    with open(os.path.join(path, name), "rb") as f:
+                        yield name, f.read()
+        else:
+            with open(path, "rb") as f:
+                yield os.path.basename(path), f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="圖片前處理基準測試")
+    parser.add_argument("paths", nargs="*", help="圖片檔或資料夾")
+    parser.add_argument("--max-side", type=int, default=1024)
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "WEBP"])
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--repeat", type=int, default=5, help="每張圖重複次數（取中位數耗時）")
+    args = parser.parse_args()
+
+    images = list(load_images(args.paths)) if args.paths else [synthetic_photo()]
+    total_in = total_out = 0
+    print(f"{'檔名':<32} {'原始':>14} {'處理後':>14} {'縮減':>7} {'耗時(ms)':>9}")
+    for name, raw in images:
+        timings = []
+        for _ in range(args.repeat):
+            result = preprocess_image(raw, max_side=args.max_side, image_format=args.format, quality=args.quality)
+            timings.append(result.elapsed_ms)
+        total_in += result.original_bytes
+        total_out += result.processed_bytes
+        print(
+            f"{name[:32]:<32} {result.original_bytes / 1024:>8.0f}KB {str(result.original_size):>5} "
+            f"{result.processed_bytes / 1024:>8.0f}KB {str(result.processed_size):>5} "
+            f"{1 - result.processed_bytes / result.original_bytes:>6.1%} {statistics.median(timings):>9.1f}"
+        )
+
+    if total_in:
+        print(f"\n合計：{total_in / 1024:.0f}KB → {total_out / 1024:.0f}KB（縮減 {1 - total_out / total_in:.1%}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+本地 OpenAI 相容 mock server
+
+模擬 /v1/chat/completions 的延遲與回應格式，讓 /ai 端點可以在沒有網路、不花費
+token 的情況下做功能與壓力測試。
+
+用法：
+    python tools/mock_openai_server.py --port 9000 --latency 5 --error-rate 0.05
+    OPENAI_BASE_URL=http://localhost:9000/v1 OPENAI_API_KEY=mock uvicorn main:app --app-dir app
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Mock OpenAI")
+
+settings = {
+    "latency": 5.0,
+    "jitter": 0.5,
+    "error_rate": 0.0,
+    "reply": "這是 mock server 的回覆，用於測試 **AI 解題** 功能。",
+}
+
+
+def completion_payload(model, content):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 100, "completion_tokens": len(content), "total_tokens": 100 + len(content)},
+    }
+
+
+def chunk_payload(chunk_id, model, delta, finish_reason=None):
+    return {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4o")
+
+    if random.random() < settings["error_rate"]:
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+        )
+
+    latency = max(0.0, random.gauss(settings["latency"], settings["jitter"]))
+
+    if body.get("stream"):
+        async def event_stream():
+            chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+            tokens = list(settings["reply"])
+            # 首個 token 前等待約 1/5 延遲，其餘平均分布
+            await asyncio.sleep(latency / 5)
+            per_token = (latency * 4 / 5) / max(1, len(tokens))
+            for token in tokens:
+                yield f"data: {json.dumps(chunk_payload(chunk_id, model, {'content': token}), ensure_ascii=False)}\n\n"
+                await asyncio.sleep(per_token)
+            yield f"data: {json.dumps(chunk_payload(chunk_id, model, {}, 'stop'))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    await asyncio.sleep(latency)
+    return completion_payload(model, settings["reply"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 相容 mock server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=5.0, help="平均回應秒數")
+    parser.add_argument("--jitter", type=float, default=0.5, help="回應秒數標準差")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回傳 429 的機率")
+    args = parser.parse_args()
+
+    settings.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
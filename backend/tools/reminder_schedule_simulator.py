@@ -0,0 +1,83 @@
+"""
+學習提醒排程模擬器
+
+以合成用戶（依設定的習慣讀書時段分布）比較「Cron 觸發時一次全部發送」與
+時間輪分散發送的每分鐘發送量，輸出每分鐘直方圖與峰值統計。
+
+用法：
+    python tools/reminder_schedule_simulator.py --users 50000 --max-per-minute 200 --start 20:00
+"""
+import argparse
+import os
+import random
+import sys
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from reminder_schedule import LOCAL_TZ, ReminderWheel  # noqa: E402
+
+# 學生常見的讀書時段權重（台北時間，小時 → 權重）
+STUDY_HOUR_WEIGHTS = {
+    7: 2, 12: 3, 13: 2, 17: 4, 18: 6, 19: 10, 20: 14, 21: 16, 22: 12, 23: 5,
+}
+
+
+def synthetic_users(count, no_history_ratio, seed):
+    rng = random.Random(seed)
+    hours = list(STUDY_HOUR_WEIGHTS)
+    weights = list(STUDY_HOUR_WEIGHTS.values())
+    for i in range(count):
+        study_hour = None if rng.random() < no_history_ratio else rng.choices(hours, weights)[0]
+        yield f"user_{i:07d}", study_hour
+
+
+def print_histogram(title, per_minute, start, bucket_minutes, width=60):
+    print(f"\n=== {title} ===")
+    if not per_minute:
+        print("（無發送）")
+        return
+    buckets = Counter()
+    for offset, count in per_minute.items():
+        buckets[offset // bucket_minutes] += count
+    peak_bucket = max(buckets.values())
+    for bucket in sorted(buckets):
+        label = datetime.fromtimestamp(start.timestamp() + bucket * bucket_minutes * 60, tz=LOCAL_TZ).strftime("%H:%M")
+        bar = "#" * max(1, round(buckets[bucket] / peak_bucket * width))
+        print(f"{label} {buckets[bucket]:>7} {bar}")
+    total = sum(per_minute.values())
+    active = len(per_minute)
+    print(f"總發送 {total}，有發送的分鐘 {active}，每分鐘峰值 {max(per_minute.values())}，"
+          f"平均 {total / active:.1f}/分鐘")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="學習提醒排程模擬器")
+    parser.add_argument("--users", type=int, default=50000, help="符合提醒資格的 token 數")
+    parser.add_argument("--no-history-ratio", type=float, default=0.2, help="沒有答題紀錄的用戶比例")
+    parser.add_argument("--max-per-minute", type=int, default=200, help="時間輪每分鐘上限")
+    parser.add_argument("--window", type=int, default=24 * 60, help="發送視窗（分鐘）")
+    parser.add_argument("--start", default="20:00", help="Cron 觸發時間（台北時間 HH:MM）")
+    parser.add_argument("--bucket", type=int, default=15, help="直方圖每列彙總的分鐘數")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    hour, minute = map(int, args.start.split(":"))
+    start = datetime.now(LOCAL_TZ).replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    wheel = ReminderWheel(start=start, window_minutes=args.window, max_per_minute=args.max_per_minute)
+    for user_id, study_hour in synthetic_users(args.users, args.no_history_ratio, args.seed):
+        wheel.place(user_id, study_hour)
+
+    print_histogram("一次全部發送（原本行為）", {0: args.users}, start, args.bucket)
+    print_histogram("時間輪分散發送", wheel.histogram(), start, args.bucket)
+
+    # 每分鐘明細（僅列出前 20 個最繁忙的分鐘）
+    print("\n最繁忙的 20 分鐘：")
+    for offset, count in sorted(wheel.histogram().items(), key=lambda item: -item[1])[:20]:
+        print(f"  {wheel.send_time(offset).astimezone(LOCAL_TZ).strftime('%H:%M')}  {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+TextCNN 微批次基準測試
+
+以固定併發數送出分類請求，比較不同批次等待時間（batch window）下的吞吐量、延遲
+分位數與平均批次大小。window=0 且 max-batch=1 相當於每個請求各做一次前向運算。
+
+用法：
+    TEXTCNN_MODEL_PATH=../best_textcnn.pt python tools/textcnn_batching_benchmark.py --concurrency 64 --windows 0 2 5 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from micro_batcher import MicroBatcher  # noqa: E402
+from text_classifier import TextClassifier  # noqa: E402
+from textcnn_benchmark import SAMPLE_TEXTS, percentile  # noqa: E402
+
+
+async def run(classifier, window_ms, max_batch_size, total, concurrency):
+    executor = ThreadPoolExecutor(max_workers=1)
+    batcher = MicroBatcher(classifier.classify_requests, max_batch_size=max_batch_size, max_wait_ms=window_ms, executor=executor)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def request(index):
+        async with semaphore:
+            started = time.perf_counter()
+            await batcher.submit((SAMPLE_TEXTS[index % len(SAMPLE_TEXTS)], 3))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    stats = batcher.snapshot()
+    await batcher.close()
+    executor.shutdown()
+    return total / elapsed, latencies, stats["avg_batch_size"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TextCNN 微批次基準測試")
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10], help="批次等待時間（毫秒）")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    classifier = TextClassifier.load()
+    print(f"{'window(ms)':>10} {'max_batch':>9} {'req/s':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'mean(ms)':>9} {'avg_batch':>9}")
+    configs = [(0, 1)] + [(window, args.max_batch) for window in args.windows]
+    for window_ms, max_batch_size in configs:
+        throughput, latencies, avg_batch = asyncio.run(
+            run(classifier, window_ms, max_batch_size, args.requests, args.concurrency)
+        )
+        print(
+            f"{window_ms:>10g} {max_batch_size:>9} {throughput:>9.1f} {percentile(latencies, 50) * 1000:>9.2f} "
+            f"{percentile(latencies, 95) * 1000:>9.2f} {statistics.mean(latencies) * 1000:>9.2f} {avg_batch:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+TextCNN 推論基準測試（CPU）
+
+直接載入 app/text_classifier.py 的模型，依不同 torch 執行緒數與批次大小量測
+單筆延遲分位數與每秒處理文本數。
+
+用法：
+    TEXTCNN_MODEL_PATH=../best_textcnn.pt python tools/textcnn_benchmark.py --threads 1 2 4 --batch-sizes 1 8 32
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import torch  # noqa: E402
+from text_classifier import TextClassifier  # noqa: E402
+
+SAMPLE_TEXTS = [
+    "二次函數的頂點公式是什麼？在座標平面上，二次函數圖形的頂點代表什麼意義？",
+    "三角函數的基本性質有哪些？正弦和餘弦函數的關係是什麼？",
+    "因式分解的基本方法有哪些？如何用十字相乘法進行因式分解？",
+    "人體器官有哪些？",
+    "解一元二次方程式 x² - 5x + 6 = 0",
+    "酸鹼中和反應後溶液的 pH 值如何變化？",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+def run(classifier, batch_size, iterations, warmup):
+    texts = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] for i in range(batch_size)]
+    for _ in range(warmup):
+        classifier.classify(texts)
+
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        classifier.classify(texts)
+        timings.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return timings, iterations * batch_size / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TextCNN 推論基準測試")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="torch intra-op 執行緒數")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    args = parser.parse_args()
+
+    classifier = TextClassifier.load()
+    print(f"模型載入耗時：{classifier.load_seconds:.2f}s\n")
+    print(f"{'threads':>7} {'batch':>5} {'p50(ms)':>9} {'p95(ms)':>9} {'mean(ms)':>9} {'texts/s':>9}")
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_sizes:
+            timings, throughput = run(classifier, batch_size, args.iterations, args.warmup)
+            print(
+                f"{threads:>7} {batch_size:>5} {percentile(timings, 50) * 1000:>9.2f} "
+                f"{percentile(timings, 95) * 1000:>9.2f} {statistics.mean(timings) * 1000:>9.2f} {throughput:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+TextCNN 冷啟動量測
+
+每個模型版本各啟動一個全新的 Python 程序，量測 import（含 torch）、載入模型與
+tokenizer、第一次分類各花多少時間，以及程序從啟動到第一次分類成功的總時間與最大
+常駐記憶體。模擬 Cloud Run 新執行個體接到第一個分類請求的情況。
+
+用法：
+    TEXTCNN_MODEL_PATH=app/models/best_textcnn.pt python tools/textcnn_cold_start.py --variants eager torchscript int8 --runs 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+CHILD_SCRIPT = r"""
+import json, resource, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import text_classifier
+imported = time.perf_counter()
+classifier = text_classifier.TextClassifier.load(variant=sys.argv[2])
+loaded = time.perf_counter()
+classifier.classify([text_classifier.WARMUP_TEXT], 1)
+classified = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "load_s": loaded - imported,
+    "first_classify_s": classified - loaded,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def measure(variant):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, APP_DIR, variant],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_total_s"] = time.perf_counter() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TextCNN 冷啟動量測")
+    parser.add_argument("--variants", nargs="+", default=["eager", "torchscript", "int8"])
+    parser.add_argument("--runs", type=int, default=3, help="每個版本重複次數（取中位數）")
+    args = parser.parse_args()
+
+    columns = ["import_s", "load_s", "first_classify_s", "process_total_s", "max_rss_mb"]
+    print(f"{'variant':<12} " + " ".join(f"{column:>16}" for column in columns))
+    for variant in args.variants:
+        try:
+            runs = [measure(variant) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"{variant:<12} 失敗：{e.stderr.strip().splitlines()[-1] if e.stderr else e}")
+            continue
+        print(f"{variant:<12} " + " ".join(
+            f"{statistics.median(run[column] for run in runs):>16.3f}" for column in columns
+        ))
+
+
+if __name__ == "__main__":
+    main()